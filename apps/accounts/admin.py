@@ -4,7 +4,8 @@ Admin interface for User management
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.utils.html import format_html
-from .models import User, UserProfile
+from apps.core.search import IndexedSearchMixin
+from .models import Department, User, UserProfile
 
 
 class UserProfileInline(admin.StackedInline):
@@ -16,15 +17,27 @@ class UserProfileInline(admin.StackedInline):
               'date_of_birth', 'gender', 'emergency_contact', 'emergency_phone', 'notes')
 
 
+@admin.register(Department)
+class DepartmentAdmin(admin.ModelAdmin):
+    """Department Admin"""
+    list_display = ('name', 'code', 'parent', 'is_active', 'created_at')
+    list_filter = ('is_active',)
+    search_fields = ('name', 'code')
+    list_select_related = ('parent',)
+    autocomplete_fields = ('parent',)
+
+
 @admin.register(User)
-class UserAdmin(BaseUserAdmin):
+class UserAdmin(IndexedSearchMixin, BaseUserAdmin):
     """Custom User Admin"""
     inlines = (UserProfileInline,)
     
     list_display = ('username', 'email', 'employee_id', 'role_badge', 'department', 
                     'is_active_badge', 'created_at')
     list_filter = ('role', 'is_active', 'is_staff', 'department', 'created_at')
-    search_fields = ('username', 'email', 'employee_id', 'first_name', 'last_name', 'department')
+    search_fields = ('username', 'email', 'employee_id', 'first_name', 'last_name', 'department__name')
+    list_select_related = ('department',)
+    autocomplete_fields = ('department',)
     ordering = ('-created_at',)
     
     fieldsets = (
@@ -77,7 +90,7 @@ class UserAdmin(BaseUserAdmin):
 
 
 @admin.register(UserProfile)
-class UserProfileAdmin(admin.ModelAdmin):
+class UserProfileAdmin(IndexedSearchMixin, admin.ModelAdmin):
     """User Profile Admin"""
     list_display = ('user', 'city', 'country', 'date_of_birth', 'gender')
     search_fields = ('user__username', 'user__email', 'city', 'country')
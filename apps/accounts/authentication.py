@@ -0,0 +1,97 @@
+"""
+Cached token authentication for the REST API
+
+Token -> user id and user id -> (role, department, is_active, ...) are
+kept in a short-lived in-process cache backed by the shared cache, so the
+common authenticated request costs no database queries. Entries are
+dropped when a token is deleted (logout) or the user is saved (password
+change, activation, role or department edits). Other workers may keep a
+stale in-process entry for at most AUTH_CACHE_LOCAL_TTL seconds.
+"""
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from apps.core.cache import LocalCache
+from .models import User
+
+# Fields available without a query; anything else is loaded on access.
+# Kept in model field order, as Model.from_db() expects.
+AUTH_FIELDS = tuple(
+    field.attname for field in User._meta.concrete_fields
+    if field.attname in ('id', 'username', 'email', 'first_name', 'last_name', 'employee_id',
+                         'role', 'department_id', 'is_active', 'is_staff', 'is_superuser')
+)
+
+_local = LocalCache(maxsize=10000, ttl=settings.AUTH_CACHE_LOCAL_TTL)
+
+
+def _token_key(key):
+    # Never use raw tokens as cache keys
+    return 'auth:token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def _user_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def _cached(key):
+    value = _local.get(key)
+    if value is None:
+        value = cache.get(key)
+        if value is not None:
+            _local.set(key, value)
+    return value
+
+
+def _store(key, value):
+    _local.set(key, value)
+    cache.set(key, value, timeout=settings.AUTH_CACHE_TTL)
+
+
+def _user_values(user):
+    return tuple(getattr(user, field) for field in AUTH_FIELDS)
+
+
+def _build_user(values):
+    """Build a User from cached values; other fields load lazily"""
+    return User.from_db('default', AUTH_FIELDS, values)
+
+
+def invalidate_token(key):
+    """Forget a token (e.g. on logout)"""
+    _local.delete(_token_key(key))
+    cache.delete(_token_key(key))
+
+
+def invalidate_user(user_id):
+    """Forget cached user data (role, department, active flag...)"""
+    _local.delete(_user_key(user_id))
+    cache.delete(_user_key(user_id))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication that skips the database on cache hits"""
+
+    def authenticate_credentials(self, key):
+        user_id = _cached(_token_key(key))
+        values = _cached(_user_key(user_id)) if user_id is not None else None
+
+        if values is None:
+            try:
+                token = Token.objects.select_related('user').get(key=key)
+            except Token.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            user_id = token.user_id
+            values = _user_values(token.user)
+            _store(_token_key(key), user_id)
+            _store(_user_key(user_id), values)
+
+        user = _build_user(values)
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        return (user, Token(key=key, user_id=user_id))
@@ -0,0 +1,61 @@
+"""
+Cached department tree and manager scoping
+
+The whole department table is small, so it is cached as a list of rows
+and subtrees are computed in memory. The cache is dropped whenever a
+department is saved or deleted.
+"""
+from django.core.cache import cache
+from apps.core.cache import LocalCache
+from .models import Department
+
+CACHE_KEY = 'departments:tree'
+CACHE_TIMEOUT = 60 * 60
+LOCAL_TTL = 30
+
+_local = LocalCache(maxsize=1, ttl=LOCAL_TTL)
+
+
+def get_departments():
+    """All departments as dicts, from cache"""
+    rows = _local.get(CACHE_KEY)
+    if rows is None:
+        rows = cache.get(CACHE_KEY)
+        if rows is None:
+            rows = list(Department.objects.values(
+                'id', 'code', 'name', 'parent_id', 'is_active'
+            ).order_by('name'))
+            cache.set(CACHE_KEY, rows, timeout=CACHE_TIMEOUT)
+        _local.set(CACHE_KEY, rows)
+    return rows
+
+
+def invalidate():
+    """Forget the cached tree"""
+    _local.clear()
+    cache.delete(CACHE_KEY)
+
+
+def get_subtree_ids(department_id):
+    """Ids of a department and all its descendants"""
+    if department_id is None:
+        return []
+
+    children = {}
+    for row in get_departments():
+        children.setdefault(row['parent_id'], []).append(row['id'])
+
+    ids = []
+    pending = [department_id]
+    while pending:
+        current = pending.pop()
+        if current in ids:
+            continue  # guard against cycles
+        ids.append(current)
+        pending.extend(children.get(current, []))
+    return ids
+
+
+def visible_department_ids(user):
+    """Departments a manager may see: their own and everything below it"""
+    return get_subtree_ids(user.department_id)
@@ -0,0 +1,272 @@
+"""
+Bulk employee import from CSV or XLSX files
+
+Creating employees through the users API costs a request, a profile
+get_or_create and a password hash each. Here the file is read row by row
+(XLSX in openpyxl's read-only mode) and every row is validated first,
+uniqueness in a few set-based queries. Valid rows are then created in
+batches of BATCH_SIZE with one bulk insert per table: users, profiles
+and, when devices are given, DeviceUser mappings with a USERINFO command
+per employee and device. Invalid rows are reported by row number and
+skipped; a batch the database rejects is retried row by row.
+
+The header row names the columns: User and UserProfile fields, plus
+department (code or name), password, pin (device PIN, defaults to
+employee_id) and card. Rows without a password, and device users, get an
+unusable password instead of a hash; an admin sets one if they need to
+log in. bulk_create sends no signals, so what the signal handlers keep
+up to date (dashboard counters, PIN cache, site database copies) is
+updated here.
+"""
+import csv
+import io
+import logging
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.db import InterfaceError, OperationalError, models, transaction
+from apps.core import sharding, stats
+from apps.devices.command_queue import queue_commands
+from apps.devices.models import DeviceUser
+from apps.devices.protocol import format_userinfo
+from apps.devices.resolver import resolver
+from .models import Department, User, UserProfile
+
+logger = logging.getLogger(__name__)
+
+USER_FIELDS = ('username', 'employee_id', 'email', 'first_name', 'last_name', 'phone', 'role', 'is_active')
+PROFILE_FIELDS = ('address', 'city', 'state', 'postal_code', 'country', 'date_of_birth', 'gender',
+                  'emergency_contact', 'emergency_phone', 'notes')
+COLUMNS = USER_FIELDS + PROFILE_FIELDS + ('department', 'password', 'pin', 'card')
+BATCH_SIZE = 1000
+LOOKUP_SIZE = 1000  # values per IN (...) lookup
+NAME_LENGTH = 24  # longest name devices store
+
+
+class Row:
+    """One employee of the file"""
+
+    def __init__(self, number):
+        self.number = number
+        self.user = {}
+        self.profile = {}
+        self.department_id = None
+        self.password = ''
+        self.pin = ''
+        self.card = ''
+        self.errors = {}
+
+    def error(self, field, message):
+        self.errors.setdefault(field, []).append(message)
+
+
+def read_rows(f, name):
+    """Yield (row number, {column: value}) for the data rows of an uploaded file"""
+    rows = _xlsx_rows(f) if name.lower().endswith('.xlsx') else csv.reader(
+        io.TextIOWrapper(f, encoding='utf-8-sig', errors='replace', newline='')
+    )
+    header = None
+    for number, values in enumerate(rows, start=1):
+        if header is None:
+            header = [_text(value).lower() for value in values]
+            unknown = [column for column in header if column and column not in COLUMNS]
+            if unknown:
+                raise ValueError(f'Unknown columns: {", ".join(unknown)}')
+            if 'username' not in header and 'employee_id' not in header:
+                raise ValueError('The header needs a username or employee_id column')
+            continue
+        if any(_text(value) for value in values):
+            yield number, {column: value for column, value in zip(header, values) if column}
+    if header is None:
+        raise ValueError('The file is empty')
+
+
+def _xlsx_rows(f):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ValueError('Reading XLSX files requires openpyxl; upload a CSV file instead')
+    workbook = load_workbook(f, read_only=True, data_only=True)
+    try:
+        yield from workbook.worksheets[0].iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def _text(value):
+    """Cell value as text; spreadsheets turn employee ids into floats"""
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _clean(field, value):
+    """Validate a cell against a model field; empty cells take the field's default"""
+    if value is None or isinstance(value, str) and not value.strip():
+        if field.has_default():
+            return field.get_default()
+        value = None if field.null else ''
+    elif isinstance(field, (models.CharField, models.TextField)) or isinstance(value, str):
+        value = _text(value)
+    return field.clean(value, None)
+
+
+def parse_row(number, data, departments):
+    row = Row(number)
+    if not _text(data.get('username')):
+        data['username'] = data.get('employee_id')  # employee ids double as usernames
+    for name, model, target in (
+        *((name, User, row.user) for name in USER_FIELDS),
+        *((name, UserProfile, row.profile) for name in PROFILE_FIELDS),
+    ):
+        if name not in data and name != 'username':
+            continue
+        try:
+            target[name] = _clean(model._meta.get_field(name), data.get(name))
+        except ValidationError as e:
+            for message in e.messages:
+                row.error(name, message)
+
+    department = _text(data.get('department'))
+    if department:
+        row.department_id = departments.get(department)
+        if row.department_id is None:
+            row.error('department', f'Unknown department "{department}".')
+    row.password = _text(data.get('password'))
+    row.pin = _text(data.get('pin')) or row.user.get('employee_id') or ''
+    row.card = _text(data.get('card'))
+    return row
+
+
+def _department_lookup():
+    """Department ids by code, then by name"""
+    lookup = {}
+    rows = list(Department.objects.values_list('id', 'code', 'name'))
+    for department_id, _, name in rows:
+        lookup.setdefault(name, department_id)
+    for department_id, code, _ in rows:
+        if code:
+            lookup[code] = department_id
+    return lookup
+
+
+def _existing(queryset, field, values):
+    """The values already taken in the database, in batched lookups"""
+    values = sorted(values)
+    taken = set()
+    for start in range(0, len(values), LOOKUP_SIZE):
+        taken.update(queryset.filter(**{f'{field}__in': values[start:start + LOOKUP_SIZE]})
+                     .values_list(field, flat=True))
+    return taken
+
+
+def validate(rows, devices):
+    """Add duplicate and uniqueness errors to parsed rows"""
+    checks = [('username', lambda row: row.user.get('username'),
+               _existing(User.objects, 'username', {row.user.get('username') for row in rows} - {None, ''})),
+              ('employee_id', lambda row: row.user.get('employee_id'),
+               _existing(User.objects, 'employee_id', {row.user.get('employee_id') for row in rows} - {None}))]
+    if devices:
+        for row in rows:
+            if not row.pin:
+                row.error('pin', 'A pin or employee_id is required to register on devices.')
+            elif len(row.pin) > DeviceUser._meta.get_field('device_user_id').max_length:
+                row.error('pin', 'Ensure this value has at most 50 characters.')
+        checks.append(('pin', lambda row: row.pin, _existing(
+            DeviceUser.objects.filter(device__in=devices), 'device_user_id', {row.pin for row in rows} - {''}
+        )))
+
+    for field, value_of, taken in checks:
+        first_row = {}
+        for row in rows:
+            value = value_of(row)
+            if value in (None, ''):
+                continue
+            if value in taken:
+                row.error(field, f'"{value}" is already in use.')
+            elif value in first_row:
+                row.error(field, f'"{value}" is also used by row {first_row[value]}.')
+            else:
+                first_row[value] = row.number
+
+
+def import_employees(rows, devices=(), dry_run=False, created_by=None):
+    """
+    Import employees from (row number, {column: value}) pairs, see read_rows()
+    devices: Device instances to register every employee on. Returns a
+    summary with the per-row errors.
+    """
+    departments = _department_lookup()
+    rows = [parse_row(number, data, departments) for number, data in rows]
+    validate(rows, devices)
+    valid = [row for row in rows if not row.errors]
+    summary = {'rows': len(rows), 'valid': len(valid), 'created': 0, 'device_users': 0, 'commands': 0,
+               'dry_run': dry_run, 'errors': []}
+    failed = {row.number: row.errors for row in rows if row.errors}
+
+    if not dry_run:
+        for start in range(0, len(valid), BATCH_SIZE):
+            batch = valid[start:start + BATCH_SIZE]
+            try:
+                _create(batch, devices, created_by, summary)
+            except (OperationalError, InterfaceError):
+                raise
+            except Exception as e:
+                # A row the checks could not catch (e.g. created meanwhile): store the rest one by one
+                logger.warning(f"Employee import batch failed, retrying per row: {str(e)}")
+                for row in batch:
+                    try:
+                        _create([row], devices, created_by, summary)
+                    except (OperationalError, InterfaceError):
+                        raise
+                    except Exception as error:
+                        failed[row.number] = {'non_field_errors': [str(error)]}
+        logger.info(f"Imported {summary['created']} of {len(rows)} employees")
+
+    summary['errors'] = [{'row': number, 'errors': errors} for number, errors in sorted(failed.items())]
+    return summary
+
+
+def _create(rows, devices, created_by, summary):
+    users = []
+    for row in rows:
+        user = User(**row.user, department_id=row.department_id)
+        # Hashing costs ~100ms per user: device staff never log in
+        user.password = make_password(row.password if row.password and user.role != 'device' else None)
+        users.append(user)
+
+    device_users = 0
+    with transaction.atomic():
+        User.objects.bulk_create(users)
+        if users[0].pk is None:  # backends that do not return ids from bulk inserts
+            ids = dict(User.objects.filter(username__in=[user.username for user in users])
+                       .values_list('username', 'id'))
+            for user in users:
+                user.pk = ids[user.username]
+        UserProfile.objects.bulk_create([UserProfile(user=user, **row.profile) for row, user in zip(rows, users)])
+        for device in devices:
+            DeviceUser.objects.bulk_create([
+                DeviceUser(device=device, user=user, device_user_id=row.pin, card_number=row.card)
+                for row, user in zip(rows, users)
+            ])
+            queue_commands(device, [
+                format_userinfo(row.pin, _device_name(user), card=row.card) for row, user in zip(rows, users)
+            ], created_by=created_by)
+            device_users += len(users)
+
+    stats.incr('total_users', sum(1 for user in users if user.is_active))
+    # bulk_create sends no post_save, so devices.signals cannot drop the
+    # "emp_<pin>" placeholder mappings of these PINs: do it here
+    resolver.invalidate_pins({user.employee_id for user in users} - {None})
+    for device in devices:
+        resolver.invalidate_device(device.id, [row.pin for row in rows])
+    if sharding.enabled():
+        sharding.mirror_many(users)
+    summary['created'] += len(users)
+    summary['device_users'] += device_users
+    summary['commands'] += device_users
+
+
+def _device_name(user):
+    return (f'{user.first_name} {user.last_name}'.strip() or user.username)[:NAME_LENGTH]
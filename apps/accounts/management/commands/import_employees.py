@@ -0,0 +1,42 @@
+"""
+Create employees from a CSV or XLSX file
+Every row is validated before anything is created; see accounts/imports.py
+for the columns.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from apps.accounts.imports import import_employees, read_rows
+from apps.devices.models import Device
+
+
+class Command(BaseCommand):
+    help = 'Bulk create employees from a CSV or XLSX file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='CSV or XLSX file with a header row')
+        parser.add_argument('--device', action='append', default=[],
+                            help='Serial number of a device to register the employees on (repeatable)')
+        parser.add_argument('--dry-run', action='store_true', help='Only validate the file')
+
+    def handle(self, *args, **options):
+        devices = list(Device.objects.filter(serial_number__in=options['device']))
+        unknown = set(options['device']) - {device.serial_number for device in devices}
+        if unknown:
+            raise CommandError(f'Unknown device: {", ".join(sorted(unknown))}')
+
+        try:
+            with open(options['file'], 'rb') as f:
+                summary = import_employees(read_rows(f, options['file']), devices=devices,
+                                           dry_run=options['dry_run'])
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        for error in summary['errors']:
+            messages = '; '.join(f'{field}: {" ".join(texts)}' for field, texts in error['errors'].items())
+            self.stdout.write(self.style.WARNING(f"Row {error['row']}: {messages}"))
+        if options['dry_run']:
+            self.stdout.write(f"{summary['valid']} of {summary['rows']} rows are valid.")
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"{summary['created']} of {summary['rows']} employees created, "
+                f"{summary['device_users']} device users, {summary['commands']} device commands queued."
+            ))
@@ -0,0 +1,108 @@
+"""
+Carry the free-text user departments over to the Department table
+
+users.department used to be text and is now a foreign key; the schema
+migration cannot cast "IT" to a department id. Run this command twice
+around that migration:
+1. before "migrate": the department text of every user is copied to a
+   holding table and the column is emptied, so the migration only
+   converts NULLs
+2. after "migrate": one Department is created per distinct text (or an
+   existing one with that name or code reused), every user gets its
+   department_id, and the holding table is dropped
+
+The command looks at the schema to tell which step is due, so running it
+again is harmless.
+"""
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from apps.accounts import departments
+from apps.accounts.authentication import invalidate_user
+from apps.accounts.models import Department, User
+
+HOLDING_TABLE = 'users_department_backfill'
+
+
+def _columns(table):
+    with connection.cursor() as cursor:
+        return {column.name for column in connection.introspection.get_table_description(cursor, table)}
+
+
+class Command(BaseCommand):
+    help = 'Convert free-text user departments to Department rows (run before and after migrate)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be done')
+
+    def handle(self, *args, **options):
+        table = User._meta.db_table
+        columns = _columns(table)
+        holding = HOLDING_TABLE in connection.introspection.table_names()
+        if holding and 'department_id' in columns:
+            self.backfill(table, options['dry_run'])
+        elif holding:
+            self.stdout.write('Department texts are saved; run "migrate", then this command again.')
+        elif 'department' in columns and 'department_id' not in columns:
+            self.save_texts(table, options['dry_run'])
+        else:
+            self.stdout.write('Nothing to do: users already reference departments.')
+
+    def save_texts(self, table, dry_run):
+        qn = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*), COUNT(DISTINCT TRIM({qn('department')})) FROM {qn(table)} "
+                           f"WHERE TRIM({qn('department')}) <> ''")
+            users, names = cursor.fetchone()
+        if dry_run:
+            self.stdout.write(f'{users} users in {names} departments would be saved.')
+            return
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"CREATE TABLE {qn(HOLDING_TABLE)} ({qn('user_id')} integer PRIMARY KEY, "
+                           f"{qn('department')} varchar(100) NOT NULL)")
+            cursor.execute(f"INSERT INTO {qn(HOLDING_TABLE)} ({qn('user_id')}, {qn('department')}) "
+                           f"SELECT {qn('id')}, TRIM({qn('department')}) FROM {qn(table)} "
+                           f"WHERE TRIM({qn('department')}) <> ''")
+            # Replace the NOT NULL text column by an empty nullable one the migration can convert
+            cursor.execute(f"ALTER TABLE {qn(table)} DROP COLUMN {qn('department')}")
+            cursor.execute(f"ALTER TABLE {qn(table)} ADD COLUMN {qn('department')} varchar(100) NULL")
+        self.stdout.write(self.style.SUCCESS(
+            f'Saved the departments of {users} users ({names} departments) in {HOLDING_TABLE}. '
+            f'Run "migrate", then this command again.'
+        ))
+
+    def backfill(self, table, dry_run):
+        qn = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT {qn('department')}, COUNT(*) FROM {qn(HOLDING_TABLE)} "
+                           f"GROUP BY {qn('department')}")
+            counts = dict(cursor.fetchall())
+        known = {}
+        for department in Department.objects.all():
+            known.setdefault(department.name, department)
+            if department.code:
+                known[department.code] = department
+        missing = sorted(name for name in counts if name not in known)
+        if dry_run:
+            self.stdout.write(f'{sum(counts.values())} users in {len(counts)} departments would be assigned, '
+                              f'{len(missing)} departments created.')
+            return
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            for name in missing:
+                known[name] = Department.objects.create(name=name)
+            for name in counts:
+                cursor.execute(f"UPDATE {qn(table)} SET {qn('department_id')} = %s WHERE {qn('id')} IN "
+                               f"(SELECT {qn('user_id')} FROM {qn(HOLDING_TABLE)} WHERE {qn('department')} = %s)",
+                               [known[name].id, name])
+            cursor.execute(f"SELECT {qn('user_id')} FROM {qn(HOLDING_TABLE)}")
+            user_ids = [user_id for user_id, in cursor.fetchall()]
+            cursor.execute(f"DROP TABLE {qn(HOLDING_TABLE)}")
+
+        # Raw updates send no signals: drop what the handlers would have
+        departments.invalidate()
+        for user_id in user_ids:
+            invalidate_user(user_id)
+        self.stdout.write(self.style.SUCCESS(
+            f'Assigned {len(user_ids)} users to {len(counts)} departments ({len(missing)} created). '
+            f'Run sync_site_databases if site databases are configured.'
+        ))
@@ -5,6 +5,28 @@ from django.contrib.auth.models import AbstractUser
 from django.db import models
 
 
+class Department(models.Model):
+    """
+    Organizational unit, optionally nested under a parent department
+    """
+    name = models.CharField(max_length=100)
+    code = models.CharField(max_length=20, unique=True, null=True, blank=True)
+    parent = models.ForeignKey('self', on_delete=models.SET_NULL, null=True,
+                               blank=True, related_name='children')
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'departments'
+        ordering = ['name']
+        verbose_name = 'Department'
+        verbose_name_plural = 'Departments'
+    
+    def __str__(self):
+        return self.name
+
+
 class User(AbstractUser):
     """
     Custom User model with additional fields for iClock Server
@@ -18,7 +40,8 @@ class User(AbstractUser):
     
     role = models.CharField(max_length=20, choices=ROLE_CHOICES, default='user')
     employee_id = models.CharField(max_length=50, unique=True, null=True, blank=True)
-    department = models.CharField(max_length=100, blank=True)
+    department = models.ForeignKey(Department, on_delete=models.SET_NULL, null=True,
+                                   blank=True, related_name='members')
     phone = models.CharField(max_length=20, blank=True)
     photo = models.ImageField(upload_to='users/photos/', null=True, blank=True)
     is_active = models.BooleanField(default=True)
@@ -28,6 +51,10 @@ class User(AbstractUser):
     class Meta:
         db_table = 'users'
         ordering = ['-created_at']
+        indexes = [
+            # Manager scoping joins through users.department_id
+            models.Index(fields=['department', 'is_active']),
+        ]
         verbose_name = 'User'
         verbose_name_plural = 'Users'
     
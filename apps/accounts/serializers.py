@@ -3,7 +3,7 @@ API Serializers for User Management
 """
 from rest_framework import serializers
 from django.contrib.auth import authenticate
-from .models import User, UserProfile
+from .models import Department, User, UserProfile
 
 
 class UserProfileSerializer(serializers.ModelSerializer):
@@ -15,19 +15,28 @@ class UserProfileSerializer(serializers.ModelSerializer):
                   'emergency_phone', 'notes']
 
 
+class DepartmentSerializer(serializers.ModelSerializer):
+    """Serializer for Department"""
+    class Meta:
+        model = Department
+        fields = ['id', 'name', 'code', 'parent', 'is_active', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'created_at', 'updated_at']
+
+
 class UserSerializer(serializers.ModelSerializer):
     """Serializer for User model"""
     profile = UserProfileSerializer(required=False)
     password = serializers.CharField(write_only=True, required=False)
     role_display = serializers.CharField(source='get_role_display', read_only=True)
+    department_name = serializers.CharField(source='department.name', read_only=True, allow_null=True)
     
     class Meta:
         model = User
         fields = ['id', 'username', 'email', 'first_name', 'last_name', 
-                  'employee_id', 'department', 'phone', 'photo', 'role', 
-                  'role_display', 'is_active', 'is_staff', 'created_at', 
+                  'employee_id', 'department', 'department_name', 'phone', 'photo', 'role', 
+                  'role_display', 'is_manager', 'is_active', 'is_staff', 'created_at', 
                   'updated_at', 'profile', 'password']
-        read_only_fields = ['id', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'is_manager', 'created_at', 'updated_at']
         extra_kwargs = {
             'password': {'write_only': True}
         }
@@ -0,0 +1,29 @@
+"""
+Signal handlers invalidating cached authentication data
+"""
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+from . import departments
+from .authentication import invalidate_token, invalidate_user
+from .models import Department, User
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_user(sender, instance, **kwargs):
+    """Password change, activation, role or department edits"""
+    invalidate_user(instance.pk)
+
+
+@receiver(post_delete, sender=Token)
+def forget_token(sender, instance, **kwargs):
+    """Logout deletes the token"""
+    invalidate_token(instance.key)
+
+
+@receiver(post_save, sender=Department)
+@receiver(post_delete, sender=Department)
+def forget_departments(sender, instance, **kwargs):
+    """Department tree changed"""
+    departments.invalidate()
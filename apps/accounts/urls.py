@@ -3,10 +3,11 @@ URL routing for accounts app
 """
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import UserViewSet, login_view, logout_view, register_view
+from .views import DepartmentViewSet, UserViewSet, login_view, logout_view, register_view
 
 router = DefaultRouter()
 router.register(r'users', UserViewSet, basename='user')
+router.register(r'departments', DepartmentViewSet, basename='department')
 
 urlpatterns = [
     path('', include(router.urls)),
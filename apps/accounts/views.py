@@ -7,9 +7,12 @@ from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
 from django.contrib.auth import login, logout
 from django.db.models import Q
-from .models import User
+from apps.devices.models import Device
+from .departments import visible_department_ids
+from .imports import import_employees, read_rows
+from .models import Department, User
 from .serializers import (
-    UserSerializer, LoginSerializer, 
+    DepartmentSerializer, UserSerializer, LoginSerializer, 
     ChangePasswordSerializer
 )
 
@@ -30,7 +33,7 @@ class UserViewSet(viewsets.ModelViewSet):
     """
     API endpoint for user management
     """
-    queryset = User.objects.all()
+    queryset = User.objects.select_related('department', 'profile')
     serializer_class = UserSerializer
     permission_classes = [IsAdminOrReadOnly]
     filterset_fields = ['role', 'is_active', 'department']
@@ -49,7 +52,7 @@ class UserViewSet(viewsets.ModelViewSet):
         # Managers see their department
         if user.is_manager:
             return queryset.filter(
-                Q(department=user.department) | Q(id=user.id)
+                Q(department_id__in=visible_department_ids(user)) | Q(id=user.id)
             )
         
         # Regular users only see themselves
@@ -58,7 +61,9 @@ class UserViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def me(self, request):
         """Get current user information"""
-        serializer = self.get_serializer(request.user)
+        # request.user may be a partially loaded cached instance
+        user = self.queryset.get(pk=request.user.pk)
+        serializer = self.get_serializer(user)
         return Response(serializer.data)
     
     @action(detail=True, methods=['post'])
@@ -107,6 +112,54 @@ class UserViewSet(viewsets.ModelViewSet):
             'message': f'User {"activated" if user.is_active else "deactivated"} successfully.',
             'is_active': user.is_active
         })
+    
+    @action(detail=False, methods=['post'])
+    def bulk_import(self, request):
+        """
+        Create employees from a CSV or XLSX file
+        Form fields: file, devices (optional ids or serial numbers, comma separated:
+        register every employee on them), dry_run (validate only)
+        """
+        if not request.user.is_admin:
+            return Response(
+                {'error': 'Only admins can import users.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': 'file is required.'}, status=status.HTTP_400_BAD_REQUEST)
+        names = {name.strip() for value in request.data.getlist('devices') for name in value.split(',')} - {''}
+        devices = list(Device.objects.filter(
+            Q(serial_number__in=names) | Q(pk__in=[name for name in names if name.isdigit()])
+        ))
+        unknown = names - {device.serial_number for device in devices} - {str(device.pk) for device in devices}
+        if unknown:
+            return Response(
+                {'error': f'Unknown devices: {", ".join(sorted(unknown))}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            summary = import_employees(
+                read_rows(upload.file, upload.name), devices=devices,
+                dry_run=str(request.data.get('dry_run', '')).lower() in ('1', 'true'), created_by=request.user
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(summary)
+
+
+class DepartmentViewSet(viewsets.ModelViewSet):
+    """
+    API endpoint for department management
+    """
+    queryset = Department.objects.all()
+    serializer_class = DepartmentSerializer
+    permission_classes = [IsAdminOrReadOnly]
+    filterset_fields = ['parent', 'is_active']
+    search_fields = ['name', 'code']
+    ordering_fields = ['name', 'code']
 
 
 @api_view(['POST'])
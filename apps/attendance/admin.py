@@ -3,16 +3,22 @@ Admin interface for Attendance Management
 """
 from django.contrib import admin
 from django.utils.html import format_html
+from apps.core.changelist import AutocompleteListFilter, LargeTableAdminMixin
+from apps.core.search import IndexedSearchMixin
+from .bulk import approve_leaves, recalculate_work_hours, reject_leaves
 from .models import AttendanceRecord, DailyAttendance, LeaveRequest
 
 
 @admin.register(AttendanceRecord)
-class AttendanceRecordAdmin(admin.ModelAdmin):
+class AttendanceRecordAdmin(LargeTableAdminMixin, IndexedSearchMixin, admin.ModelAdmin):
     """Attendance Record Admin"""
     list_display = ('user', 'device', 'timestamp', 'verify_type', 
                     'verify_code_display', 'is_processed')
-    list_filter = ('verify_type', 'verify_code', 'is_processed', 'timestamp', 'device')
+    list_filter = ('verify_type', 'verify_code', 'is_processed', 'timestamp',
+                   ('device', AutocompleteListFilter), ('user', AutocompleteListFilter))
     search_fields = ('user__username', 'user__employee_id', 'device__name')
+    list_select_related = ('user', 'device')
+    autocomplete_fields = ('user', 'device')
     readonly_fields = ('created_at', 'processed_at')
     date_hierarchy = 'timestamp'
     
@@ -24,12 +30,14 @@ class AttendanceRecordAdmin(admin.ModelAdmin):
 
 
 @admin.register(DailyAttendance)
-class DailyAttendanceAdmin(admin.ModelAdmin):
+class DailyAttendanceAdmin(IndexedSearchMixin, admin.ModelAdmin):
     """Daily Attendance Admin"""
     list_display = ('user', 'date', 'check_in', 'check_out', 'status_badge', 
                     'work_hours', 'late_minutes', 'is_approved')
     list_filter = ('status', 'is_approved', 'date')
     search_fields = ('user__username', 'user__employee_id')
+    list_select_related = ('user',)
+    autocomplete_fields = ('user', 'approved_by')
     readonly_fields = ('created_at', 'updated_at', 'approved_at')
     date_hierarchy = 'date'
     actions = ['approve_attendance', 'calculate_hours']
@@ -73,31 +81,32 @@ class DailyAttendanceAdmin(admin.ModelAdmin):
     def approve_attendance(self, request, queryset):
         """Approve selected attendance records"""
         from django.utils import timezone
-        count = queryset.update(
+        now = timezone.now()
+        count = queryset.filter(is_approved=False).update(
             is_approved=True,
             approved_by=request.user,
-            approved_at=timezone.now()
+            approved_at=now,
+            updated_at=now
         )
         self.message_user(request, f'{count} attendance records approved.')
     approve_attendance.short_description = 'Approve selected attendance'
     
     def calculate_hours(self, request, queryset):
         """Calculate work hours for selected records"""
-        count = 0
-        for record in queryset:
-            record.calculate_work_hours()
-            count += 1
+        count = recalculate_work_hours(queryset)
         self.message_user(request, f'Work hours calculated for {count} records.')
     calculate_hours.short_description = 'Calculate work hours'
 
 
 @admin.register(LeaveRequest)
-class LeaveRequestAdmin(admin.ModelAdmin):
+class LeaveRequestAdmin(IndexedSearchMixin, admin.ModelAdmin):
     """Leave Request Admin"""
     list_display = ('user', 'leave_type', 'start_date', 'end_date', 
                     'days_count', 'status_badge', 'reviewed_by')
     list_filter = ('status', 'leave_type', 'start_date')
     search_fields = ('user__username', 'user__employee_id', 'reason')
+    list_select_related = ('user', 'reviewed_by')
+    autocomplete_fields = ('user', 'reviewed_by')
     readonly_fields = ('created_at', 'updated_at', 'reviewed_at')
     date_hierarchy = 'start_date'
     actions = ['approve_requests', 'reject_requests']
@@ -137,18 +146,12 @@ class LeaveRequestAdmin(admin.ModelAdmin):
     
     def approve_requests(self, request, queryset):
         """Approve selected leave requests"""
-        count = 0
-        for leave in queryset.filter(status='pending'):
-            leave.approve(request.user)
-            count += 1
+        count = approve_leaves(queryset, request.user)
         self.message_user(request, f'{count} leave requests approved.')
     approve_requests.short_description = 'Approve selected requests'
     
     def reject_requests(self, request, queryset):
         """Reject selected leave requests"""
-        count = 0
-        for leave in queryset.filter(status='pending'):
-            leave.reject(request.user)
-            count += 1
+        count = reject_leaves(queryset, request.user)
         self.message_user(request, f'{count} leave requests rejected.')
     reject_requests.short_description = 'Reject selected requests'
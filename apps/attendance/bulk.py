@@ -0,0 +1,81 @@
+"""
+Set-based versions of per-object model methods, for admin actions
+
+An admin action on a selection of thousands of rows used to call
+DailyAttendance.calculate_work_hours() or LeaveRequest.approve() once per
+row: a save() each, and for leave an update_or_create per day. Here the
+same changes are made in a fixed number of statements per batch. Updates
+and upserts send no post_save, so the dashboard counters the signal
+handlers would adjust are adjusted here.
+"""
+from datetime import timedelta
+from django.db import transaction
+from django.utils import timezone
+from apps.core import stats
+from apps.core.upsert import upsert
+from .models import DailyAttendance, LeaveRequest
+
+BATCH_SIZE = 1000
+
+
+def recalculate_work_hours(queryset):
+    """
+    Recompute work_hours of the DailyAttendance rows in queryset, as calculate_work_hours() does
+    Rows are read in chunks of BATCH_SIZE and written back with one UPDATE
+    per chunk. Returns the number of rows updated; rows missing a
+    check-in or check-out are left alone.
+    """
+    rows = (queryset.filter(check_in__isnull=False, check_out__isnull=False)
+            .select_related(None).order_by().only('id', 'check_in', 'check_out'))
+    now = timezone.now()
+    count = 0
+    batch = []
+    for daily in rows.iterator(chunk_size=BATCH_SIZE):
+        daily.work_hours = round((daily.check_out - daily.check_in).total_seconds() / 3600, 2)
+        daily.updated_at = now
+        batch.append(daily)
+        if len(batch) >= BATCH_SIZE:
+            DailyAttendance.objects.bulk_update(batch, ['work_hours', 'updated_at'])
+            count += len(batch)
+            batch = []
+    if batch:
+        DailyAttendance.objects.bulk_update(batch, ['work_hours', 'updated_at'])
+        count += len(batch)
+    return count
+
+
+def approve_leaves(queryset, reviewer):
+    """
+    Approve the pending LeaveRequests in queryset, as LeaveRequest.approve() does
+    The requests are updated in one statement and every day they cover is
+    marked as leave in DailyAttendance with one upsert per batch. Returns
+    the number of requests approved.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        leaves = list(queryset.filter(status='pending').select_for_update().select_related(None).order_by()
+                      .only('id', 'user_id', 'start_date', 'end_date'))
+        if not leaves:
+            return 0
+        LeaveRequest.objects.filter(pk__in=[leave.pk for leave in leaves]).update(
+            status='approved', reviewed_by=reviewer, reviewed_at=now, updated_at=now
+        )
+        days = [
+            DailyAttendance(user_id=leave.user_id, date=leave.start_date + timedelta(days=offset), status='leave')
+            for leave in leaves
+            for offset in range((leave.end_date - leave.start_date).days + 1)
+        ]
+        upsert(days, ('user', 'date'), ['status', 'updated_at'])
+    # Days turned from late to leave change the late counter too: recount on the next read
+    stats.invalidate()
+    return len(leaves)
+
+
+def reject_leaves(queryset, reviewer):
+    """Reject the pending LeaveRequests in queryset in one statement; returns the number rejected"""
+    now = timezone.now()
+    count = queryset.filter(status='pending').update(
+        status='rejected', reviewed_by=reviewer, reviewed_at=now, updated_at=now
+    )
+    stats.incr('pending_leaves', -count)
+    return count
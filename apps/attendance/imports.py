@@ -0,0 +1,220 @@
+"""
+Import of x_attlog.dat attendance logs (USB dumps)
+
+When a device loses its network, HR pulls its attendance log on a USB
+stick. The dump holds everything the device remembers, so it overlaps
+heavily with what was uploaded before. The file is streamed and handled
+in batches of ATTLOG_IMPORT_BATCH lines:
+1. PINs are mapped to users as for device uploads (devices.resolver:
+   DeviceUser on that device, then employee_id)
+2. the punches the device already has in the database are fetched in one
+   query over the batch's time range; they and duplicates within the
+   file are dropped
+3. the remaining punches are inserted by store_punches in one statement
+
+Each batch is committed on its own: an interrupted import can simply be
+run again. Uploads too large for memory are imported by a background
+job; its summary is kept as <job>.json in ATTLOG_IMPORT_DIR so that any
+worker on the host can report it. The job runs in a thread of the web
+worker, which a restart stops: the status records the worker's host and
+pid and a heartbeat renewed after every batch, and a running job whose
+worker is gone or whose heartbeat is older than ATTLOG_IMPORT_STALE
+seconds is reported as failed. Its file is kept for import_attlog.
+"""
+import io
+import json
+import logging
+import os
+import re
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from apps.core.sharding import device_database
+from apps.devices.models import DeviceLog
+from apps.devices.protocol import parse_attlog_line
+from apps.devices.resolver import resolver
+from .models import AttendanceRecord
+from .storage import store_punches
+
+logger = logging.getLogger(__name__)
+
+JOB_ID = re.compile(r'^[0-9a-f]{32}$')
+MAX_ERRORS = 20  # malformed lines listed in the summary
+
+
+def read_lines(binary_file):
+    """Text lines of an x_attlog.dat file, whatever its line endings"""
+    return io.TextIOWrapper(binary_file, encoding='utf-8-sig', errors='replace')
+
+
+def import_attlog(device, lines, source='', progress=None):
+    """
+    Import the punches of device from lines
+    Returns a summary: lines read, malformed lines, duplicates within the
+    file, punches already stored and punches inserted. progress(summary)
+    is called after every batch.
+    """
+    summary = {
+        'device': device.serial_number, 'source': source, 'lines': 0, 'malformed': 0,
+        'duplicates': 0, 'existing': 0, 'inserted': 0, 'first': None, 'last': None, 'errors': [],
+    }
+    batch = []
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        summary['lines'] += 1
+        try:
+            batch.append(parse_attlog_line(line))
+        except ValueError as e:
+            summary['malformed'] += 1
+            if len(summary['errors']) < MAX_ERRORS:
+                summary['errors'].append({'line': number, 'error': str(e)})
+            continue
+        if len(batch) >= settings.ATTLOG_IMPORT_BATCH:
+            _import_batch(device, batch, summary)
+            batch = []
+            if progress:
+                progress(summary)
+    if batch:
+        _import_batch(device, batch, summary)
+
+    logger.info(f"Imported {summary['inserted']} of {summary['lines']} attendance log lines "
+                f"from {source or 'a file'} for {device.serial_number}")
+    DeviceLog.objects.create(
+        device=device,
+        log_type='attlog_import',
+        message=f"{summary['inserted']} punches imported from {source or 'x_attlog.dat'}",
+        details=summary,
+    )
+    return summary
+
+
+def _import_batch(device, punches, summary):
+    user_ids = resolver.resolve_many(device, {punch.pin for punch in punches})
+    records = {}
+    for punch in punches:
+        timestamp = timezone.make_aware(punch.timestamp)
+        key = (user_ids[punch.pin], timestamp)
+        if key in records:
+            summary['duplicates'] += 1
+            continue
+        records[key] = AttendanceRecord(
+            user_id=key[0],
+            device=device,
+            timestamp=timestamp,
+            verify_type=punch.verify,
+            verify_code=punch.status,
+            work_code=punch.workcode,
+        )
+
+    # Dumps are in time order, so the range is narrow and served by the (device, timestamp) index.
+    # Read from the primary: a lagging replica would miss the latest uploads.
+    first = min(timestamp for _, timestamp in records)
+    last = max(timestamp for _, timestamp in records)
+    stored = set(
+        AttendanceRecord.objects.db_manager(device_database(device))
+        .filter(device=device, timestamp__range=(first, last))
+        .values_list('user_id', 'timestamp')
+    )
+    new_records = [record for key, record in records.items() if key not in stored]
+    inserted = store_punches(new_records) if new_records else []
+
+    # Anything store_punches skipped was stored concurrently, e.g. by a device upload
+    summary['existing'] += len(records) - len(inserted)
+    summary['inserted'] += len(inserted)
+    if summary['first'] is None or first.isoformat() < summary['first']:
+        summary['first'] = first.isoformat()
+    if summary['last'] is None or last.isoformat() > summary['last']:
+        summary['last'] = last.isoformat()
+
+
+def _job_path(job, extension):
+    return os.path.join(settings.ATTLOG_IMPORT_DIR, f'{job}.{extension}')
+
+
+def _write_status(job, status):
+    path = _job_path(job, 'json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(status, f)
+    os.replace(path + '.tmp', path)
+
+
+def _read_status(job):
+    try:
+        with open(_job_path(job, 'json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _worker_gone(status):
+    """True when the worker running a job has stopped (or stopped renewing its heartbeat)"""
+    # Jobs started before heartbeats were recorded have only their start time
+    heartbeat = datetime.fromisoformat(status.get('heartbeat') or status['started'])
+    if timezone.now() - heartbeat > timedelta(seconds=settings.ATTLOG_IMPORT_STALE):
+        return True
+    if status.get('host') != socket.gethostname() or os.name != 'posix':
+        return False
+    try:
+        os.kill(status['pid'], 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def job_status(job):
+    """Status of an import job, None when unknown; an abandoned job is marked failed"""
+    if not JOB_ID.match(job):
+        return None
+    status = _read_status(job)
+    if status is not None and status['status'] == 'running' and _worker_gone(status):
+        logger.error(f"Attendance log import {job} from {status['source']} was interrupted "
+                     f"(worker {status.get('pid')} on {status.get('host')} stopped or stalled)")
+        status.update(status='failed', error='The import was interrupted: its worker stopped.',
+                      file=_job_path(job, 'dat'), finished=timezone.now().isoformat())
+        _write_status(job, status)
+    return status
+
+
+def start_import(device, upload):
+    """Copy an uploaded dump to ATTLOG_IMPORT_DIR and import it in a background thread; returns the job id"""
+    job = uuid.uuid4().hex
+    os.makedirs(settings.ATTLOG_IMPORT_DIR, exist_ok=True)
+    with open(_job_path(job, 'dat'), 'wb') as f:
+        for chunk in upload.chunks():
+            f.write(chunk)
+    now = timezone.now().isoformat()
+    _write_status(job, {'job': job, 'status': 'running', 'device': device.serial_number, 'source': upload.name,
+                        'started': now, 'heartbeat': now, 'host': socket.gethostname(), 'pid': os.getpid()})
+    threading.Thread(target=_run_import, args=(job, device, upload.name), name=f'attlog-import-{job[:8]}',
+                     daemon=True).start()
+    return job
+
+
+def _run_import(job, device, source):
+    status = _read_status(job)
+
+    def progress(summary):
+        status.update(summary, heartbeat=timezone.now().isoformat())
+        _write_status(job, status)
+
+    try:
+        with open(_job_path(job, 'dat'), 'rb') as f:
+            summary = import_attlog(device, read_lines(f), source=source, progress=progress)
+        status.update(summary, status='done')
+    except Exception as e:
+        # Batches imported so far are kept, and so is the file: import_attlog can take it again
+        logger.error(f"Attendance log import {job} from {source} failed: {str(e)}")
+        status.update(status='failed', error=str(e), file=_job_path(job, 'dat'))
+    finally:
+        connections.close_all()
+    status['finished'] = timezone.now().isoformat()
+    _write_status(job, status)
+    if status['status'] == 'done':
+        os.remove(_job_path(job, 'dat'))
@@ -0,0 +1,40 @@
+"""
+Import x_attlog.dat files pulled from a device over USB
+Streams the file in batches, so dumps of hundreds of megabytes import in
+one pass; punches already stored are skipped (see attendance/imports.py).
+"""
+from django.core.management.base import BaseCommand, CommandError
+from apps.attendance.imports import import_attlog, read_lines
+from apps.devices.models import Device
+
+
+class Command(BaseCommand):
+    help = 'Import attendance punches from x_attlog.dat files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+', help='x_attlog.dat files')
+        parser.add_argument('--device', required=True, help='Serial number of the device the files come from')
+
+    def handle(self, *args, **options):
+        try:
+            device = Device.objects.get(serial_number=options['device'])
+        except Device.DoesNotExist:
+            raise CommandError(f'Unknown device: {options["device"]}')
+
+        for path in options['files']:
+            try:
+                f = open(path, 'rb')
+            except OSError as e:
+                raise CommandError(f'Cannot read {path}: {str(e)}')
+            with f:
+                summary = import_attlog(device, read_lines(f), source=path, progress=self.progress)
+            self.stdout.write(self.style.SUCCESS(
+                f"{path}: {summary['inserted']} punches imported, {summary['existing']} already stored, "
+                f"{summary['duplicates']} duplicates, {summary['malformed']} malformed lines "
+                f"({summary['first']} to {summary['last']})"
+            ))
+            for error in summary['errors']:
+                self.stdout.write(self.style.WARNING(f"  line {error['line']}: {error['error']}"))
+
+    def progress(self, summary):
+        self.stdout.write(f"  {summary['lines']} lines, {summary['inserted']} punches imported")
@@ -0,0 +1,76 @@
+"""
+Move daily summaries left in site databases to the default database
+Daily summaries used to be written to the database of the punch's site,
+so an employee punching at two sites had a summary in each. They are now
+kept on the primary only. Each site row is merged into the primary's row
+for that employee and day (earliest check-in, latest check-out; the
+primary's status and approval are kept) or copied there, then deleted
+from the site database. Running it again finds nothing to move.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
+from apps.attendance.models import DailyAttendance
+from apps.core import stats
+from apps.core.sharding import site_aliases
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = 'Move daily attendance summaries from the site databases to the primary'
+
+    def handle(self, *args, **options):
+        aliases = site_aliases()
+        if not aliases:
+            raise CommandError('No site databases are configured (SITE_DATABASES).')
+
+        for alias in aliases:
+            copied = merged = 0
+            while True:
+                rows = list(DailyAttendance.objects.using(alias).order_by('pk')[:BATCH_SIZE])
+                if not rows:
+                    break
+                with transaction.atomic(using=DEFAULT_DB_ALIAS), transaction.atomic(using=alias):
+                    new, changed = self.merge(rows)
+                    site_ids = [row.pk for row in rows]
+                    for row in new:
+                        row.pk = None
+                        row._state.adding = True
+                        row._state.db = None
+                    DailyAttendance.objects.bulk_create(new, batch_size=BATCH_SIZE)
+                    DailyAttendance.objects.bulk_update(changed, ['check_in', 'check_out', 'updated_at'],
+                                                        batch_size=BATCH_SIZE)
+                    DailyAttendance.objects.using(alias).filter(pk__in=site_ids).delete()
+                copied += len(new)
+                merged += len(rows) - len(new)
+            self.stdout.write(f'{alias}: {copied} summaries copied, {merged} merged into existing ones')
+
+        # bulk_create sends no signals and the deletes uncounted the site rows: recount
+        stats.invalidate()
+        self.stdout.write(self.style.SUCCESS('Daily summaries are all on the primary database.'))
+
+    def merge(self, rows):
+        """Site rows without a primary row, and the primary rows their punches changed"""
+        existing = {
+            (daily.user_id, daily.date): daily
+            for daily in DailyAttendance.objects.db_manager(DEFAULT_DB_ALIAS).select_for_update().filter(
+                user_id__in={row.user_id for row in rows}, date__in={row.date for row in rows}
+            )
+        }
+        now = timezone.now()
+        new, changed = [], {}
+        for row in rows:
+            daily = existing.get((row.user_id, row.date))
+            if daily is None:
+                new.append(row)
+                continue
+            if row.check_in and (not daily.check_in or row.check_in < daily.check_in):
+                daily.check_in = row.check_in
+                changed[daily.pk] = daily
+            if row.check_out and (not daily.check_out or row.check_out > daily.check_out):
+                daily.check_out = row.check_out
+                changed[daily.pk] = daily
+        for daily in changed.values():
+            daily.updated_at = now
+        return new, list(changed.values())
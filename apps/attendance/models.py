@@ -35,8 +35,13 @@ class AttendanceRecord(models.Model):
         indexes = [
             models.Index(fields=['user', 'timestamp']),
             models.Index(fields=['device', 'timestamp']),
+            models.Index(fields=['timestamp']),
             models.Index(fields=['is_processed']),
         ]
+        constraints = [
+            # Devices resend uploads they got no answer for; see storage.store_punches
+            models.UniqueConstraint(fields=['user', 'device', 'timestamp'], name='unique_punch'),
+        ]
         verbose_name = 'Attendance Record'
         verbose_name_plural = 'Attendance Records'
     
@@ -55,9 +60,9 @@ class AttendanceRecord(models.Model):
         
         date = self.timestamp.date()
         
-        # Get or create daily attendance
+        # Get or create daily attendance; summaries of every site are on the primary
         daily, created = DailyAttendance.objects.get_or_create(
-            user=self.user,
+            user_id=self.user_id,
             date=date,
             defaults={
                 'check_in': self.timestamp if self.verify_code == 0 else None,
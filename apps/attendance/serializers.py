@@ -2,6 +2,7 @@
 API Serializers for Attendance Management
 """
 from rest_framework import serializers
+from apps.core.sharding import database_site
 from .models import AttendanceRecord, DailyAttendance, LeaveRequest
 
 
@@ -10,11 +11,16 @@ class AttendanceRecordSerializer(serializers.ModelSerializer):
     user_name = serializers.CharField(source='user.username', read_only=True)
     device_name = serializers.CharField(source='device.name', read_only=True)
     verify_type_display = serializers.CharField(source='get_verify_type_display', read_only=True)
+    site = serializers.SerializerMethodField()
     
     class Meta:
         model = AttendanceRecord
         fields = '__all__'
         read_only_fields = ['created_at', 'processed_at']
+    
+    def get_site(self, obj):
+        """Site database holding the record; ids are only unique within one"""
+        return database_site(obj._state.db)
 
 
 class DailyAttendanceSerializer(serializers.ModelSerializer):
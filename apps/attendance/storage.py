@@ -0,0 +1,105 @@
+"""
+Batched punch storage
+Every path that stores punches (device uploads, the transaction API, bulk
+create and imports) goes through store_punches. Duplicates are skipped by
+the database on the (user, device, timestamp) unique constraint, in one
+statement per batch, and the daily summaries of the new punches are
+updated in a fixed number of queries instead of two or three per punch
+(AttendanceRecord.process_record). Bulk updates send no post_save, so
+the dashboard "present" counter is kept up to date here. Records are
+written to the database of their device's site (apps.core.sharding), in
+one transaction per database; their daily summaries always go to the
+default database, committed along with them.
+"""
+from collections import defaultdict
+from contextlib import ExitStack
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
+from apps.core import stats
+from apps.core.sharding import punch_database
+from apps.core.upsert import insert_ignore, upsert
+from .models import AttendanceRecord, DailyAttendance
+
+UNIQUE_PUNCH = ('user', 'device', 'timestamp')
+
+
+def store_punches(records):
+    """
+    Insert unsaved AttendanceRecords, skipping those that are already stored
+    Records not yet processed are folded into their daily summaries, as
+    save() does. Returns the records that were inserted.
+    """
+    now = timezone.now()
+    pending = {id(record) for record in records if not record.is_processed}
+    for record in records:
+        if id(record) in pending:
+            record.is_processed = True
+            record.processed_at = now
+    by_database = defaultdict(list)
+    for record in records:
+        by_database[punch_database(record)].append(record)
+
+    inserted = []
+    for using, batch in by_database.items():
+        try:
+            with ExitStack() as stack:
+                # using is None for the default database: a second atomic() would only add a savepoint
+                if using is not None:
+                    stack.enter_context(transaction.atomic(using=using))
+                stack.enter_context(transaction.atomic(using=DEFAULT_DB_ALIAS))
+                stored = insert_ignore(batch, UNIQUE_PUNCH, using=using)
+                rollup_daily([record for record in stored if id(record) in pending])
+        except Exception:
+            # Rolled back: leave the records as they came so they can be stored again
+            for record in batch:
+                if id(record) in pending:
+                    record.is_processed = False
+                    record.processed_at = None
+            raise
+        inserted.extend(stored)
+    return inserted
+
+
+def rollup_daily(records):
+    """Update the DailyAttendance rows of records: earliest check-in, latest check-out"""
+    days = defaultdict(lambda: [None, None])
+    for record in records:
+        day = days[record.user_id, timezone.localtime(record.timestamp).date()]
+        if record.verify_code == 0 and (day[0] is None or record.timestamp < day[0]):
+            day[0] = record.timestamp
+        elif record.verify_code == 1 and (day[1] is None or record.timestamp > day[1]):
+            day[1] = record.timestamp
+    if not days:
+        return
+
+    # One row per user and day, in the default database whichever site the punches come from
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        insert_ignore([DailyAttendance(user_id=user_id, date=date) for user_id, date in days], ('user', 'date'),
+                      using=DEFAULT_DB_ALIAS)
+        dailies = DailyAttendance.objects.db_manager(DEFAULT_DB_ALIAS).select_for_update().filter(
+            user_id__in={user_id for user_id, _ in days}, date__in={date for _, date in days}
+        )
+        now = timezone.now()
+        changed = []
+        checked_in = defaultdict(int)
+        for daily in dailies:
+            punches = days.get((daily.user_id, daily.date))
+            if punches is None:
+                continue
+            check_in, check_out = punches
+            updated = False
+            if check_in and (not daily.check_in or check_in < daily.check_in):
+                if not daily.check_in:
+                    checked_in[daily.date] += 1
+                daily.check_in = check_in
+                updated = True
+            if check_out and (not daily.check_out or check_out > daily.check_out):
+                daily.check_out = check_out
+                updated = True
+            if updated:
+                daily.updated_at = now
+                changed.append(daily)
+        # The rows exist and are locked: the upsert updates them in one statement
+        upsert(changed, ('user', 'date'), ['check_in', 'check_out', 'updated_at'], using=DEFAULT_DB_ALIAS)
+    for date, count in checked_in.items():
+        stats.incr('present', count, date=date)
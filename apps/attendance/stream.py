@@ -0,0 +1,227 @@
+"""
+Live attendance feed (Server-Sent Events)
+Replaces dashboard polling of the attendance records list.
+
+A stream stays open for SSE_MAX_DURATION seconds, so deployments serve
+it from the async pool (stream_async.py), not from the sync API workers.
+punch_stream below is the same feed for runserver.
+
+EventSource cannot send an Authorization header. Browsers with a session
+use the cookie; token clients first POST to stream/ticket/ and open the
+stream with ?ticket=, a signed value valid for SSE_TICKET_TTL seconds and
+redeemed once, so the API token never appears in a URL or access log.
+"""
+import json
+import secrets
+import threading
+import time
+from importlib import import_module
+from django.conf import settings
+from django.contrib import auth
+from django.core import signing
+from django.core.cache import cache
+from django.db.models import Q
+from django.http import HttpRequest, HttpResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from apps.accounts.departments import visible_department_ids
+from apps.accounts.models import User
+from apps.core import events
+from apps.core.sharding import gather
+from .models import AttendanceRecord
+
+CHANNEL = 'punches'
+TICKET_SALT = 'apps.attendance.stream.ticket'
+TICKET_KEY_PREFIX = 'iclock:stream-ticket'
+
+# Redeemed ticket nonces of this process (nonce -> expiry); the cache
+# covers other processes when it is shared
+_redeemed = {}
+_redeemed_lock = threading.Lock()
+
+
+def punch_payload(record):
+    """Serialize a punch for the live feed"""
+    return {
+        'id': record.id,
+        'user_id': record.user_id,
+        'user_name': record.user.username,
+        'employee_id': record.user.employee_id,
+        'department_id': record.user.department_id,
+        'device_id': record.device_id,
+        'device_name': record.device.name,
+        'timestamp': record.timestamp.isoformat(),
+        'verify_type': record.verify_type,
+        'verify_code': record.verify_code,
+    }
+
+
+def publish_punches(records):
+    """Publish newly stored punches to the live feed"""
+    if records:
+        events.publish(CHANNEL, 'punch', [punch_payload(r) for r in records])
+
+
+def issue_ticket(user):
+    """A stream ticket for user, valid for SSE_TICKET_TTL seconds"""
+    return signing.dumps({'user': user.pk, 'nonce': secrets.token_urlsafe(12)}, salt=TICKET_SALT)
+
+
+def _claim(nonce):
+    """True the first time a ticket nonce is redeemed"""
+    now = time.monotonic()
+    with _redeemed_lock:
+        for key in [key for key, expiry in _redeemed.items() if expiry < now]:
+            del _redeemed[key]
+        if nonce in _redeemed:
+            return False
+        _redeemed[nonce] = now + settings.SSE_TICKET_TTL
+    return cache.add(f'{TICKET_KEY_PREFIX}:{nonce}', 1, settings.SSE_TICKET_TTL)
+
+
+def redeem_ticket(ticket):
+    """The active user a ticket was issued to; None if it is invalid, expired or used"""
+    try:
+        payload = signing.loads(ticket, salt=TICKET_SALT, max_age=settings.SSE_TICKET_TTL)
+    except signing.BadSignature:
+        return None
+    if not _claim(payload['nonce']):
+        return None
+    return User.objects.filter(pk=payload['user'], is_active=True).first()
+
+
+def session_user(session_key):
+    """The user logged in with a session cookie; None for no or an expired session"""
+    request = HttpRequest()
+    request.session = import_module(settings.SESSION_ENGINE).SessionStore(session_key)
+    user = auth.get_user(request)
+    return user if user.is_authenticated else None
+
+
+def authenticate(params, session_key=None):
+    """The user of a stream request: ?ticket= or the session cookie"""
+    ticket = params.get('ticket')
+    if ticket:
+        return redeem_ticket(ticket)
+    if session_key:
+        return session_user(session_key)
+    return None
+
+
+def stream_options(params, last_event_id=None):
+    """
+    Filters and resume point of a stream request
+    Returns (department, device, last_id, backlog); last_id is None for a
+    fresh connection. Raises ValueError for invalid filters.
+    """
+    department = params.get('department')
+    device = params.get('device')
+    if (device and not device.isdigit()) or (department and not department.isdigit()):
+        raise ValueError('Invalid filter')
+    last_event_id = last_event_id or params.get('last_event_id')
+    last_id = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+    try:
+        backlog = min(int(params.get('backlog', 10)), 100)
+    except ValueError:
+        backlog = 10
+    return department, device, last_id, backlog
+
+
+def _visibility_filter(user, department=None, device=None):
+    """Build a predicate deciding which punches a client receives"""
+    managed = set(visible_department_ids(user)) if user.is_manager else set()
+
+    def visible(punch):
+        if device and str(punch['device_id']) != device:
+            return False
+        if department and str(punch['department_id']) != department:
+            return False
+        # Same scoping as the REST endpoints
+        if user.is_admin or user.is_superuser:
+            return True
+        if user.is_manager:
+            return punch['department_id'] in managed or punch['user_id'] == user.id
+        return punch['user_id'] == user.id
+    return visible
+
+
+def _format(event_type, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event_type}')
+    lines.append(f'data: {json.dumps(data)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+def _recent_punches(user, department, device, limit):
+    """Latest stored punches, used to seed a fresh connection"""
+    queryset = AttendanceRecord.objects.select_related('user', 'device')
+    if not (user.is_admin or user.is_superuser):
+        if user.is_manager:
+            queryset = queryset.filter(
+                Q(user__department_id__in=visible_department_ids(user)) | Q(user=user)
+            )
+        else:
+            queryset = queryset.filter(user=user)
+    if department:
+        queryset = queryset.filter(user__department_id=department)
+    if device:
+        queryset = queryset.filter(device_id=device)
+    records = list(gather(queryset.order_by('-timestamp'))[:limit])
+    return [punch_payload(r) for r in records[::-1]]
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def stream_ticket(request):
+    """Issue a single-use ticket for opening the live feed with ?ticket="""
+    return Response({'ticket': issue_ticket(request.user), 'expires_in': settings.SSE_TICKET_TTL})
+
+
+@require_GET
+def punch_stream(request):
+    """
+    Stream new punches as Server-Sent Events (runserver; see stream_async for deployments)
+    Query params: ticket, department, device, backlog
+    Resumes from the Last-Event-ID header (or last_event_id param).
+    """
+    if request.user.is_authenticated:
+        user = request.user
+    else:
+        user = authenticate(request.GET)
+    if user is None:
+        return HttpResponse('Authentication required', status=401)
+
+    try:
+        department, device, last_id, backlog = stream_options(
+            request.GET, request.META.get('HTTP_LAST_EVENT_ID'))
+    except ValueError as e:
+        return HttpResponse(str(e), status=400)
+    visible = _visibility_filter(user, department, device)
+
+    def stream():
+        nonlocal last_id
+        yield f'retry: {settings.SSE_RETRY_MS}\n\n'
+
+        if last_id is None:
+            # Fresh connection: send recent punches, then resume from "now"
+            last_id = events.current_id(CHANNEL)
+            for payload in _recent_punches(user, department, device, backlog):
+                yield _format('punch', payload)
+            yield _format('ready', {}, event_id=last_id)
+
+        for event in events.listen(CHANNEL, last_id,
+                                   timeout=settings.SSE_HEARTBEAT,
+                                   duration=settings.SSE_MAX_DURATION):
+            if event is None:
+                yield ': ping\n\n'
+            elif visible(event.data):
+                yield _format(event.type, event.data, event_id=event.id)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # disable nginx buffering
+    return response
@@ -0,0 +1,168 @@
+"""
+Live attendance feed for the async pool (see iclock_server/asgi.py)
+
+A dashboard keeps its stream open for SSE_MAX_DURATION seconds and
+reconnects at once, so on sync workers every open dashboard held a
+worker. Here a stream is a coroutine: one listener thread per process
+follows the punch channel and hands each event to the queues of the open
+streams. Authentication and the seed punches are database work and run
+in the pool of apps.devices.iclock_async.run_db.
+
+Django 3.2 iterates a StreamingHttpResponse synchronously on the event
+loop, so the feed is a plain ASGI application rather than a view.
+"""
+import asyncio
+import logging
+import threading
+import time
+from django.conf import settings
+from django.http import QueryDict
+from apps.core import events
+from apps.devices.iclock_async import run_db
+from .stream import CHANNEL, _format, _recent_punches, _visibility_filter, authenticate, stream_options
+
+logger = logging.getLogger(__name__)
+
+STREAM_PATH = '/api/attendance/stream/'
+
+
+class PunchFanout:
+    """Delivers punch events to the queues of the streams open in this process"""
+
+    def __init__(self):
+        self._queues = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._listen, name='attendance-stream', daemon=True)
+                self._thread.start()
+
+    def _listen(self):
+        # From the start of the backlog: streams skip what they have already sent
+        last_id = 0
+        while True:
+            try:
+                for event in events.listen(CHANNEL, last_id, timeout=15, duration=3600):
+                    if event is not None:
+                        last_id = event.id
+                        self._deliver(event)
+            except Exception as e:
+                logger.warning(f"Attendance stream listener failed, retrying: {str(e)}")
+                time.sleep(5)
+
+    def _deliver(self, event):
+        with self._lock:
+            queues = list(self._queues)
+        for loop, queue in queues:
+            loop.call_soon_threadsafe(queue.put_nowait, event)
+
+    def subscribe(self):
+        """A queue receiving every event published from now on"""
+        self._start()
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue())
+        with self._lock:
+            self._queues.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._queues.discard(subscriber)
+
+
+fanout = PunchFanout()
+
+
+def _session_key(scope):
+    for name, value in scope['headers']:
+        if name == b'cookie':
+            for cookie in value.decode('latin-1').split(';'):
+                key, _, session_key = cookie.strip().partition('=')
+                if key == settings.SESSION_COOKIE_NAME:
+                    return session_key
+    return None
+
+
+async def _disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def _respond(send, status, body):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'text/plain; charset=utf-8')]})
+    await send({'type': 'http.response.body', 'body': body.encode()})
+
+
+async def stream_application(scope, receive, send):
+    """
+    Stream new punches as Server-Sent Events
+    Same parameters and events as stream.punch_stream.
+    """
+    if scope['method'] != 'GET':
+        return await _respond(send, 405, 'Method not allowed')
+    params = QueryDict(scope['query_string'].decode('latin-1'))
+    headers = dict(scope['headers'])
+
+    user = await run_db(None, authenticate, params, _session_key(scope))
+    if user is None:
+        return await _respond(send, 401, 'Authentication required')
+    try:
+        department, device, last_id, backlog = stream_options(
+            params, headers.get(b'last-event-id', b'').decode('latin-1'))
+    except ValueError as e:
+        return await _respond(send, 400, str(e))
+    visible = _visibility_filter(user, department, device)
+
+    # Subscribe before reading the resume point so nothing falls in between
+    subscriber = fanout.subscribe()
+    disconnected = asyncio.ensure_future(_disconnect(receive))
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),  # disable nginx buffering
+        ]})
+
+        async def write(chunk):
+            await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+
+        await write(f'retry: {settings.SSE_RETRY_MS}\n\n')
+        if last_id is None:
+            # Fresh connection: send recent punches, then resume from "now"
+            last_id = await run_db(None, events.current_id, CHANNEL)
+            for payload in await run_db(None, _recent_punches, user, department, device, backlog):
+                await write(_format('punch', payload))
+            await write(_format('ready', {}, event_id=last_id))
+        else:
+            for event in await run_db(None, events.since, CHANNEL, last_id):
+                last_id = event.id
+                if visible(event.data):
+                    await write(_format(event.type, event.data, event_id=event.id))
+
+        deadline = time.monotonic() + settings.SSE_MAX_DURATION
+        queue = subscriber[1]
+        while not disconnected.done():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            received = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({received, disconnected}, timeout=min(settings.SSE_HEARTBEAT, remaining),
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if received not in done:
+                received.cancel()
+                if not done:
+                    await write(': ping\n\n')
+                continue
+            event = received.result()
+            if event.id > last_id:
+                last_id = event.id
+                if visible(event.data):
+                    await write(_format(event.type, event.data, event_id=event.id))
+        if not disconnected.done():
+            await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        fanout.unsubscribe(subscriber)
+        disconnected.cancel()
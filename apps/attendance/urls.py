@@ -4,6 +4,7 @@ URL routing for attendance app
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import AttendanceRecordViewSet, DailyAttendanceViewSet, LeaveRequestViewSet
+from .stream import punch_stream, stream_ticket
 
 router = DefaultRouter()
 router.register(r'records', AttendanceRecordViewSet, basename='attendance-record')
@@ -11,5 +12,7 @@ router.register(r'daily', DailyAttendanceViewSet, basename='daily-attendance')
 router.register(r'leaves', LeaveRequestViewSet, basename='leave-request')
 
 urlpatterns = [
+    path('stream/', punch_stream, name='attendance-stream'),
+    path('stream/ticket/', stream_ticket, name='attendance-stream-ticket'),
     path('', include(router.urls)),
 ]
@@ -2,14 +2,24 @@
 API Views for Attendance Management
 """
 from rest_framework import viewsets, status
+from rest_framework.exceptions import ValidationError
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from django.conf import settings
+from django.core.files.uploadedfile import InMemoryUploadedFile
 from django.utils import timezone
-from django.db.models import Q
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.db.models import Count, Q, Sum
 from django.http import HttpResponse
 from datetime import datetime, timedelta
+from operator import itemgetter
+from apps.accounts.departments import visible_department_ids
+from apps.core.sharding import SiteDatabaseMixin, punch_database
+from apps.devices.models import Device
+from .imports import import_attlog, job_status, read_lines, start_import
 from .models import AttendanceRecord, DailyAttendance, LeaveRequest
+from .storage import store_punches
 from .serializers import (
     AttendanceRecordSerializer,
     DailyAttendanceSerializer,
@@ -17,9 +27,9 @@ from .serializers import (
 )
 
 
-class AttendanceRecordViewSet(viewsets.ModelViewSet):
-    """API endpoint for attendance records"""
-    queryset = AttendanceRecord.objects.all()
+class AttendanceRecordViewSet(SiteDatabaseMixin, viewsets.ModelViewSet):
+    """API endpoint for attendance records; ?site= selects a site database"""
+    queryset = AttendanceRecord.objects.select_related('user', 'device')
     serializer_class = AttendanceRecordSerializer
     permission_classes = [IsAuthenticated]
     filterset_fields = ['user', 'device', 'verify_type', 'verify_code', 'is_processed']
@@ -38,6 +48,26 @@ class AttendanceRecordViewSet(viewsets.ModelViewSet):
         # Regular users only see their own records
         return queryset.filter(user=user)
     
+    def create(self, request, *args, **kwargs):
+        """Store a punch; one that is already stored is returned as it is, with 200"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        record = AttendanceRecord(**serializer.validated_data)
+        if store_punches([record]):
+            data = self.get_serializer(record).data
+            return Response(data, status=status.HTTP_201_CREATED, headers=self.get_success_headers(data))
+        existing = AttendanceRecord.objects.db_manager(punch_database(record) or DEFAULT_DB_ALIAS).select_related(
+            'user', 'device').get(user=record.user, device=record.device, timestamp=record.timestamp)
+        return Response(self.get_serializer(existing).data)
+    
+    def perform_update(self, serializer):
+        # Moving a punch onto another stored one breaks the (user, device, timestamp) key
+        try:
+            with transaction.atomic(using=serializer.instance._state.db):
+                serializer.save()
+        except IntegrityError:
+            raise ValidationError({'non_field_errors': ['This punch is already stored.']})
+    
     @action(detail=False, methods=['post'])
     def bulk_create(self, request):
         """Bulk create attendance records (for device sync)"""
@@ -49,8 +79,9 @@ class AttendanceRecordViewSet(viewsets.ModelViewSet):
         
         serializer = self.get_serializer(data=request.data, many=True)
         if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            # Records that are already stored are skipped and left out of the response
+            created = store_punches([AttendanceRecord(**item) for item in serializer.validated_data])
+            return Response(self.get_serializer(created, many=True).data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
     @action(detail=False, methods=['get'])
@@ -83,12 +114,14 @@ class AttendanceRecordViewSet(viewsets.ModelViewSet):
         # Generate .dat file content
         # Format: PIN\tDateTime\tStatus\tVerifyType\tWorkCode
         lines = []
-        for record in queryset:
-            pin = record.user.employee_id or record.user.username
-            datetime_str = record.timestamp.strftime('%Y-%m-%d %H:%M:%S')
-            status_code = record.verify_code
-            verify_type = record.verify_type
-            work_code = record.work_code or '0'
+        rows = self.gather(queryset.order_by('-timestamp').values_list(
+            'user__employee_id', 'user__username', 'timestamp',
+            'verify_code', 'verify_type', 'work_code'
+        ), key=itemgetter(2), reverse=True)
+        for employee_id, username, timestamp, status_code, verify_type, work_code in rows.iterator():
+            pin = employee_id or username
+            datetime_str = timestamp.strftime('%Y-%m-%d %H:%M:%S')
+            work_code = work_code or '0'
             
             line = f"{pin}\t{datetime_str}\t{status_code}\t{verify_type}\t{work_code}"
             lines.append(line)
@@ -103,10 +136,59 @@ class AttendanceRecordViewSet(viewsets.ModelViewSet):
         
         return response
 
+    @action(detail=False, methods=['post'])
+    def import_attlog(self, request):
+        """
+        Import an x_attlog.dat file pulled from a device over USB
+        Form fields: file, device (id or serial number)
+        Punches already stored are skipped. Small files are imported at
+        once; larger ones by a background job, reported by import_attlog/<job>/.
+        """
+        if not request.user.is_admin:
+            return Response(
+                {'error': 'Only admins can import attendance logs.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': 'file is required.'}, status=status.HTTP_400_BAD_REQUEST)
+        if upload.size > settings.ATTLOG_IMPORT_MAX_BYTES:
+            return Response(
+                {'error': f'File is larger than {settings.ATTLOG_IMPORT_MAX_BYTES} bytes; '
+                          f'use "manage.py import_attlog" instead.'},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+        device_id = str(request.data.get('device', ''))
+        device = Device.objects.filter(
+            Q(serial_number=device_id) | Q(pk=int(device_id) if device_id.isdigit() else None)
+        ).first()
+        if device is None:
+            return Response({'error': 'Unknown device.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Django keeps uploads up to FILE_UPLOAD_MAX_MEMORY_SIZE in memory: those are quick to import
+        if isinstance(upload, InMemoryUploadedFile):
+            return Response(import_attlog(device, read_lines(upload.file), source=upload.name))
+        job = start_import(device, upload)
+        return Response(job_status(job), status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['get'], url_path=r'import_attlog/(?P<job>[0-9a-f]{32})')
+    def import_attlog_status(self, request, job=None):
+        """Progress or summary of a background attendance log import"""
+        if not request.user.is_admin:
+            return Response(
+                {'error': 'Only admins can import attendance logs.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        job = job_status(job)
+        if job is None:
+            return Response({'error': 'Unknown import.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(job)
+
 
 class DailyAttendanceViewSet(viewsets.ModelViewSet):
-    """API endpoint for daily attendance"""
-    queryset = DailyAttendance.objects.all()
+    """API endpoint for daily attendance (always on the primary database)"""
+    queryset = DailyAttendance.objects.select_related('user')
     serializer_class = DailyAttendanceSerializer
     permission_classes = [IsAuthenticated]
     filterset_fields = ['user', 'date', 'status', 'is_approved']
@@ -125,7 +207,7 @@ class DailyAttendanceViewSet(viewsets.ModelViewSet):
         # Managers see their department
         if user.is_manager:
             return queryset.filter(
-                Q(user__department=user.department) | Q(user=user)
+                Q(user__department_id__in=visible_department_ids(user)) | Q(user=user)
             )
         
         # Regular users only see their own records
@@ -167,33 +249,28 @@ class DailyAttendanceViewSet(viewsets.ModelViewSet):
         if user_id:
             queryset = queryset.filter(user_id=user_id)
         
-        # Calculate statistics
-        total_days = queryset.count()
-        present_days = queryset.filter(status='present').count()
-        late_days = queryset.filter(status='late').count()
-        absent_days = queryset.filter(status='absent').count()
-        leave_days = queryset.filter(status='leave').count()
-        
-        total_late_minutes = sum([a.late_minutes for a in queryset])
-        total_work_hours = sum([float(a.work_hours) for a in queryset])
+        # Calculate statistics in one aggregate query
+        summary = queryset.aggregate(
+            total_days=Count('id'),
+            present_days=Count('id', filter=Q(status='present')),
+            late_days=Count('id', filter=Q(status='late')),
+            absent_days=Count('id', filter=Q(status='absent')),
+            leave_days=Count('id', filter=Q(status='leave')),
+            total_late_minutes=Sum('late_minutes'),
+            total_work_hours=Sum('work_hours'),
+        )
+        summary['total_late_minutes'] = summary['total_late_minutes'] or 0
+        summary['total_work_hours'] = round(float(summary['total_work_hours'] or 0), 2)
         
         return Response({
-            'summary': {
-                'total_days': total_days,
-                'present_days': present_days,
-                'late_days': late_days,
-                'absent_days': absent_days,
-                'leave_days': leave_days,
-                'total_late_minutes': total_late_minutes,
-                'total_work_hours': round(total_work_hours, 2)
-            },
+            'summary': summary,
             'records': self.get_serializer(queryset, many=True).data
         })
 
 
 class LeaveRequestViewSet(viewsets.ModelViewSet):
     """API endpoint for leave requests"""
-    queryset = LeaveRequest.objects.all()
+    queryset = LeaveRequest.objects.select_related('user', 'reviewed_by')
     serializer_class = LeaveRequestSerializer
     permission_classes = [IsAuthenticated]
     filterset_fields = ['user', 'leave_type', 'status']
@@ -212,7 +289,7 @@ class LeaveRequestViewSet(viewsets.ModelViewSet):
         # Managers see their department
         if user.is_manager:
             return queryset.filter(
-                Q(user__department=user.department) | Q(user=user)
+                Q(user__department_id__in=visible_department_ids(user)) | Q(user=user)
             )
         
         # Regular users only see their own requests
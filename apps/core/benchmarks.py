@@ -0,0 +1,272 @@
+"""
+Benchmarks of the hot paths, run by the run_benchmarks command
+
+Each benchmark is a function decorated with @benchmark. It receives the
+Dataset and returns a callable, and only that callable is timed. Settings
+a benchmark depends on are overridden for its whole run. Anything
+written to the database while timing is rolled back after each round,
+and logging below WARNING is muted so console output does not skew it.
+The results are plain dicts and can be stored as JSON and compared
+between commits.
+"""
+import logging
+import statistics
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db import connection, reset_queries, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import resolve, reverse
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+from apps.accounts.models import User
+from apps.attendance.models import AttendanceRecord, DailyAttendance
+from apps.attendance.storage import rollup_daily
+from apps.devices.admission import AdmissionControl
+from apps.devices.ingest import ingest_punches
+from apps.devices.models import Device, DeviceUser
+from apps.devices.protocol import TIMESTAMP_FORMAT, parse_attlog
+
+BENCHMARKS = {}
+
+UPLOAD_SIZE = 50  # punches per simulated device upload
+PARSE_LINES = 1000
+ADMISSION_CHECKS = 100
+
+
+def benchmark(name, items=1, rounds=None, overrides=None):
+    """
+    Register a benchmark; items is the number of units (lines, rows) one call handles
+    overrides are settings applied while the benchmark is set up and timed.
+    """
+    def register(setup):
+        BENCHMARKS[name] = {'setup': setup, 'items': items, 'rounds': rounds, 'overrides': overrides or {}}
+        return setup
+    return register
+
+
+@dataclass
+class Dataset:
+    """Data created by generate_load_data that the benchmarks run against"""
+    prefix: str
+    device: Device
+    pins: list
+    manager: User
+    admin: User
+    first_day: object
+    last_day: object
+
+    @classmethod
+    def load(cls, prefix):
+        """Find the dataset for this prefix, or return None when it was not generated"""
+        device = Device.objects.filter(serial_number__startswith=prefix.upper()).order_by('serial_number').first()
+        users = User.objects.filter(username__startswith=f'{prefix}_')
+        manager = users.filter(role='manager').order_by('username').first()
+        days = DailyAttendance.objects.filter(user__in=users).order_by('date').values_list('date', flat=True)
+        if device is None or manager is None or not days.exists():
+            return None
+        pins = list(DeviceUser.objects.filter(device=device).order_by('device_user_id')
+                    .values_list('device_user_id', flat=True)[:UPLOAD_SIZE])
+        # Unsaved superuser: API calls see everything without touching auth tables
+        admin = User(username=f'{prefix}_benchmark', role='admin', is_staff=True, is_superuser=True)
+        return cls(prefix, device, pins, manager, admin, days.first(), days.last())
+
+    def counts(self):
+        users = User.objects.filter(username__startswith=f'{self.prefix}_')
+        return {
+            'users': users.count(),
+            'devices': Device.objects.filter(serial_number__startswith=self.prefix.upper()).count(),
+            'punches': AttendanceRecord.objects.filter(user__in=users).count(),
+            'daily': DailyAttendance.objects.filter(user__in=users).count(),
+            'first_day': self.first_day.isoformat(),
+            'last_day': self.last_day.isoformat(),
+        }
+
+    def upload_body(self, count, day=None):
+        """Bare ATTLOG lines as a device sends them, on the day after the dataset by default"""
+        day = day or self.last_day + timedelta(days=1)
+        start = datetime.combine(day, datetime.min.time()) + timedelta(hours=7)
+        return '\n'.join(
+            f'{self.pins[n % len(self.pins)]}\t'
+            f'{(start + timedelta(seconds=17 * n)).strftime(TIMESTAMP_FORMAT)}\t0\t1\t0\t0\t0'
+            for n in range(count)
+        ) + '\n'
+
+    def month(self):
+        """Query string for the last 30 days of the dataset"""
+        return f'start_date={self.last_day - timedelta(days=29)}&end_date={self.last_day}'
+
+
+def run(name, dataset, rounds, warmup=1):
+    """Time one benchmark; returns its result dict"""
+    spec = BENCHMARKS[name]
+    rounds = spec['rounds'] or rounds
+    timings = []
+    queries = 0
+    logging.disable(logging.INFO)
+    try:
+        with override_settings(**spec['overrides']):
+            call = spec['setup'](dataset)
+            for n in range(warmup + rounds):
+                reset_queries()  # a full queries log would hide new queries
+                with transaction.atomic():
+                    with CaptureQueriesContext(connection) as captured:
+                        start = time.perf_counter()
+                        call()
+                        elapsed = time.perf_counter() - start
+                    transaction.set_rollback(True)
+                if n >= warmup:
+                    timings.append(elapsed * 1000)
+                    queries = len(captured)
+    finally:
+        logging.disable(logging.NOTSET)
+
+    timings.sort()
+    median = statistics.median(timings)
+    return {
+        'rounds': rounds,
+        'items': spec['items'],
+        'median_ms': round(median, 3),
+        'min_ms': round(timings[0], 3),
+        'max_ms': round(timings[-1], 3),
+        'stdev_ms': round(statistics.stdev(timings), 3) if len(timings) > 1 else 0.0,
+        'per_item_us': round(median * 1000 / spec['items'], 2) if spec['items'] > 1 else None,
+        'queries': queries,
+    }
+
+
+def compare(results, baseline, threshold, min_delta_ms=1.0):
+    """
+    Regressions of results against a baseline
+    A benchmark regresses when its median is more than threshold (a
+    fraction) and min_delta_ms slower, or when it runs more queries.
+    """
+    regressions = []
+    for name, result in results['benchmarks'].items():
+        before = baseline.get('benchmarks', {}).get(name)
+        if not before:
+            continue
+        slower = result['median_ms'] - before['median_ms']
+        if slower > min_delta_ms and result['median_ms'] > before['median_ms'] * (1 + threshold):
+            regressions.append(f"{name}: {before['median_ms']} ms -> {result['median_ms']} ms")
+        if result['queries'] > before['queries']:
+            regressions.append(f"{name}: {before['queries']} queries -> {result['queries']} queries")
+    return regressions
+
+
+def _api(view_name, user, query=''):
+    """Callable that runs an API view in-process and renders the response"""
+    path = reverse(view_name)
+    match = resolve(path)
+    factory = APIRequestFactory()
+
+    def call():
+        request = factory.get(f'{path}?{query}')
+        force_authenticate(request, user=user)
+        response = match.func(request, *match.args, **match.kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        assert response.status_code == 200, f'{path}: HTTP {response.status_code}'
+    return call
+
+
+@benchmark('parse_attlog', items=PARSE_LINES, rounds=50)
+def parse_lines(dataset):
+    body = dataset.upload_body(PARSE_LINES)
+    return lambda: parse_attlog(body, table='ATTLOG')
+
+
+@benchmark('ingest_new', items=UPLOAD_SIZE)
+def ingest_new(dataset):
+    punches = parse_attlog(dataset.upload_body(UPLOAD_SIZE), table='ATTLOG')
+    return lambda: ingest_punches(dataset.device, punches)
+
+
+@benchmark('ingest_duplicates', items=UPLOAD_SIZE)
+def ingest_duplicates(dataset):
+    # Devices resend their last upload after a timeout: every punch exists already
+    pins = dict(DeviceUser.objects.filter(device=dataset.device).values_list('user_id', 'device_user_id'))
+    rows = (AttendanceRecord.objects.filter(device=dataset.device, user_id__in=pins)
+            .order_by('-timestamp').values_list('user_id', 'timestamp')[:UPLOAD_SIZE])
+    body = ''.join(
+        f'{pins[user_id]}\t{timezone.localtime(timestamp).strftime(TIMESTAMP_FORMAT)}\t0\t1\t0\t0\t0\n'
+        for user_id, timestamp in rows
+    )
+    punches = parse_attlog(body, table='ATTLOG')
+    return lambda: ingest_punches(dataset.device, punches)
+
+
+# Admission is timed on its own (upload_admission): the device's token
+# bucket would refuse repeated rounds with "ERROR: busy"
+@benchmark('cdata_upload', items=UPLOAD_SIZE, overrides={'ICLOCK_ADMISSION_ENABLED': False})
+def cdata_upload(dataset):
+    body = dataset.upload_body(UPLOAD_SIZE).encode()
+    path = f'{reverse("iclock-cdata")}?SN={dataset.device.serial_number}&table=ATTLOG&Stamp=1'
+    view = resolve(reverse('iclock-cdata')).func
+    factory = APIRequestFactory()
+
+    def call():
+        response = view(factory.generic('POST', path, body, content_type='text/plain'))
+        assert response.status_code == 200 and response.content == b'OK', response.content
+    return call
+
+
+@benchmark('upload_admission', items=ADMISSION_CHECKS, overrides={'ICLOCK_ADMISSION_ENABLED': True})
+def upload_admission(dataset):
+    # The production limits, with a bucket that never runs dry
+    control = AdmissionControl(rate=ADMISSION_CHECKS, burst=ADMISSION_CHECKS * 1000,
+                               max_concurrent=settings.ICLOCK_MAX_CONCURRENT_UPLOADS,
+                               lease_seconds=settings.ICLOCK_UPLOAD_LEASE_SECONDS)
+    sn = dataset.device.serial_number
+
+    def call():
+        for _ in range(ADMISSION_CHECKS):
+            with control.admit(sn) as ticket:
+                assert ticket.admitted, ticket.reason
+    return call
+
+
+@benchmark('daily_rollup', items=200)
+def daily_rollup(dataset):
+    # Fold the latest punches into their daily summaries, as saving a punch does
+    records = list(AttendanceRecord.objects.filter(device=dataset.device).order_by('-timestamp')[:200])
+
+    def call():
+        for record in records:
+            record.process_record()
+    return call
+
+
+@benchmark('daily_rollup_batch', items=200)
+def daily_rollup_batch(dataset):
+    # The same punches folded in one batch, as ingest does
+    records = list(AttendanceRecord.objects.filter(device=dataset.device).order_by('-timestamp')[:200])
+    return lambda: rollup_daily(records)
+
+
+@benchmark('daily_report')
+def daily_report(dataset):
+    return _api('daily-attendance-report', dataset.admin, dataset.month())
+
+
+@benchmark('daily_report_manager')
+def daily_report_manager(dataset):
+    return _api('daily-attendance-report', dataset.manager, dataset.month())
+
+
+@benchmark('download_attlog')
+def download_attlog(dataset):
+    last = dataset.last_day
+    return _api('attendance-record-download-attlog', dataset.admin,
+                f'start_date={last - timedelta(days=6)}&end_date={last}')
+
+
+for _name in ('attendance-record-list', 'daily-attendance-list', 'leave-request-list',
+              'user-list', 'device-list', 'device-user-list'):
+    benchmark(f'api:{_name}')(lambda dataset, _name=_name: _api(_name, dataset.admin))
+
+
+@benchmark('api:daily-attendance-list:manager')
+def daily_list_manager(dataset):
+    return _api('daily-attendance-list', dataset.manager)
@@ -0,0 +1,172 @@
+"""
+Read replica routing
+
+Reads go to the primary unless they run inside replica_reads(): the
+REPLICA_READ_VIEWS (see ReplicaReadMiddleware) and report jobs that opt
+in. Writes, and reads inside a transaction on the primary, always use the
+primary. A client that wrote is pinned to the primary for
+REPLICA_PIN_SECONDS, so it reads its own writes despite replication lag.
+
+A replica that cannot be reached is skipped for REPLICA_RETRY_SECONDS and
+its reads fall back to another replica or the primary. Replicas are
+configured with DB_REPLICA_HOSTS; without any, the router does nothing.
+"""
+import hashlib
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.utils import DatabaseError
+from . import metrics
+from .cache import LocalCache
+from .middleware import view_name
+
+logger = logging.getLogger(__name__)
+
+_use_replica = ContextVar('use_replica', default=False)
+_wrote = ContextVar('wrote', default=None)
+_local_pins = LocalCache(maxsize=10000)  # without redis, pins only hold within one worker
+PIN_KEY = 'db:pin:{client}'
+# Authentication must see new logins and tokens at once, whatever the lag
+PRIMARY_ONLY_APPS = {'sessions', 'authtoken', 'admin', 'contenttypes', 'auth'}
+
+
+@contextmanager
+def replica_reads():
+    """Send the reads of this block to a replica when one is available"""
+    token = _use_replica.set(True)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+@contextmanager
+def track_writes():
+    """Yields a dict whose 'wrote' key is set when the block routes a write"""
+    state = {'wrote': False}
+    token = _wrote.set(state)
+    try:
+        yield state
+    finally:
+        _wrote.reset(token)
+
+
+class ReplicaRouter:
+    """Routes opted-in reads to healthy replicas and everything else to the primary"""
+
+    def __init__(self):
+        self._down_until = {}
+        self._lock = threading.Lock()
+
+    def _available(self, alias):
+        with self._lock:
+            if self._down_until.get(alias, 0) > time.monotonic():
+                return False
+        try:
+            connections[alias].ensure_connection()
+            return True
+        except DatabaseError as e:
+            with self._lock:
+                self._down_until[alias] = time.monotonic() + settings.REPLICA_RETRY_SECONDS
+            metrics.REPLICA_FALLBACKS.inc(alias=alias)
+            logger.warning(f"Replica {alias} unavailable for {settings.REPLICA_RETRY_SECONDS}s: {str(e)}")
+            return False
+
+    def db_for_read(self, model, **hints):
+        if not settings.DATABASE_REPLICAS or not _use_replica.get():
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None  # see this transaction's own writes
+        if model._meta.app_label in PRIMARY_ONLY_APPS or model._meta.label == settings.AUTH_USER_MODEL:
+            return None
+        replicas = list(settings.DATABASE_REPLICAS)
+        random.shuffle(replicas)
+        for alias in replicas:
+            if self._available(alias):
+                return alias
+        return None
+
+    def db_for_write(self, model, **hints):
+        state = _wrote.get()
+        if state is not None:
+            state['wrote'] = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+def _client(request):
+    """Stable key for the client: its token, session or address"""
+    identity = (request.META.get('HTTP_AUTHORIZATION')
+                or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+                or request.META.get('REMOTE_ADDR', ''))
+    return PIN_KEY.format(client=hashlib.sha1(identity.encode()).hexdigest())
+
+
+def _pin(request):
+    key = _client(request)
+    if settings.CACHE_BACKEND == 'redis':
+        try:
+            cache.set(key, 1, timeout=settings.REPLICA_PIN_SECONDS)
+            return
+        except Exception as e:
+            logger.warning(f"Failed to pin client to the primary: {str(e)}")
+    _local_pins.set(key, 1, ttl=settings.REPLICA_PIN_SECONDS)
+
+
+def _pinned(request):
+    key = _client(request)
+    if _local_pins.get(key):
+        return True
+    if settings.CACHE_BACKEND == 'redis':
+        try:
+            return bool(cache.get(key))
+        except Exception:
+            return True  # cannot tell: stay on the primary
+    return False
+
+
+class ReplicaReadMiddleware:
+    """
+    Serves GET and HEAD requests to REPLICA_READ_VIEWS from a replica
+    Requests that write pin their client to the primary.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+        with track_writes() as state:
+            try:
+                response = self.get_response(request)
+            finally:
+                token = getattr(request, '_replica_token', None)
+                if token is not None:
+                    _use_replica.reset(token)
+        if state['wrote']:
+            _pin(request)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (settings.DATABASE_REPLICAS and request.method in ('GET', 'HEAD')
+                and view_name(request) in settings.REPLICA_READ_VIEWS and not _pinned(request)):
+            request._replica_token = _use_replica.set(True)
+        return None
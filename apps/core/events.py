@@ -0,0 +1,190 @@
+"""
+Lightweight event bus for live feeds
+
+Events are published to redis pub/sub when the redis cache backend is
+configured, so every worker sees every event. Otherwise an in-process
+broker is used, which only delivers events published by the same
+process (fine for runserver, not for multi-worker deployments).
+
+Every event gets a monotonically increasing id per channel and the last
+EVENTS_BACKLOG events are kept so subscribers can resume after a
+reconnect (SSE Last-Event-ID).
+"""
+import json
+import logging
+import threading
+import time
+from collections import deque
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'iclock:events'
+
+
+class Event:
+    """A published event"""
+    __slots__ = ('id', 'type', 'data')
+
+    def __init__(self, id, type, data):
+        self.id = id
+        self.type = type
+        self.data = data
+
+    def to_json(self):
+        return json.dumps({'id': self.id, 'type': self.type, 'data': self.data})
+
+    @classmethod
+    def from_json(cls, raw):
+        payload = json.loads(raw)
+        return cls(payload['id'], payload['type'], payload['data'])
+
+
+class LocalBroker:
+    """In-process broker used when redis is not available"""
+
+    def __init__(self, backlog):
+        self._cond = threading.Condition()
+        self._backlog = backlog
+        self._events = {}
+        self._seq = {}
+
+    def publish_many(self, channel, event_type, payloads):
+        with self._cond:
+            events = self._events.setdefault(channel, deque(maxlen=self._backlog))
+            for data in payloads:
+                self._seq[channel] = self._seq.get(channel, 0) + 1
+                events.append(Event(self._seq[channel], event_type, data))
+            self._cond.notify_all()
+
+    def current_id(self, channel):
+        with self._cond:
+            return self._seq.get(channel, 0)
+
+    def since(self, channel, last_id):
+        with self._cond:
+            return [e for e in self._events.get(channel, ()) if e.id > last_id]
+
+    def listen(self, channel, last_id, timeout, duration):
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._seq.get(channel, 0) > last_id,
+                    timeout=min(timeout, max(deadline - time.monotonic(), 0))
+                )
+                pending = [e for e in self._events.get(channel, ()) if e.id > last_id]
+            if not pending:
+                yield None
+                continue
+            for event in pending:
+                last_id = event.id
+                yield event
+
+
+class RedisBroker:
+    """Broker backed by redis pub/sub and a capped backlog list"""
+
+    def __init__(self, backlog):
+        self._backlog = backlog
+
+    def _conn(self):
+        from django_redis import get_redis_connection
+        return get_redis_connection('default')
+
+    def publish_many(self, channel, event_type, payloads):
+        if not payloads:
+            return
+        conn = self._conn()
+        last_id = conn.incrby(f'{KEY_PREFIX}:{channel}:seq', len(payloads))
+        first_id = last_id - len(payloads) + 1
+
+        pipe = conn.pipeline(transaction=False)
+        for offset, data in enumerate(payloads):
+            raw = Event(first_id + offset, event_type, data).to_json()
+            pipe.lpush(f'{KEY_PREFIX}:{channel}:backlog', raw)
+            pipe.publish(f'{KEY_PREFIX}:{channel}', raw)
+        pipe.ltrim(f'{KEY_PREFIX}:{channel}:backlog', 0, self._backlog - 1)
+        pipe.execute()
+
+    def current_id(self, channel):
+        return int(self._conn().get(f'{KEY_PREFIX}:{channel}:seq') or 0)
+
+    def since(self, channel, last_id):
+        return self._replay(self._conn(), channel, last_id)
+
+    def _replay(self, conn, channel, last_id):
+        raw_events = conn.lrange(f'{KEY_PREFIX}:{channel}:backlog', 0, -1)
+        events = [Event.from_json(raw) for raw in reversed(raw_events)]
+        return [e for e in events if e.id > last_id]
+
+    def listen(self, channel, last_id, timeout, duration):
+        conn = self._conn()
+        pubsub = conn.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(f'{KEY_PREFIX}:{channel}')
+        try:
+            # Replay after subscribing so nothing published in between is lost
+            for event in self._replay(conn, channel, last_id):
+                last_id = event.id
+                yield event
+
+            deadline = time.monotonic() + duration
+            while time.monotonic() < deadline:
+                message = pubsub.get_message(timeout=timeout)
+                if message is None:
+                    yield None
+                    continue
+                event = Event.from_json(message['data'])
+                if event.id <= last_id:
+                    continue
+                last_id = event.id
+                yield event
+        finally:
+            pubsub.close()
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """Return the process-wide broker"""
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                if settings.CACHE_BACKEND == 'redis':
+                    _broker = RedisBroker(settings.EVENTS_BACKLOG)
+                else:
+                    _broker = LocalBroker(settings.EVENTS_BACKLOG)
+    return _broker
+
+
+def publish(channel, event_type, payloads):
+    """
+    Publish a batch of events
+    Failures are logged and swallowed so publishers never fail because of
+    the live feed.
+    """
+    try:
+        get_broker().publish_many(channel, event_type, payloads)
+    except Exception as e:
+        logger.warning(f"Failed to publish {len(payloads)} {event_type} events: {str(e)}")
+
+
+def current_id(channel):
+    """Id of the latest event published on a channel"""
+    return get_broker().current_id(channel)
+
+
+def since(channel, last_id):
+    """Kept events newer than last_id, without waiting for new ones"""
+    return get_broker().since(channel, last_id)
+
+
+def listen(channel, last_id=0, timeout=15, duration=300):
+    """
+    Yield events newer than last_id for up to duration seconds
+    Yields None every timeout seconds without events (for heartbeats).
+    """
+    return get_broker().listen(channel, last_id, timeout, duration)
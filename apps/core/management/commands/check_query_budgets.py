@@ -0,0 +1,102 @@
+"""
+Check that API endpoints stay within their query budgets
+Calls the list and detail endpoint (with the first object) of every
+viewset registered on the API routers and the main read-only actions as a
+superuser, counts the queries and compares them with QUERY_BUDGETS.
+Nothing is written: each call runs in a transaction that is rolled back.
+An endpoint that raises is reported and the check goes on. Exits with
+status 1 when a budget is exceeded or an endpoint fails, so it can run in
+CI against a database with sample data.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.urls import resolve, reverse
+from rest_framework.test import APIRequestFactory, force_authenticate
+from apps.accounts.models import User
+from apps.accounts.urls import router as accounts_router
+from apps.attendance.urls import router as attendance_router
+from apps.core.middleware import query_budget
+from apps.core.testing import assert_max_queries
+from apps.devices.urls import router as devices_router
+
+ROUTERS = [accounts_router, attendance_router, devices_router]
+
+# Read-only actions and function views worth guarding besides the viewsets
+EXTRA_ENDPOINTS = [
+    'user-me',
+    'daily-attendance-report',
+    'attendance-record-download-attlog',
+    'stats',
+    'iclock-department',
+    'iclock-employee',
+    'iclock-transaction',
+]
+
+
+class Command(BaseCommand):
+    help = 'Count queries per API endpoint and compare them with QUERY_BUDGETS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Username to call endpoints as (default: first superuser)')
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['user'])
+        factory = APIRequestFactory()
+        failures = 0
+        errors = 0
+
+        for name, path in self.endpoints():
+            budget = query_budget(name)
+            request = factory.get(path)
+            force_authenticate(request, user=user)
+
+            try:
+                view = resolve(path)
+                with transaction.atomic():
+                    with assert_max_queries(budget if budget is not None else float('inf')) as queries:
+                        response = view.func(request, *view.args, **view.kwargs)
+                        if hasattr(response, 'render'):
+                            response.render()
+                    transaction.set_rollback(True)
+            except AssertionError:
+                failures += 1
+                self.stdout.write(self.style.ERROR(
+                    f'FAIL {name}: {len(queries)} queries, budget {budget} ({path})'
+                ))
+                for query in queries.captured_queries:
+                    self.stdout.write(f"    {query['sql']}")
+                continue
+            except Exception as e:
+                errors += 1
+                self.stdout.write(self.style.ERROR(f'ERROR {name}: {e.__class__.__name__}: {e} ({path})'))
+                continue
+
+            line = f'ok   {name}: {len(queries)} queries, budget {budget} (HTTP {response.status_code})'
+            if response.status_code >= 400:
+                line = self.style.WARNING(line)
+            self.stdout.write(line)
+
+        if failures or errors:
+            raise CommandError(f'{failures} endpoint(s) over budget, {errors} failed')
+        self.stdout.write(self.style.SUCCESS('All endpoints within budget.'))
+
+    def get_user(self, username):
+        users = User.objects.filter(is_active=True)
+        user = users.filter(username=username).first() if username else users.filter(is_superuser=True).first()
+        if user is None:
+            raise CommandError('No user to run the checks as; pass --user or create a superuser')
+        return user
+
+    def endpoints(self):
+        viewsets = sorted(
+            (basename, viewset) for router in ROUTERS for _, viewset, basename in router.registry
+        )
+        for basename, viewset in viewsets:
+            if hasattr(viewset, 'list'):
+                yield f'{basename}-list', reverse(f'{basename}-list')
+            if hasattr(viewset, 'retrieve') and viewset.queryset is not None:
+                obj = viewset.queryset.order_by('pk').first()
+                if obj is not None:
+                    yield f'{basename}-detail', reverse(f'{basename}-detail', kwargs={'pk': obj.pk})
+        for name in EXTRA_ENDPOINTS:
+            yield name, reverse(name)
@@ -0,0 +1,47 @@
+"""
+Create the trigram indexes behind apps.core.search on PostgreSQL
+Indexes UPPER(column) with gin_trgm_ops for the columns in
+SEARCH_INDEXES, which is what Django's case-insensitive lookups compare.
+Indexes are built CONCURRENTLY, so the command can run on a live
+database; existing ones are left alone (drop an index left INVALID by
+an interrupted build before running it again). Other databases are
+skipped.
+"""
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connections
+from apps.core.search import SEARCH_INDEXES
+from apps.core.sharding import attendance_databases
+
+
+class Command(BaseCommand):
+    help = 'Create pg_trgm GIN indexes for API and admin search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', action='append', default=[],
+                            help='Database alias (repeatable); default: the primary and the site databases')
+
+    def handle(self, *args, **options):
+        for alias in options['database'] or attendance_databases():
+            connection = connections[alias]
+            if connection.vendor != 'postgresql':
+                self.stdout.write(f'{alias}: not PostgreSQL, search runs without indexes')
+                continue
+            with connection.cursor() as cursor:
+                try:
+                    cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+                except DatabaseError as e:
+                    self.stderr.write(f'{alias}: cannot enable pg_trgm (needs a superuser once): {str(e)}')
+                    continue
+                for label, columns in SEARCH_INDEXES.items():
+                    meta = apps.get_model(label)._meta
+                    table = meta.db_table
+                    for column in (meta.get_field(name).column for name in columns):
+                        name = f'{table}_{column}_trgm'[:63]
+                        self.stdout.write(f'{alias}: {name}')
+                        cursor.execute(
+                            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {connection.ops.quote_name(name)} '
+                            f'ON {connection.ops.quote_name(table)} '
+                            f'USING gin (UPPER({connection.ops.quote_name(column)}::text) gin_trgm_ops)'
+                        )
+        self.stdout.write(self.style.SUCCESS('Search indexes are in place.'))
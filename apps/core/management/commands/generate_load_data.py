@@ -0,0 +1,371 @@
+"""
+Generate a large, realistic dataset for benchmarks and scale tests
+
+Creates departments, users, devices grouped into sites, DeviceUser
+mappings, and months of punches, daily summaries and leave requests.
+Users work one of several shift patterns. Punches include lateness,
+missed check-outs and double punches. The same --seed and arguments
+always produce the same data.
+
+Rows are written with COPY on PostgreSQL and bulk_create elsewhere. Every
+generated name starts with --prefix, so --clear can remove them again.
+Meant for disposable databases.
+"""
+import io
+import json
+import random
+import time as clock
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from apps.accounts.models import Department, User
+from apps.core import stats
+from apps.devices.models import Device, DeviceLog, DeviceUser
+from apps.devices.resolver import resolver
+from apps.attendance.models import AttendanceRecord, DailyAttendance, LeaveRequest
+
+# name, start time, length in hours, works on weekends, weight
+SHIFTS = [
+    ('office', time(8, 0), 9, False, 50),
+    ('day', time(9, 0), 8, False, 20),
+    ('evening', time(14, 0), 8, True, 15),
+    ('night', time(22, 0), 8, True, 15),
+]
+
+VERIFY_TYPES = [1, 3, 2, 0]  # fingerprint, face, card, password
+VERIFY_WEIGHTS = [70, 20, 8, 2]
+
+LEAVE_TYPES = ['annual', 'sick', 'personal', 'emergency', 'other']
+LEAVE_WEIGHTS = [45, 35, 12, 5, 3]
+
+PUNCH_FIELDS = ['user_id', 'device_id', 'timestamp', 'verify_type', 'verify_code',
+                'work_code', 'is_processed', 'processed_at', 'created_at']
+DAILY_FIELDS = ['user_id', 'date', 'check_in', 'check_out', 'status', 'work_hours',
+                'overtime_hours', 'late_minutes', 'early_leave_minutes', 'notes',
+                'is_approved', 'created_at', 'updated_at']
+LEAVE_FIELDS = ['user_id', 'leave_type', 'start_date', 'end_date', 'days_count', 'reason',
+                'status', 'reviewed_by_id', 'review_notes', 'reviewed_at',
+                'created_at', 'updated_at']
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    if value is True:
+        return 't'
+    if value is False:
+        return 'f'
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (list, dict)):
+        value = json.dumps(value)
+    if isinstance(value, str):
+        return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+    return str(value)
+
+
+class Writer:
+    """Buffers rows per model and writes them in batches"""
+
+    def __init__(self, use_copy, batch_size):
+        self.use_copy = use_copy
+        self.batch_size = batch_size
+        self.buffers = {}
+        self.counts = {}
+
+    def add(self, model, fields, row):
+        rows = self.buffers.setdefault(model, (fields, []))[1]
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            self.flush(model)
+
+    def flush(self, model=None):
+        models = [model] if model else list(self.buffers)
+        for current in models:
+            fields, rows = self.buffers.get(current, (None, []))
+            if not rows:
+                continue
+            with transaction.atomic():
+                if self.use_copy:
+                    self._copy(current, fields, rows)
+                else:
+                    current.objects.bulk_create(
+                        [current(**dict(zip(fields, row))) for row in rows],
+                        batch_size=1000
+                    )
+            self.counts[current] = self.counts.get(current, 0) + len(rows)
+            rows.clear()
+
+    def _copy(self, model, fields, rows):
+        columns = ', '.join(model._meta.get_field(field).column for field in fields)
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write('\t'.join(_copy_value(value) for value in row))
+            buffer.write('\n')
+        buffer.seek(0)
+        with connection.cursor() as cursor:
+            cursor.copy_expert(f'COPY {model._meta.db_table} ({columns}) FROM STDIN', buffer)
+
+
+class Command(BaseCommand):
+    help = 'Generate users, devices and months of attendance data for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--devices', type=int, default=20)
+        parser.add_argument('--devices-per-site', type=int, default=4,
+                            help='Users are registered on every device of their site')
+        parser.add_argument('--departments', type=int, default=12)
+        parser.add_argument('--months', type=int, default=3)
+        parser.add_argument('--end-date', help='Last day to generate (YYYY-MM-DD, default: yesterday)')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--prefix', default='load', help='Prefix for generated names')
+        parser.add_argument('--pin-start', type=int, default=500000,
+                            help='First employee id / device PIN')
+        parser.add_argument('--password', help='Usable password for all users (default: unusable)')
+        parser.add_argument('--batch-size', type=int, default=20000)
+        parser.add_argument('--no-copy', action='store_true',
+                            help='Use bulk_create even on PostgreSQL')
+        parser.add_argument('--clear', action='store_true',
+                            help='Delete data generated with this prefix and exit')
+
+    def handle(self, *args, **options):
+        self.prefix = options['prefix']
+        if options['clear']:
+            self.clear()
+            return
+
+        if User.objects.filter(username__startswith=f'{self.prefix}_').exists():
+            raise CommandError(f'Data with prefix "{self.prefix}" exists; use --clear first or another --prefix')
+
+        started = clock.monotonic()
+        rng = random.Random(options['seed'])
+        use_copy = connection.vendor == 'postgresql' and not options['no_copy']
+        self.writer = Writer(use_copy, options['batch_size'])
+        self.now = timezone.now()
+
+        end = (datetime.strptime(options['end_date'], '%Y-%m-%d').date()
+               if options['end_date'] else timezone.localdate() - timedelta(days=1))
+        start = end - timedelta(days=30 * options['months'] - 1)
+
+        departments = self.create_departments(options['departments'])
+        sites = self.create_devices(options['devices'], options['devices_per_site'])
+        users = self.create_users(rng, options, departments, sites)
+        self.create_device_users(users, sites)
+
+        leaves = self.create_leaves(rng, users, start, end)
+        self.create_attendance(rng, users, sites, leaves, start, end)
+        self.writer.flush()
+
+        # bulk writes skip signals: recount the dashboard and forget cached PINs
+        stats.invalidate()
+        resolver.invalidate_pins([user['pin'] for user in users])
+
+        elapsed = clock.monotonic() - started
+        punches = self.writer.counts.get(AttendanceRecord, 0)
+        self.stdout.write(f'Period: {start} to {end} ({"COPY" if use_copy else "bulk_create"})')
+        for model, count in self.writer.counts.items():
+            self.stdout.write(f'{model._meta.verbose_name_plural}: {count}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {punches} punches in {elapsed:.1f}s ({punches / max(elapsed, 0.001):.0f}/s).'
+        ))
+
+    def create_departments(self, count):
+        tops = max(1, count // 4)
+        created = []
+        for n in range(count):
+            parent = created[n % tops] if n >= tops else None
+            created.append(Department.objects.create(
+                name=f'{self.prefix} Department {n + 1}',
+                code=f'{self.prefix.upper()}-D{n + 1}',
+                parent=parent,
+            ))
+        return created
+
+    def create_devices(self, count, per_site):
+        serial_prefix = self.prefix.upper()
+        Device.objects.bulk_create([
+            Device(
+                serial_number=f'{serial_prefix}{n + 1:05d}',
+                name=f'{self.prefix} device {n + 1}',
+                location=f'Site {n // per_site + 1}',
+                ip_address=f'10.{(n // 65025) % 256}.{(n // 255) % 255}.{n % 255 + 1}',
+                status='offline',
+            )
+            for n in range(count)
+        ])
+        devices = Device.objects.filter(serial_number__startswith=serial_prefix).order_by('serial_number')
+        device_ids = list(devices.values_list('id', flat=True))
+        return [device_ids[i:i + per_site] for i in range(0, len(device_ids), per_site)]
+
+    def create_users(self, rng, options, departments, sites):
+        password = make_password(options['password']) if options['password'] else None
+        top_departments = [d for d in departments if d.parent_id is None]
+        shift_weights = [shift[4] for shift in SHIFTS]
+
+        users = []
+        objects = []
+        for n in range(options['users']):
+            pin = str(options['pin_start'] + n)
+            is_manager = n < len(top_departments)
+            department = top_departments[n] if is_manager else rng.choice(departments)
+            users.append({
+                'username': f'{self.prefix}_{n + 1:06d}',
+                'pin': pin,
+                'site': rng.randrange(len(sites)),
+                'shift': rng.choices(SHIFTS, weights=shift_weights)[0],
+                'off_day': rng.randrange(7),
+                'punctuality': rng.betavariate(2, 8),  # most people are rarely late
+            })
+            objects.append(User(
+                username=users[-1]['username'],
+                email=f'{users[-1]["username"]}@example.com',
+                first_name='Load',
+                last_name=f'User {n + 1}',
+                employee_id=pin,
+                role='manager' if is_manager else 'user',
+                department_id=department.id,
+                password=password or make_password(None),
+            ))
+        User.objects.bulk_create(objects, batch_size=1000)
+
+        ids = dict(User.objects.filter(username__startswith=f'{self.prefix}_')
+                   .values_list('username', 'id'))
+        for user in users:
+            user['id'] = ids[user['username']]
+        self.writer.counts[User] = len(users)
+        return users
+
+    def create_device_users(self, users, sites):
+        for user in users:
+            for device_id in sites[user['site']]:
+                self.writer.add(DeviceUser, ['device_id', 'user_id', 'device_user_id', 'privilege',
+                                             'fingerprint_templates', 'face_templates', 'card_number',
+                                             'password', 'is_synced', 'created_at', 'updated_at'],
+                                (device_id, user['id'], user['pin'], 0, [], [], '', '', True,
+                                 self.now, self.now))
+        self.writer.flush(DeviceUser)
+
+    def create_leaves(self, rng, users, start, end):
+        """Leave requests; returns {user_id: set of approved leave dates}"""
+        days = (end - start).days + 1
+        reviewer = users[0]['id']
+        leaves = {}
+        for user in users:
+            for _ in range(rng.choices([0, 1, 2, 3], weights=[40, 35, 18, 7])[0] * max(1, days // 90)):
+                leave_type = rng.choices(LEAVE_TYPES, weights=LEAVE_WEIGHTS)[0]
+                length = rng.randint(1, 2) if leave_type == 'sick' else rng.randint(1, 5)
+                first = start + timedelta(days=rng.randrange(days))
+                last = min(first + timedelta(days=length - 1), end)
+                status = rng.choices(['approved', 'pending', 'rejected'], weights=[75, 10, 15])[0]
+                if first > end - timedelta(days=7) and rng.random() < 0.6:
+                    status = 'pending'
+                reviewed = status != 'pending'
+                created = timezone.make_aware(datetime.combine(first - timedelta(days=rng.randint(1, 14)), time(10)))
+                self.writer.add(LeaveRequest, LEAVE_FIELDS, (
+                    user['id'], leave_type, first, last, (last - first).days + 1,
+                    f'{leave_type.title()} leave', status,
+                    reviewer if reviewed else None, '', created + timedelta(days=1) if reviewed else None,
+                    created, created,
+                ))
+                if status == 'approved':
+                    current = first
+                    while current <= last:
+                        leaves.setdefault(user['id'], set()).add(current)
+                        current += timedelta(days=1)
+        return leaves
+
+    def create_attendance(self, rng, users, sites, leaves, start, end):
+        tz = timezone.get_current_timezone()
+        current = start
+        while current <= end:
+            # UTC offset of the day, so timestamps need no per-row localization
+            offset = timezone.make_aware(datetime.combine(current, time(12)), tz).utcoffset()
+            for user in users:
+                self.add_day(rng, user, sites[user['site']], current, offset, leaves.get(user['id']))
+            current += timedelta(days=1)
+            self.stdout.write(f'{current - timedelta(days=1)}: '
+                              f'{self.writer.counts.get(AttendanceRecord, 0)} punches written')
+
+    def add_day(self, rng, user, devices, day, offset, leave_days):
+        name, start, hours, weekends, _ = user['shift']
+        if weekends:
+            if (day.toordinal() + user['off_day']) % 7 == 0:
+                return
+        elif day.weekday() >= 5:
+            return
+
+        def aware(naive):
+            return (naive - offset).replace(tzinfo=dt_timezone.utc)
+
+        def daily(check_in, check_out, status, late=0, early=0):
+            work = round((check_out - check_in).total_seconds() / 3600, 2) if check_in and check_out else 0
+            self.writer.add(DailyAttendance, DAILY_FIELDS, (
+                user['id'], day, check_in and aware(check_in), check_out and aware(check_out), status,
+                work, max(0, round(work - hours, 2)), late, early, '', False, self.now, self.now,
+            ))
+
+        if leave_days and day in leave_days:
+            daily(None, None, 'leave')
+            return
+        if rng.random() < 0.03:
+            daily(None, None, 'absent')
+            return
+
+        scheduled_in = datetime.combine(day, start)
+        scheduled_out = scheduled_in + timedelta(hours=hours)
+        if rng.random() < user['punctuality'] * 0.6:
+            check_in = scheduled_in + timedelta(minutes=rng.expovariate(1 / 15) + 1)
+        else:
+            check_in = scheduled_in - timedelta(minutes=abs(rng.gauss(12, 8)))
+        check_in = check_in.replace(microsecond=0)
+        check_out = (scheduled_out + timedelta(minutes=rng.gauss(12, 15))).replace(microsecond=0)
+        if rng.random() < 0.02:
+            check_out = None  # forgot to punch out
+
+        device_id = rng.choice(devices)
+        verify = rng.choices(VERIFY_TYPES, weights=VERIFY_WEIGHTS)[0]
+        punches = [(check_in, 0)]
+        if rng.random() < 0.03:
+            punches.append((check_in + timedelta(seconds=rng.randint(2, 50)), 0))  # double punch
+        if check_out:
+            punches.append((check_out, 1))
+        for moment, code in punches:
+            timestamp = aware(moment)
+            self.writer.add(AttendanceRecord, PUNCH_FIELDS, (
+                user['id'], device_id, timestamp, verify, code, '', True, timestamp, self.now,
+            ))
+
+        late = max(0, int((check_in - scheduled_in).total_seconds() // 60))
+        early = max(0, int((scheduled_out - check_out).total_seconds() // 60)) if check_out else 0
+        daily(check_in, check_out, 'late' if late else 'present', late, early)
+
+    def clear(self):
+        """Remove everything generated with this prefix"""
+        users = User.objects.filter(username__startswith=f'{self.prefix}_')
+        devices = Device.objects.filter(serial_number__startswith=self.prefix.upper())
+        pins = list(users.values_list('employee_id', flat=True))
+        db = connection.alias
+
+        # Raw deletes: the ORM collector would load millions of rows to cascade
+        with transaction.atomic():
+            for queryset in [
+                AttendanceRecord.objects.filter(user__in=users),
+                AttendanceRecord.objects.filter(device__in=devices),
+                DailyAttendance.objects.filter(user__in=users),
+                LeaveRequest.objects.filter(user__in=users),
+                DeviceUser.objects.filter(user__in=users),
+                DeviceUser.objects.filter(device__in=devices),
+                DeviceLog.objects.filter(device__in=devices),
+            ]:
+                deleted = queryset._raw_delete(db)
+                self.stdout.write(f'{queryset.model._meta.verbose_name_plural}: {deleted} deleted')
+            users.delete()
+            devices.delete()
+            Department.objects.filter(code__startswith=f'{self.prefix.upper()}-D').delete()
+
+        stats.invalidate()
+        resolver.invalidate_pins(pins)
+        self.stdout.write(self.style.SUCCESS(f'Removed data with prefix "{self.prefix}".'))
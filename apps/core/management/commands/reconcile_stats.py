@@ -0,0 +1,16 @@
+"""
+Recompute the dashboard counters from the database
+Run periodically (e.g. from cron) to correct drift from bulk updates.
+"""
+from django.core.management.base import BaseCommand
+from apps.core import stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute dashboard statistics counters from the database'
+
+    def handle(self, *args, **options):
+        values, _ = stats.reconcile()
+        for key, value in sorted(values.items()):
+            self.stdout.write(f'{key}: {value}')
+        self.stdout.write(self.style.SUCCESS('Statistics reconciled.'))
@@ -0,0 +1,145 @@
+"""
+Run the benchmark suite and compare it with an earlier run
+
+Times ATTLOG parsing, ingest of new and duplicate uploads, the
+DailyAttendance rollup, the report and download_attlog actions and the
+main list APIs (see apps/core/benchmarks.py). They run on the
+generate_load_data dataset with --prefix. Use --generate to create it
+first. Results include the database vendor, the dataset size and the git
+commit, and --output saves them as JSON. --baseline then fails the run
+when a benchmark got slower than --threshold or runs more queries.
+
+Runs against whatever database is configured (DB_ENGINE), so the same
+suite covers SQLite and PostgreSQL. Meant for disposable databases.
+"""
+import json
+import platform
+import subprocess
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from apps.core import benchmarks, stats
+
+# Fixed so that a regenerated dataset is identical
+DATASET_END_DATE = '2025-06-30'
+DATASET_SEED = 1
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Benchmark parsing, ingest, rollup and reporting on a generated dataset'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefix', default='bench', help='generate_load_data prefix of the dataset')
+        parser.add_argument('--generate', action='store_true', help='Generate the dataset when it is missing')
+        parser.add_argument('--users', type=int, default=2000, help='Dataset size for --generate')
+        parser.add_argument('--devices', type=int, default=40, help='Dataset size for --generate')
+        parser.add_argument('--months', type=int, default=3, help='Dataset size for --generate')
+        parser.add_argument('--rounds', type=int, default=10)
+        parser.add_argument('--warmup', type=int, default=1)
+        parser.add_argument('--only', nargs='+', help='Run benchmarks whose name contains one of these')
+        parser.add_argument('--list', action='store_true', help='List the benchmarks and exit')
+        parser.add_argument('--output', help='Write results as JSON')
+        parser.add_argument('--baseline', help='Results JSON of an earlier run to compare with')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Allowed slowdown of the median (0.2 = 20%%)')
+        parser.add_argument('--min-delta-ms', type=float, default=1.0,
+                            help='Ignore slowdowns smaller than this, whatever the ratio')
+
+    def handle(self, *args, **options):
+        names = [
+            name for name in benchmarks.BENCHMARKS
+            if not options['only'] or any(part in name for part in options['only'])
+        ]
+        if options['list']:
+            for name in names:
+                self.stdout.write(name)
+            return
+        if not names:
+            raise CommandError('No benchmark matches --only')
+
+        dataset = self.get_dataset(options)
+        results = {
+            'created': timezone.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'dataset': dataset.counts(),
+            'benchmarks': {},
+        }
+        self.stdout.write(
+            f"{connection.vendor}, commit {results['commit'] or '?'}, "
+            f"{results['dataset']['users']} users, {results['dataset']['punches']} punches"
+        )
+        self.stdout.write(f"{'benchmark':<40}{'median ms':>11}{'min ms':>10}{'stdev':>9}{'us/item':>10}{'queries':>9}")
+
+        try:
+            for name in names:
+                result = benchmarks.run(name, dataset, options['rounds'], options['warmup'])
+                results['benchmarks'][name] = result
+                per_item = '-' if result['per_item_us'] is None else f"{result['per_item_us']:.1f}"
+                self.stdout.write(
+                    f"{name:<40}{result['median_ms']:>11.2f}{result['min_ms']:>10.2f}"
+                    f"{result['stdev_ms']:>9.2f}{per_item:>10}{result['queries']:>9}"
+                )
+        finally:
+            # Rolled back writes still moved the cached dashboard counters
+            stats.invalidate()
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+        if options['baseline']:
+            self.compare(results, options)
+
+    def get_dataset(self, options):
+        dataset = benchmarks.Dataset.load(options['prefix'])
+        if dataset is None and options['generate']:
+            call_command(
+                'generate_load_data', prefix=options['prefix'], users=options['users'],
+                devices=options['devices'], months=options['months'],
+                end_date=DATASET_END_DATE, seed=DATASET_SEED, stdout=self.stdout,
+            )
+            dataset = benchmarks.Dataset.load(options['prefix'])
+        if dataset is None:
+            raise CommandError(
+                f'No dataset with prefix "{options["prefix"]}"; run with --generate '
+                f'or generate_load_data --prefix {options["prefix"]}'
+            )
+        return dataset
+
+    def compare(self, results, options):
+        with open(options['baseline']) as f:
+            baseline = json.load(f)
+        if baseline.get('database') != results['database']:
+            self.stdout.write(self.style.WARNING(
+                f"Baseline ran on {baseline.get('database')}, this run on {results['database']}"
+            ))
+        if baseline.get('dataset') != results['dataset']:
+            self.stdout.write(self.style.WARNING('Baseline used a different dataset; timings may not compare'))
+
+        for name, result in results['benchmarks'].items():
+            before = baseline.get('benchmarks', {}).get(name)
+            if before and before['median_ms']:
+                change = (result['median_ms'] / before['median_ms'] - 1) * 100
+                self.stdout.write(f"{name:<40}{before['median_ms']:>11.2f} -> {result['median_ms']:.2f} ms "
+                                  f"({change:+.0f}%), queries {before['queries']} -> {result['queries']}")
+
+        regressions = benchmarks.compare(results, baseline, options['threshold'], options['min_delta_ms'])
+        if regressions:
+            for line in regressions:
+                self.stdout.write(self.style.ERROR(f'Regression: {line}'))
+            raise CommandError(f'{len(regressions)} regression(s) against {options["baseline"]}')
+        self.stdout.write(self.style.SUCCESS(f'No regressions against {options["baseline"]}.'))
@@ -0,0 +1,74 @@
+"""
+Copy the reference tables to the site databases
+Run after adding a site database (and migrating it with
+"migrate --database site_<name>"), or after a copy failed. Departments,
+users and devices are upserted by primary key; saves on the primary keep
+them current afterwards. Departments are copied parents first, so that
+every parent exists by the time its children arrive.
+"""
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from apps.core.sharding import MIRRORED_MODELS, mirrored_fields, site_aliases
+from apps.core.upsert import upsert
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = 'Copy departments, users and devices to every site database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--site', action='append', default=[],
+                            help='Only this site (repeatable)')
+
+    def handle(self, *args, **options):
+        if not settings.SITE_DATABASES:
+            raise CommandError('No site databases are configured (SITE_DATABASES).')
+        unknown = [site for site in options['site'] if site not in settings.SITE_DATABASES]
+        if unknown:
+            raise CommandError(f'Unknown site: {", ".join(unknown)}')
+        aliases = sorted({settings.SITE_DATABASES[site] for site in options['site']}) or site_aliases()
+
+        for label in MIRRORED_MODELS:
+            model = apps.get_model(label)
+            fields = mirrored_fields(model)
+            for alias in aliases:
+                copied = 0
+                batch = []
+                for obj in self.rows(model):
+                    batch.append(obj)
+                    if len(batch) == BATCH_SIZE:
+                        copied += self.copy(batch, fields, alias)
+                        batch = []
+                copied += self.copy(batch, fields, alias)
+                self.stdout.write(f'{alias}: {copied} {model._meta.verbose_name_plural}')
+        self.stdout.write(self.style.SUCCESS('Site databases synchronized.'))
+
+    def rows(self, model):
+        """Rows in primary key order; rows of a tree (departments) parents first"""
+        rows = model._base_manager.order_by('pk')
+        parent = next((f for f in model._meta.concrete_fields
+                       if f.is_relation and f.related_model is model), None)
+        if parent is None:
+            return rows.iterator(chunk_size=BATCH_SIZE)
+
+        rows = list(rows)
+        pks = {obj.pk for obj in rows}
+        children = {}
+        for obj in rows:
+            parent_pk = getattr(obj, parent.attname)
+            children.setdefault(parent_pk if parent_pk in pks else None, []).append(obj)
+        ordered = []
+        pending = children.get(None, [])
+        while pending:
+            ordered.extend(pending)
+            pending = [child for obj in pending for child in children.get(obj.pk, [])]
+        # Rows in a parent cycle are never reached from a root: copy them last
+        reached = {obj.pk for obj in ordered}
+        return ordered + [obj for obj in rows if obj.pk not in reached]
+
+    def copy(self, batch, fields, alias):
+        if batch:
+            upsert(batch, (batch[0]._meta.pk.name,), fields, using=alias)
+        return len(batch)
@@ -0,0 +1,298 @@
+"""
+Prometheus-style metrics
+
+Counters, gauges and histograms are recorded in-process and flushed to a
+redis hash every METRICS_FLUSH_INTERVAL seconds, so a scrape of any worker
+sees the totals of all gunicorn workers. Without the redis cache backend
+each worker only reports its own numbers.
+
+Metric names and label sets must stay bounded (device serial numbers and
+view names are fine, user ids or timestamps are not).
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+REDIS_KEY = 'iclock:metrics'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+class Registry:
+    """Holds metric definitions and the values not yet flushed"""
+
+    def __init__(self):
+        self.metrics = {}
+        self._deltas = {}  # sample -> amount to add
+        self._values = {}  # sample -> absolute value (gauge.set)
+        self._totals = {}  # everything recorded by this worker
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f'Metric {metric.name} already registered')
+        self.metrics[metric.name] = metric
+        return metric
+
+    def add(self, sample, amount):
+        with self._lock:
+            self._deltas[sample] = self._deltas.get(sample, 0) + amount
+            self._totals[sample] = self._totals.get(sample, 0) + amount
+        self._maybe_flush()
+
+    def set(self, sample, value):
+        with self._lock:
+            self._values[sample] = value
+            self._totals[sample] = value
+        self._maybe_flush()
+
+    def _redis(self):
+        if settings.CACHE_BACKEND != 'redis':
+            return None
+        from django_redis import get_redis_connection
+        return get_redis_connection('default')
+
+    def _maybe_flush(self):
+        if time.monotonic() - self._last_flush >= settings.METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """Push buffered values to redis; kept in memory if redis is down"""
+        with self._lock:
+            self._last_flush = time.monotonic()
+            deltas, self._deltas = self._deltas, {}
+            values, self._values = self._values, {}
+        if not deltas and not values:
+            return
+
+        try:
+            conn = self._redis()
+            if conn is None:
+                return
+            pipe = conn.pipeline(transaction=False)
+            for sample, amount in deltas.items():
+                pipe.hincrbyfloat(REDIS_KEY, sample, amount)
+            if values:
+                pipe.hset(REDIS_KEY, mapping=values)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Metrics flush failed: {str(e)}")
+            with self._lock:
+                for sample, amount in deltas.items():
+                    self._deltas[sample] = self._deltas.get(sample, 0) + amount
+                for sample, value in values.items():
+                    self._values.setdefault(sample, value)
+
+    def collect(self):
+        """Current {sample: value}, across workers when redis is available"""
+        self.flush()
+        try:
+            conn = self._redis()
+            if conn is not None:
+                return {
+                    sample.decode(): float(value)
+                    for sample, value in conn.hgetall(REDIS_KEY).items()
+                }
+        except Exception as e:
+            logger.warning(f"Metrics unavailable from redis, serving local values: {str(e)}")
+        with self._lock:
+            return dict(self._totals)
+
+    def render(self):
+        """Prometheus text exposition format"""
+        samples = self.collect()
+        lines = []
+        for name in sorted(self.metrics):
+            metric = self.metrics[name]
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            for sample in sorted(s for s in samples if metric.owns(s)):
+                lines.append(f'{sample} {_format_value(samples[sample])}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        """Forget every value (used by tools, never in production)"""
+        with self._lock:
+            self._deltas.clear()
+            self._values.clear()
+            self._totals.clear()
+        try:
+            conn = self._redis()
+            if conn is not None:
+                conn.delete(REDIS_KEY)
+        except Exception as e:
+            logger.warning(f"Metrics reset failed: {str(e)}")
+
+
+registry = Registry()
+
+
+class Metric:
+    kind = None
+    suffixes = ('',)
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        registry.register(self)
+
+    def _labels(self, labels, extra=()):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        pairs = [(key, labels[key]) for key in self.labelnames] + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+    def _sample(self, labels, suffix='', extra=()):
+        return f'{self.name}{suffix}{self._labels(labels, extra)}'
+
+    def owns(self, sample):
+        base = sample.split('{', 1)[0]
+        return any(base == self.name + suffix for suffix in self.suffixes)
+
+
+class Counter(Metric):
+    """Monotonic total"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if amount:
+            registry.add(self._sample(labels), amount)
+
+
+class Gauge(Metric):
+    """Value that goes up and down; inc/dec sum across workers"""
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        registry.set(self._sample(labels), value)
+
+    def inc(self, amount=1, **labels):
+        registry.add(self._sample(labels), amount)
+
+    def dec(self, amount=1, **labels):
+        registry.add(self._sample(labels), -amount)
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(Metric):
+    """Distribution of observations in cumulative buckets"""
+    kind = 'histogram'
+    suffixes = ('_bucket', '_sum', '_count')
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        for bound in self.buckets:
+            if value <= bound:
+                registry.add(self._sample(labels, '_bucket', [('le', bound)]), 1)
+        registry.add(self._sample(labels, '_bucket', [('le', '+Inf')]), 1)
+        registry.add(self._sample(labels, '_sum'), value)
+        registry.add(self._sample(labels, '_count'), 1)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+
+# Device ingest
+# No sn label: it comes from an unauthenticated query parameter, so any
+# client could add series without end. Per-device series start at parsing.
+CDATA_REQUESTS = Counter(
+    'iclock_cdata_requests_total', 'iClock cdata requests by method', ['method']
+)
+CDATA_INFLIGHT = Gauge(
+    'iclock_cdata_uploads_in_progress', 'Attendance uploads being processed right now'
+)
+RECORDS_PARSED = Counter(
+    'iclock_records_parsed_total', 'Attendance lines parsed from device uploads', ['sn']
+)
+RECORDS_INSERTED = Counter(
+    'iclock_records_inserted_total', 'New attendance records stored', ['sn']
+)
+RECORDS_DUPLICATE = Counter(
+    'iclock_records_duplicate_total', 'Uploaded punches that were already stored', ['sn']
+)
+RECORDS_FAILED = Counter(
+    'iclock_records_failed_total', 'Uploaded punches that could not be stored', ['sn']
+)
+RECORDS_SUPPRESSED = Counter(
+    'iclock_records_suppressed_total', 'Near-duplicate punches dropped by the suppression window', ['sn']
+)
+PARSE_SECONDS = Histogram(
+    'iclock_upload_parse_seconds', 'Time spent parsing one upload body'
+)
+INSERT_SECONDS = Histogram(
+    'iclock_upload_insert_seconds', 'Time spent storing the punches of one upload'
+)
+UPLOAD_LAG = Gauge(
+    'iclock_upload_lag_seconds', 'Server time minus the newest punch of the last upload', ['sn']
+)
+DEVICE_COMMANDS = Counter(
+    'iclock_device_commands_total', 'Device commands by the state they moved to', ['status']
+)
+UPLOADS_REJECTED = Counter(
+    'iclock_uploads_rejected_total', 'Uploads answered with Retry-After by admission control', ['reason']
+)
+RELAY_UPLOADS = Counter(
+    'iclock_relay_uploads_total', 'Device uploads received in edge relay bundles', ['relay']
+)
+UPLOADS_SPOOLED = Counter(
+    'iclock_uploads_spooled_total', 'Uploads acknowledged from the local spool while the database was down', ['sn']
+)
+SPOOL_PENDING_BYTES = Gauge(
+    'iclock_spool_pending_bytes', 'Spooled upload bytes waiting to be replayed'
+)
+LONGPOLLS_WAITING = Gauge(
+    'iclock_getrequest_longpolls_waiting', 'getrequest polls held open waiting for a command'
+)
+
+# HTTP and database
+HTTP_REQUESTS = Counter(
+    'iclock_http_requests_total', 'HTTP requests by view and status', ['view', 'method', 'status']
+)
+HTTP_SECONDS = Histogram(
+    'iclock_http_request_seconds', 'Request latency by view', ['view']
+)
+DB_QUERIES = Histogram(
+    'iclock_db_queries_per_request', 'Database queries per request by view', ['view'],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200)
+)
+DB_SECONDS = Histogram(
+    'iclock_db_seconds_per_request', 'Database time per request by view', ['view']
+)
+QUERY_BUDGET_EXCEEDED = Counter(
+    'iclock_query_budget_exceeded_total', 'Requests that ran more queries than their view budget', ['view']
+)
+REPLICA_FALLBACKS = Counter(
+    'iclock_db_replica_fallbacks_total', 'Times a read replica was found unreachable and skipped', ['alias']
+)
@@ -0,0 +1,159 @@
+"""
+Request middleware for core services
+"""
+import asyncio
+import hmac
+import logging
+import random
+import time
+from contextlib import ExitStack, contextmanager
+from django.conf import settings
+from django.db import connections
+from . import metrics, profiling
+
+logger = logging.getLogger(__name__)
+
+
+class QueryStats:
+    """Counts queries and database time through connection.execute_wrapper"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.count += 1
+
+
+@contextmanager
+def track_queries(stats):
+    """Count the queries of every connection of the current thread into stats"""
+    with ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(stats))
+        yield stats
+
+
+def view_name(request):
+    """Bounded label for the view that served a request"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unresolved>'
+    return match.view_name or match._func_path
+
+
+def query_budget(view):
+    """Maximum number of queries a view is expected to run"""
+    return settings.QUERY_BUDGETS.get(view, settings.QUERY_BUDGET_DEFAULT)
+
+
+class MetricsMiddleware:
+    """
+    Records latency, status and database usage per view
+    Also adds a Server-Timing header and logs views that run more queries
+    than their budget (QUERY_BUDGETS, QUERY_BUDGET_DEFAULT). Works in
+    async stacks too; async views count their queries by running database
+    work with track_queries(request.query_stats).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Mark the instance as a coroutine function, as Django's MiddlewareMixin does
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        stats = request.query_stats = QueryStats()
+        start = time.perf_counter()
+        with track_queries(stats):
+            response = self.get_response(request)
+        return self.record(request, response, stats, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        stats = request.query_stats = QueryStats()
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        return self.record(request, response, stats, time.perf_counter() - start)
+
+    def record(self, request, response, stats, elapsed):
+        view = view_name(request)
+        metrics.HTTP_REQUESTS.inc(view=view, method=request.method, status=response.status_code)
+        metrics.HTTP_SECONDS.observe(elapsed, view=view)
+        metrics.DB_QUERIES.observe(stats.count, view=view)
+        metrics.DB_SECONDS.observe(stats.seconds, view=view)
+
+        budget = query_budget(view)
+        if budget is not None and stats.count > budget:
+            metrics.QUERY_BUDGET_EXCEEDED.inc(view=view)
+            logger.warning(f"Query budget exceeded: {request.method} {request.path} ({view}) "
+                           f"ran {stats.count} queries, budget {budget}, "
+                           f"{stats.seconds * 1000:.1f}ms in database")
+
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = (
+                f'db;dur={stats.seconds * 1000:.1f};desc="{stats.count} queries", '
+                f'total;dur={elapsed * 1000:.1f}'
+            )
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Wraps selected requests in the sampling profiler
+    Triggered by "X-Profile: 1" from a staff user, "X-Profile: <PROFILING_SECRET>"
+    (for clients without a login, e.g. replayed device uploads), or randomly
+    per PROFILING_SAMPLE_RATES. Does nothing unless PROFILING_ENABLED.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.PROFILING_ENABLED or not self.should_profile(request):
+            return self.get_response(request)
+
+        sampler = profiling.start()
+        if sampler is None:
+            return self.get_response(request)
+
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            elapsed = time.perf_counter() - start
+            name = f'{request.method}-{view_name(request)}'
+            filename = profiling.finish(sampler, name, elapsed)
+        if filename:
+            response['X-Profile'] = filename
+        return response
+
+    def should_profile(self, request):
+        header = request.META.get('HTTP_X_PROFILE')
+        if header:
+            secret = settings.PROFILING_SECRET
+            if secret and hmac.compare_digest(header, secret):
+                return True
+            return header == '1' and self.is_staff(request)
+        rate = profiling.sample_rate(request.path)
+        return rate > 0 and random.random() < rate
+
+    def is_staff(self, request):
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return user.is_staff
+        # API clients authenticate with a token inside DRF, check it here too
+        from apps.accounts.authentication import CachedTokenAuthentication
+        try:
+            result = CachedTokenAuthentication().authenticate(request)
+        except Exception:
+            return False
+        return result is not None and result[0].is_staff
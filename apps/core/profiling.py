@@ -0,0 +1,159 @@
+"""
+On-demand sampling profiler
+
+A background thread samples the stack of the request thread every
+PROFILING_INTERVAL seconds through sys._current_frames(). Samples are
+written in the collapsed stack format ("a;b;c count" per line) that
+flamegraph.pl and speedscope read directly. Profiling is opt-in
+(PROFILING_ENABLED) and triggered either by the X-Profile header from a
+staff user (or with PROFILING_SECRET) or by PROFILING_SAMPLE_RATES.
+"""
+import logging
+import os
+import sys
+import threading
+from collections import Counter
+from datetime import datetime
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+SUFFIX = '.collapsed'
+
+# Only one profile per worker at a time keeps the overhead bounded
+_active = threading.Semaphore(1)
+
+
+def _path_prefixes():
+    return sorted({os.path.abspath(p) for p in sys.path if p}, key=len, reverse=True)
+
+
+class Sampler:
+    """Samples one thread's stack until stopped"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._labels = {}
+        self._prefixes = _path_prefixes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.samples
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            self.samples[';'.join(reversed(stack))] += 1
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            filename = code.co_filename
+            for prefix in self._prefixes:
+                if filename.startswith(prefix + os.sep):
+                    filename = filename[len(prefix) + 1:]
+                    break
+            label = f'{code.co_name} ({filename}:{code.co_firstlineno})'.replace(';', ':')
+            self._labels[code] = label
+        return label
+
+
+def start():
+    """Start sampling the current thread; None if a profile is already running"""
+    if not _active.acquire(blocking=False):
+        return None
+    sampler = Sampler(threading.get_ident(), settings.PROFILING_INTERVAL)
+    sampler.start()
+    return sampler
+
+
+def finish(sampler, name, elapsed):
+    """Stop sampling and write the profile file"""
+    try:
+        samples = sampler.stop()
+    finally:
+        _active.release()
+    if not samples:
+        return None
+
+    os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    safe_name = ''.join(c if c.isalnum() or c in '-.' else '-' for c in name)[:80]
+    filename = f'{stamp}_{safe_name}_{int(elapsed * 1000)}ms{SUFFIX}'
+    path = os.path.join(settings.PROFILING_DIR, filename)
+    with open(path, 'w') as f:
+        for stack, count in samples.most_common():
+            f.write(f'{stack} {count}\n')
+
+    _prune()
+    logger.info(f"Profile written: {filename} ({sum(samples.values())} samples)")
+    return filename
+
+
+def _prune():
+    """Keep only the newest PROFILING_MAX_FILES profiles"""
+    profiles = sorted(list_profiles(), key=lambda p: p['name'])
+    for profile in profiles[:-settings.PROFILING_MAX_FILES]:
+        try:
+            os.remove(os.path.join(settings.PROFILING_DIR, profile['name']))
+        except OSError:
+            pass
+
+
+def list_profiles():
+    """Profiles on disk, newest first"""
+    try:
+        names = [n for n in os.listdir(settings.PROFILING_DIR) if n.endswith(SUFFIX)]
+    except FileNotFoundError:
+        return []
+
+    profiles = []
+    for name in names:
+        stamp, _, rest = name[:-len(SUFFIX)].partition('_')
+        label, _, duration = rest.rpartition('_')
+        try:
+            created = datetime.strptime(stamp, '%Y%m%d-%H%M%S-%f')
+            size = os.path.getsize(os.path.join(settings.PROFILING_DIR, name))
+        except (ValueError, OSError):
+            continue
+        profiles.append({
+            'name': name,
+            'created': created,
+            'label': label,
+            'duration': duration,
+            'size': size,
+        })
+    profiles.sort(key=lambda p: p['name'], reverse=True)
+    return profiles
+
+
+def profile_path(name):
+    """Absolute path of a listed profile, or None"""
+    if os.path.basename(name) != name or not name.endswith(SUFFIX):
+        return None
+    path = os.path.join(settings.PROFILING_DIR, name)
+    return path if os.path.isfile(path) else None
+
+
+def sample_rate(path):
+    """Configured sampling rate for a request path (longest prefix wins)"""
+    rate = 0.0
+    longest = -1
+    for prefix, value in settings.PROFILING_SAMPLE_RATES.items():
+        if path.startswith(prefix) and len(prefix) > longest:
+            rate, longest = value, len(prefix)
+    return rate
@@ -0,0 +1,271 @@
+"""
+Multi-site sharding of attendance data
+
+A site listed in SITE_DATABASES stores the AttendanceRecord rows of its
+devices (Device.site) in a database of its own, so storage and write
+throughput grow by adding databases. Devices without a site, or with one
+that is not listed, use the default database. DailyAttendance is keyed by
+user and date, and an employee may punch at several sites in a day: all
+summaries stay in the default database (SiteRouter sends every write
+there), so each employee and day has exactly one row.
+Each site database also holds a copy of the rows attendance points to
+(departments, users, devices) so that foreign keys and joins work there:
+signal handlers keep it current, sync_site_databases fills it.
+
+Reads that span sites run the same query on every attendance database and
+merge the sorted results (ScatterGather). Primary keys are only unique
+within one database, so a row is addressed by its id and its site: the
+attendance API shows the site of every row and takes ?site= to work on
+one database.
+"""
+import heapq
+import logging
+from functools import reduce
+from itertools import islice
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+logger = logging.getLogger(__name__)
+
+SHARDED_MODELS = {'attendance.AttendanceRecord'}
+# Attendance kept in the default database whatever the site
+PRIMARY_MODELS = {'attendance.DailyAttendance'}
+# Copied to every site database, in foreign key order
+MIRRORED_MODELS = ('accounts.Department', 'accounts.User', 'devices.Device')
+# Saves of only these fields (device polls, logins) are not copied
+UNMIRRORED_FIELDS = {'last_online', 'status', 'last_login'}
+
+
+def enabled():
+    return bool(settings.SITE_DATABASES)
+
+
+def site_database(site):
+    """Database alias holding the attendance of site"""
+    return settings.SITE_DATABASES.get(site or '', DEFAULT_DB_ALIAS)
+
+
+def device_database(device):
+    return site_database(device.site) if device is not None else DEFAULT_DB_ALIAS
+
+
+def punch_database(record):
+    """Site database of an unsaved AttendanceRecord; None for the default one, left to the routers"""
+    if not enabled():
+        return None
+    alias = device_database(record.device)
+    return alias if alias != DEFAULT_DB_ALIAS else None
+
+
+def database_site(alias):
+    """Site stored in database alias; '' for the default database"""
+    for site, site_alias in settings.SITE_DATABASES.items():
+        if site_alias == alias:
+            return site
+    return ''
+
+
+def site_aliases():
+    return sorted(set(settings.SITE_DATABASES.values()))
+
+
+def attendance_databases():
+    return [DEFAULT_DB_ALIAS, *site_aliases()]
+
+
+class SiteRouter:
+    """Sends attendance writes to the database of their device's site"""
+
+    def _hinted(self, hints):
+        # Objects related to a row of a site database are read and written there
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db in settings.SITE_DATABASES.values():
+            return instance._state.db
+        return None
+
+    def db_for_read(self, model, **hints):
+        if model._meta.label in PRIMARY_MODELS:
+            return None  # left to the replica router
+        return self._hinted(hints)
+
+    def db_for_write(self, model, **hints):
+        if not enabled():
+            return None
+        if model._meta.label in PRIMARY_MODELS:
+            return DEFAULT_DB_ALIAS
+        alias = self._hinted(hints)
+        if alias is not None:
+            return alias
+        instance = hints.get('instance')
+        if model._meta.label == 'attendance.AttendanceRecord' and instance is not None \
+                and instance._state.adding and instance.device_id:
+            return punch_database(instance)
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Attendance rows point to the copies of their user and device
+        labels = {obj1._meta.label, obj2._meta.label}
+        if labels <= SHARDED_MODELS | PRIMARY_MODELS | set(MIRRORED_MODELS):
+            return True
+        if obj1._state.db == obj2._state.db:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
+
+
+class ScatterGather:
+    """
+    One ordered queryset read from every attendance database
+    Supports what list views and paginators use: count(), slicing and
+    iteration. Each database returns its rows sorted; the streams are
+    merged, so a slice [start:stop] reads at most stop rows per database.
+    key extracts the sort value of a row, by default from the queryset
+    ordering (a single direction); values_list() querysets need one.
+    """
+    ordered = True
+
+    def __init__(self, queryset, key=None, reverse=None, databases=None):
+        self.queryset = queryset
+        self.databases = databases or attendance_databases()
+        if key is None:
+            key, default_reverse = self._ordering_key(queryset)
+            reverse = default_reverse if reverse is None else reverse
+        self.key = key
+        self.reverse = bool(reverse)
+
+    @staticmethod
+    def _ordering_key(queryset):
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+        if not ordering:
+            raise ValueError('ScatterGather needs an ordered queryset')
+        if len({name.startswith('-') for name in ordering}) > 1:
+            raise ValueError('ScatterGather needs every ordering field in the same direction')
+        pk = queryset.model._meta.pk.attname
+        paths = [(pk if name.lstrip('-') == 'pk' else name.lstrip('-')).split('__') for name in ordering]
+
+        def key(obj):
+            return tuple(reduce(getattr, path, obj) for path in paths)
+        return key, ordering[0].startswith('-')
+
+    def count(self):
+        return sum(part.count() for part in per_database(self.queryset, self.databases))
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        parts = per_database(self.queryset, self.databases)
+        return heapq.merge(*(part.iterator() for part in parts), key=self.key, reverse=self.reverse)
+
+    iterator = __iter__
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            rows = self[item:item + 1]
+            if not rows:
+                raise IndexError(item)
+            return rows[0]
+        if item.step is not None or (item.start or 0) < 0 or (item.stop is not None and item.stop < 0):
+            raise ValueError('ScatterGather supports non-negative slices only')
+        start, stop = item.start or 0, item.stop
+        parts = [part if stop is None else part[:stop] for part in per_database(self.queryset, self.databases)]
+        return list(islice(heapq.merge(*parts, key=self.key, reverse=self.reverse), start, stop))
+
+
+def per_database(queryset, databases=None):
+    """queryset once for each attendance database"""
+    for alias in databases or attendance_databases():
+        # The default database keeps its routing (read replicas)
+        yield queryset if alias == DEFAULT_DB_ALIAS else queryset.using(alias)
+
+
+def gather(queryset, **kwargs):
+    """queryset over every attendance database when sites have their own, else queryset itself"""
+    return ScatterGather(queryset, **kwargs) if enabled() else queryset
+
+
+def aggregate(queryset, **expressions):
+    """queryset.aggregate() over every attendance database; only for additive results (Count, Sum)"""
+    if not enabled():
+        return queryset.aggregate(**expressions)
+    totals = dict.fromkeys(expressions)
+    for part in per_database(queryset):
+        for name, value in part.aggregate(**expressions).items():
+            if value is not None:
+                totals[name] = value if totals[name] is None else totals[name] + value
+    return totals
+
+
+class SiteDatabaseMixin:
+    """
+    For attendance viewsets: ?site= selects one site's database (empty for
+    the default one); without it lists gather every database and other
+    actions use the default database
+    """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        site = self.request.query_params.get('site')
+        if site is None:
+            return queryset
+        if site and site not in settings.SITE_DATABASES:
+            raise ValidationError({'site': f'Unknown site: {site}'})
+        return queryset.using(site_database(site))
+
+    def site_selected(self):
+        return not enabled() or 'site' in self.request.query_params
+
+    def gather(self, queryset, **kwargs):
+        return queryset if self.site_selected() else ScatterGather(queryset, **kwargs)
+
+    def aggregate(self, queryset, **expressions):
+        return queryset.aggregate(**expressions) if self.site_selected() else aggregate(queryset, **expressions)
+
+    def list(self, request, *args, **kwargs):
+        if self.site_selected():
+            return super().list(request, *args, **kwargs)
+        queryset = ScatterGather(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer(queryset, many=True).data)
+
+
+def mirrored_fields(model):
+    """Fields a copy is updated with; creation times stay as first copied"""
+    return [f.name for f in model._meta.concrete_fields
+            if not f.primary_key and not getattr(f, 'auto_now_add', False)]
+
+
+def mirror(instance):
+    """Copy a saved reference row to every site database"""
+    mirror_many([instance])
+
+
+def mirror_many(instances):
+    """Copy saved reference rows of one model to every site database, one statement per site"""
+    from .upsert import upsert
+    if not instances:
+        return
+    meta = instances[0]._meta
+    fields = mirrored_fields(type(instances[0]))
+    for alias in site_aliases():
+        try:
+            upsert(instances, (meta.pk.name,), fields, using=alias)
+        except Exception as e:
+            rows = instances[0].pk if len(instances) == 1 else f'({len(instances)} rows)'
+            logger.warning(f"Failed to copy {meta.label} {rows} to {alias}, "
+                           f"run sync_site_databases: {str(e)}")
+
+
+def unmirror(instance):
+    """Delete the copies of a reference row, with the site's attendance rows pointing to it"""
+    for alias in site_aliases():
+        try:
+            type(instance)._base_manager.using(alias).filter(pk=instance.pk).delete()
+        except Exception as e:
+            logger.warning(f"Failed to delete {instance._meta.label} {instance.pk} from {alias}: {str(e)}")
@@ -0,0 +1,128 @@
+"""
+Signal handlers keeping the dashboard counters and the site database
+copies up to date
+"""
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+from apps.accounts.models import Department, User
+from apps.devices.models import Device
+from apps.attendance.models import DailyAttendance, LeaveRequest
+from . import sharding, stats
+
+
+def _loaded(instance, field):
+    """Read a field without triggering a deferred load"""
+    return instance.__dict__.get(field)
+
+
+@receiver(post_init, sender=User)
+def remember_user_state(sender, instance, **kwargs):
+    instance._stats_active = _loaded(instance, 'is_active')
+
+
+@receiver(post_save, sender=User)
+def count_user(sender, instance, created, using, **kwargs):
+    """Track active users"""
+    if using != DEFAULT_DB_ALIAS:
+        return  # a site database copy
+    was_active = False if created else bool(instance._stats_active)
+    stats.incr('total_users', int(instance.is_active) - int(was_active))
+    instance._stats_active = instance.is_active
+
+
+@receiver(post_delete, sender=User)
+def uncount_user(sender, instance, using, **kwargs):
+    if using == DEFAULT_DB_ALIAS and instance.is_active:
+        stats.incr('total_users', -1)
+
+
+@receiver(post_init, sender=Device)
+def remember_device_state(sender, instance, **kwargs):
+    instance._stats_status = _loaded(instance, 'status')
+
+
+@receiver(post_save, sender=Device)
+def count_device(sender, instance, created, using, **kwargs):
+    """Track online devices"""
+    if using != DEFAULT_DB_ALIAS:
+        return  # a site database copy
+    was_online = not created and instance._stats_status == 'online'
+    stats.incr('online_devices', int(instance.status == 'online') - int(was_online))
+    instance._stats_status = instance.status
+
+
+@receiver(post_delete, sender=Device)
+def uncount_device(sender, instance, using, **kwargs):
+    if using == DEFAULT_DB_ALIAS and instance.status == 'online':
+        stats.incr('online_devices', -1)
+
+
+@receiver(post_init, sender=DailyAttendance)
+def remember_daily_state(sender, instance, **kwargs):
+    instance._stats_state = (
+        _loaded(instance, 'date'),
+        _loaded(instance, 'check_in') is not None,
+        _loaded(instance, 'status') == 'late',
+    )
+
+
+@receiver(post_save, sender=DailyAttendance)
+def count_daily(sender, instance, created, **kwargs):
+    """Track present (checked in) and late employees per day"""
+    old_date, was_present, was_late = (None, False, False) if created else instance._stats_state
+    new_state = (instance.date, instance.check_in is not None, instance.status == 'late')
+
+    if old_date is not None and old_date != instance.date:
+        stats.incr('present', -int(was_present), date=old_date)
+        stats.incr('late', -int(was_late), date=old_date)
+        was_present = was_late = False
+
+    stats.incr('present', int(new_state[1]) - int(was_present), date=instance.date)
+    stats.incr('late', int(new_state[2]) - int(was_late), date=instance.date)
+    instance._stats_state = new_state
+
+
+@receiver(post_delete, sender=DailyAttendance)
+def uncount_daily(sender, instance, **kwargs):
+    stats.incr('present', -int(instance.check_in is not None), date=instance.date)
+    stats.incr('late', -int(instance.status == 'late'), date=instance.date)
+
+
+@receiver(post_init, sender=LeaveRequest)
+def remember_leave_state(sender, instance, **kwargs):
+    instance._stats_status = _loaded(instance, 'status')
+
+
+@receiver(post_save, sender=LeaveRequest)
+def count_leave(sender, instance, created, **kwargs):
+    """Track pending leave requests"""
+    was_pending = not created and instance._stats_status == 'pending'
+    stats.incr('pending_leaves', int(instance.status == 'pending') - int(was_pending))
+    instance._stats_status = instance.status
+
+
+@receiver(post_delete, sender=LeaveRequest)
+def uncount_leave(sender, instance, **kwargs):
+    if instance.status == 'pending':
+        stats.incr('pending_leaves', -1)
+
+
+@receiver(post_save, sender=Department)
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Device)
+def mirror_to_sites(sender, instance, using, update_fields=None, **kwargs):
+    """Copy reference rows to the site databases; liveness updates are not copied"""
+    if not sharding.enabled() or using != DEFAULT_DB_ALIAS:
+        return
+    if update_fields and set(update_fields) <= sharding.UNMIRRORED_FIELDS:
+        return
+    sharding.mirror(instance)
+
+
+@receiver(post_delete, sender=Department)
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Device)
+def unmirror_from_sites(sender, instance, using, **kwargs):
+    if sharding.enabled() and using == DEFAULT_DB_ALIAS:
+        sharding.unmirror(instance)
@@ -0,0 +1,115 @@
+"""
+Dashboard statistics backed by maintained counters
+
+Counters live in the cache and are adjusted by model signals and the
+device ingest pipeline. Reads never touch the database unless a counter
+is missing or the last reconciliation is older than
+STATS_RECONCILE_INTERVAL, in which case all counters are recomputed.
+"""
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'stats'
+GLOBAL_COUNTERS = ('total_users', 'online_devices', 'pending_leaves')
+DAILY_COUNTERS = ('present', 'late')
+DAILY_TIMEOUT = 60 * 60 * 48  # keep per-day counters for two days
+RECONCILE_LOCK_TIMEOUT = 30
+
+
+def counter_key(name, date=None):
+    """Cache key for a counter, per day for daily counters"""
+    if date is not None:
+        return f'{KEY_PREFIX}:{name}:{date.isoformat()}'
+    return f'{KEY_PREFIX}:{name}'
+
+
+def incr(name, delta=1, date=None):
+    """
+    Adjust a counter by delta
+    Missing counters are left alone; the next read reconciles them.
+    """
+    if not delta:
+        return
+    try:
+        cache.incr(counter_key(name, date), delta)
+    except ValueError:
+        pass
+    except Exception as e:
+        logger.warning(f"Failed to update counter {name}: {str(e)}")
+
+
+def invalidate():
+    """Force the next read to reconcile from the database"""
+    cache.delete(counter_key('reconciled_at'))
+
+
+def reconcile():
+    """Recompute every counter from the database and store it"""
+    from apps.accounts.models import User
+    from apps.devices.models import Device
+    from apps.attendance.models import DailyAttendance, LeaveRequest
+
+    now = timezone.now()
+    today = timezone.localdate()
+
+    # Devices that stopped polling are no longer online
+    offline_after = timedelta(seconds=settings.DEVICE_OFFLINE_AFTER)
+    Device.objects.filter(
+        status='online', last_online__lt=now - offline_after
+    ).update(status='offline')
+
+    # Daily summaries of every site are on the primary
+    daily = DailyAttendance.objects.filter(date=today)
+    values = {
+        counter_key('total_users'): User.objects.filter(is_active=True).count(),
+        counter_key('online_devices'): Device.objects.filter(status='online').count(),
+        counter_key('pending_leaves'): LeaveRequest.objects.filter(status='pending').count(),
+    }
+    daily_values = {
+        counter_key('present', today): daily.filter(check_in__isnull=False).count(),
+        counter_key('late', today): daily.filter(status='late').count(),
+    }
+
+    cache.set_many(values, timeout=None)
+    cache.set_many(daily_values, timeout=DAILY_TIMEOUT)
+    cache.set(counter_key('reconciled_at'), now.timestamp(), timeout=None)
+
+    values.update(daily_values)
+    return values, now.timestamp()
+
+
+def get_dashboard_stats():
+    """Return dashboard statistics, reconciling when stale"""
+    today = timezone.localdate()
+    keys = [counter_key(name) for name in GLOBAL_COUNTERS]
+    keys += [counter_key(name, today) for name in DAILY_COUNTERS]
+    keys.append(counter_key('reconciled_at'))
+
+    values = cache.get_many(keys)
+    reconciled_at = values.get(counter_key('reconciled_at'))
+    complete = len(values) == len(keys)
+    stale = (
+        reconciled_at is None or
+        timezone.now().timestamp() - reconciled_at > settings.STATS_RECONCILE_INTERVAL
+    )
+
+    # Only one worker reconciles a stale set; the others serve stale values
+    if not complete or (stale and cache.add(counter_key('reconcile_lock'), 1,
+                                            timeout=RECONCILE_LOCK_TIMEOUT)):
+        values, reconciled_at = reconcile()
+        cache.delete(counter_key('reconcile_lock'))
+
+    return {
+        'date': today.isoformat(),
+        'total_users': values[counter_key('total_users')],
+        'online_devices': values[counter_key('online_devices')],
+        'present_today': values[counter_key('present', today)],
+        'late_today': values[counter_key('late', today)],
+        'pending_leaves': values[counter_key('pending_leaves')],
+        'reconciled_at': datetime.fromtimestamp(reconciled_at, tz=dt_timezone.utc).isoformat(),
+    }
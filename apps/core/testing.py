@@ -0,0 +1,24 @@
+"""
+Query count helpers for tests and the check_query_budgets command
+"""
+from contextlib import contextmanager
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+
+
+@contextmanager
+def assert_max_queries(limit, using='default'):
+    """
+    Fail if the block runs more than `limit` queries
+
+        with assert_max_queries(3):
+            client.get('/api/attendance/records/')
+    """
+    with CaptureQueriesContext(connections[using]) as context:
+        yield context
+    executed = len(context)
+    if executed > limit:
+        statements = '\n'.join(
+            f"{i}. {query['sql']}" for i, query in enumerate(context.captured_queries, start=1)
+        )
+        raise AssertionError(f'{executed} queries executed, {limit} allowed:\n{statements}')
@@ -0,0 +1,202 @@
+"""
+Bulk insert and upsert with the best statement for each database
+
+bulk_create(ignore_conflicts=True) cannot tell which rows were new, and
+Django 3.2 cannot update on conflict. These helpers write one statement
+per batch, chosen by database vendor:
+
+                skip duplicates             update duplicates
+    PostgreSQL  ON CONFLICT DO NOTHING      ON CONFLICT DO UPDATE
+    SQLite      ON CONFLICT DO NOTHING      ON CONFLICT DO UPDATE
+    MySQL       INSERT IGNORE               ON DUPLICATE KEY UPDATE
+
+The conflict fields must be covered by a unique constraint; when they are
+the primary key, its values are inserted too (copying rows between
+databases), and every value is copied as it is: auto_now and
+auto_now_add fields are not refreshed. PostgreSQL and SQLite 3.35+ report the inserted rows with
+RETURNING. On MySQL and older SQLite (INSERT OR IGNORE), the keys that
+already existed are read before the insert instead.
+"""
+from django.db import NotSupportedError, connections, router
+from django.db.models import Q
+from django.db.models.expressions import Col
+
+BATCH_SIZE = 500
+
+
+def insert_ignore(objs, unique_fields, batch_size=BATCH_SIZE, using=None):
+    """
+    Insert model instances, skipping those whose unique_fields match an existing row
+    Returns the inserted instances with their primary key set. Instances
+    repeating a key earlier in objs count as existing. using overrides the
+    database the router picks.
+    """
+    objs = _unique(objs, unique_fields, keep='first')
+    if not objs:
+        return []
+    model, connection, fields = _prepare(objs, unique_fields, using)
+    returning = _supports_returning(connection)
+    inserted = []
+    for batch in _batches(objs, fields, connection, batch_size):
+        if returning:
+            inserted.extend(_insert_returning(model, connection, fields, batch, unique_fields))
+        else:
+            inserted.extend(_insert_ignore_and_read(model, connection, fields, batch, unique_fields))
+    return inserted
+
+
+def upsert(objs, unique_fields, update_fields, batch_size=BATCH_SIZE, using=None):
+    """
+    Insert model instances, updating update_fields of the rows that already exist
+    Returns the number of rows the database reports as affected. When
+    objs repeat a key, the last one wins.
+    """
+    objs = _unique(objs, unique_fields, keep='last')
+    if not objs:
+        return 0
+    model, connection, fields = _prepare(objs, unique_fields, using)
+    vendor = connection.vendor
+    qn = connection.ops.quote_name
+    updates = [model._meta.get_field(name).column for name in update_fields]
+    if vendor == 'mysql':
+        suffix = 'ON DUPLICATE KEY UPDATE ' + ', '.join(f'{qn(c)} = VALUES({qn(c)})' for c in updates)
+    elif vendor in ('postgresql', 'sqlite'):
+        if vendor == 'sqlite' and connection.Database.sqlite_version_info < (3, 24):
+            raise NotSupportedError('upsert needs SQLite 3.24 or later')
+        suffix = (f'ON CONFLICT ({_columns(model, unique_fields, qn)}) DO UPDATE SET '
+                  + ', '.join(f'{qn(c)} = EXCLUDED.{qn(c)}' for c in updates))
+    else:
+        raise NotSupportedError(f'upsert is not implemented for {vendor}')
+
+    affected = 0
+    for batch in _batches(objs, fields, connection, batch_size):
+        sql, params = _insert_sql(model, connection, fields, batch)
+        with connection.cursor() as cursor:
+            cursor.execute(f'{sql} {suffix}', params)
+            affected += cursor.rowcount
+    return affected
+
+
+def _prepare(objs, unique_fields, using):
+    model = type(objs[0])
+    connection = connections[using or router.db_for_write(model)]
+    with_pk = model._meta.pk.name in unique_fields
+    fields = [f for f in model._meta.concrete_fields if with_pk or not f.primary_key]
+    return model, connection, fields
+
+
+def _supports_returning(connection):
+    if connection.vendor == 'postgresql':
+        return True
+    return connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 35)
+
+
+def _key(obj, unique_fields):
+    return tuple(getattr(obj, obj._meta.get_field(name).attname) for name in unique_fields)
+
+
+def _unique(objs, unique_fields, keep):
+    by_key = {}
+    for obj in objs:
+        key = _key(obj, unique_fields)
+        if keep == 'last' or key not in by_key:
+            by_key[key] = obj
+    return list(by_key.values())
+
+
+def _columns(model, names, qn):
+    return ', '.join(qn(model._meta.get_field(name).column) for name in names)
+
+
+def _batches(objs, fields, connection, batch_size):
+    # SQLite limits the number of parameters per statement
+    size = max(1, min(batch_size, connection.ops.bulk_batch_size(fields, objs)))
+    for start in range(0, len(objs), size):
+        yield objs[start:start + size]
+
+
+def _insert_sql(model, connection, fields, batch):
+    """
+    INSERT ... VALUES statement for batch; pre_save fills auto_now fields as save() would
+    Rows copied with their primary key keep their values, and the instances are left untouched.
+    """
+    qn = connection.ops.quote_name
+    copy = model._meta.pk in fields
+    params = []
+    for obj in batch:
+        params.extend(
+            f.get_db_prep_save(f.value_from_object(obj) if copy else f.pre_save(obj, True), connection)
+            for f in fields
+        )
+    row = '(' + ', '.join(['%s'] * len(fields)) + ')'
+    sql = (f'INSERT INTO {qn(model._meta.db_table)} ({", ".join(qn(f.column) for f in fields)}) '
+           f'VALUES {", ".join([row] * len(batch))}')
+    return sql, params
+
+
+def _insert_returning(model, connection, fields, batch, unique_fields):
+    qn = connection.ops.quote_name
+    sql, params = _insert_sql(model, connection, fields, batch)
+    conflict = _columns(model, unique_fields, qn)
+    sql = f'{sql} ON CONFLICT ({conflict}) DO NOTHING RETURNING {qn(model._meta.pk.column)}, {conflict}'
+
+    # Convert the returned keys as a queryset would before matching them
+    converters = []
+    for name in unique_fields:
+        column = Col(model._meta.db_table, model._meta.get_field(name))
+        converters.append((column, connection.ops.get_db_converters(column) + column.get_db_converters(connection)))
+    by_key = {_key(obj, unique_fields): obj for obj in batch}
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    inserted = []
+    for pk, *values in rows:
+        key = []
+        for value, (column, functions) in zip(values, converters):
+            for convert in functions:
+                value = convert(value, column, connection)
+            key.append(value)
+        obj = by_key[tuple(key)]
+        obj.pk = pk
+        obj._state.adding = False
+        obj._state.db = connection.alias
+        inserted.append(obj)
+    return inserted
+
+
+def _insert_ignore_and_read(model, connection, fields, batch, unique_fields):
+    keys = [_key(obj, unique_fields) for obj in batch]
+    existing = _read_keys(model, connection, unique_fields, keys)
+
+    sql, params = _insert_sql(model, connection, fields, batch)
+    if connection.vendor == 'mysql':
+        sql = 'INSERT IGNORE' + sql[len('INSERT'):]
+    else:
+        sql = 'INSERT OR IGNORE' + sql[len('INSERT'):]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+    new = [(key, obj) for key, obj in zip(keys, batch) if key not in existing]
+    if not new:
+        return []
+    stored = _read_keys(model, connection, unique_fields, [key for key, _ in new])
+    inserted = []
+    for key, obj in new:
+        # Missing only when the row was deleted again in the meantime
+        if key in stored:
+            obj.pk = stored[key]
+            obj._state.adding = False
+            obj._state.db = connection.alias
+            inserted.append(obj)
+    return inserted
+
+
+def _read_keys(model, connection, unique_fields, keys):
+    """{key: pk} of the stored rows among keys; one query on a superset of them"""
+    condition = Q()
+    for n, name in enumerate(unique_fields):
+        condition &= Q(**{f'{model._meta.get_field(name).attname}__in': {key[n] for key in keys}})
+    wanted = set(keys)
+    attnames = [model._meta.get_field(name).attname for name in unique_fields]
+    rows = model._base_manager.using(connection.alias).filter(condition).values_list('pk', *attnames)
+    return {tuple(key): pk for pk, *key in rows if tuple(key) in wanted}
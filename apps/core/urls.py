@@ -0,0 +1,9 @@
+"""
+URL routing for core app
+"""
+from django.urls import path
+from .views import stats_api
+
+urlpatterns = [
+    path('', stats_api, name='stats'),
+]
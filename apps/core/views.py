@@ -0,0 +1,62 @@
+"""
+API Views for Core Services
+"""
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseForbidden
+from django.shortcuts import render
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from . import profiling
+from .metrics import registry
+from .stats import get_dashboard_stats
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def stats_api(request):
+    """
+    Dashboard statistics
+    Served from cached counters, no list queries per call
+    """
+    if not request.user.is_manager:
+        return Response(
+            {'error': 'Only admins or managers can view statistics.'},
+            status=status.HTTP_403_FORBIDDEN
+        )
+    
+    return Response(get_dashboard_stats())
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint
+    Only reachable from METRICS_ALLOWED_IPS (X-Real-IP is set by nginx)
+    """
+    client_ip = request.META.get('HTTP_X_REAL_IP') or request.META.get('REMOTE_ADDR')
+    if client_ip not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden('Forbidden')
+    
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@staff_member_required
+def profile_list(request):
+    """Recent sampling profiles (admin page)"""
+    return render(request, 'core/profiles.html', {
+        'title': 'Profiles',
+        'profiles': profiling.list_profiles(),
+        'enabled': settings.PROFILING_ENABLED,
+        'sample_rates': settings.PROFILING_SAMPLE_RATES,
+    })
+
+
+@staff_member_required
+def profile_download(request, name):
+    """Download one profile in collapsed stack format"""
+    path = profiling.profile_path(name)
+    if path is None:
+        raise Http404('Profile not found')
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=name, content_type='text/plain')
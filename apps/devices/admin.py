@@ -3,7 +3,10 @@ Admin interface for Device Management
 """
 from django.contrib import admin
 from django.utils.html import format_html
-from .models import Device, DeviceUser, DeviceLog
+from apps.core.changelist import AutocompleteListFilter, LargeTableAdminMixin
+from apps.core.search import IndexedSearchMixin
+from .command_queue import announce
+from .models import Device, DeviceCommand, DeviceUser, DeviceLog
 
 
 @admin.register(Device)
@@ -11,7 +14,7 @@ class DeviceAdmin(admin.ModelAdmin):
     """Device Admin"""
     list_display = ('name', 'serial_number', 'ip_address', 'location', 
                     'status_badge', 'is_active_badge', 'last_online')
-    list_filter = ('status', 'is_active', 'device_type', 'created_at')
+    list_filter = ('status', 'is_active', 'site', 'device_type', 'created_at')
     search_fields = ('name', 'serial_number', 'ip_address', 'location')
     readonly_fields = ('created_at', 'updated_at', 'last_online')
     
@@ -23,7 +26,10 @@ class DeviceAdmin(admin.ModelAdmin):
             'fields': ('ip_address', 'port')
         }),
         ('Location & Status', {
-            'fields': ('location', 'status', 'is_active', 'last_online')
+            'fields': ('location', 'site', 'status', 'is_active', 'last_online')
+        }),
+        ('Ingest', {
+            'fields': ('punch_suppress_seconds',)
         }),
         ('Additional Information', {
             'fields': ('notes', 'created_by', 'created_at', 'updated_at')
@@ -54,23 +60,52 @@ class DeviceAdmin(admin.ModelAdmin):
 
 
 @admin.register(DeviceUser)
-class DeviceUserAdmin(admin.ModelAdmin):
+class DeviceUserAdmin(LargeTableAdminMixin, IndexedSearchMixin, admin.ModelAdmin):
     """Device User Admin"""
     list_display = ('user', 'device', 'device_user_id', 'is_synced', 'synced_at')
-    list_filter = ('is_synced', 'device', 'created_at')
+    list_filter = ('is_synced', ('device', AutocompleteListFilter), 'created_at')
     search_fields = ('user__username', 'device__name', 'device_user_id', 'card_number')
+    list_select_related = ('user', 'device')
+    autocomplete_fields = ('user', 'device')
     readonly_fields = ('created_at', 'updated_at', 'synced_at')
 
 
 @admin.register(DeviceLog)
-class DeviceLogAdmin(admin.ModelAdmin):
+class DeviceLogAdmin(LargeTableAdminMixin, IndexedSearchMixin, admin.ModelAdmin):
     """Device Log Admin"""
     list_display = ('device', 'log_type', 'message_preview', 'timestamp')
-    list_filter = ('log_type', 'device', 'timestamp')
+    list_filter = ('log_type', ('device', AutocompleteListFilter), 'timestamp')
     search_fields = ('device__name', 'log_type', 'message')
+    list_select_related = ('device',)
+    autocomplete_fields = ('device',)
     readonly_fields = ('timestamp',)
+    date_hierarchy = 'timestamp'
     
     def message_preview(self, obj):
         """Show preview of message"""
         return obj.message[:100] + '...' if len(obj.message) > 100 else obj.message
     message_preview.short_description = 'Message'
+
+
+@admin.register(DeviceCommand)
+class DeviceCommandAdmin(IndexedSearchMixin, admin.ModelAdmin):
+    """Device Command Admin"""
+    list_display = ('device', 'command_preview', 'status', 'return_code', 'created_at', 'completed_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('device__serial_number', 'device__name', 'command')
+    list_select_related = ('device',)
+    autocomplete_fields = ('device',)
+    readonly_fields = ('status', 'return_code', 'created_by', 'created_at', 'sent_at', 'completed_at')
+    
+    def command_preview(self, obj):
+        """Show preview of command"""
+        return obj.command[:80] + '...' if len(obj.command) > 80 else obj.command
+    command_preview.short_description = 'Command'
+    
+    def save_model(self, request, obj, form, change):
+        """Wake the device when a new command is queued here"""
+        if not change:
+            obj.created_by = request.user
+        super().save_model(request, obj, form, change)
+        if not change:
+            announce(obj)
@@ -0,0 +1,223 @@
+"""
+Admission control for device uploads
+
+After a site-wide outage every device reconnects at once and uploads its
+backlog. Processing all of those uploads together exhausts database
+connections and slows the REST API for everyone. Before an upload touches
+the database it must pass two checks:
+1. a token bucket per serial number: ICLOCK_UPLOAD_BURST uploads at once,
+   then ICLOCK_UPLOAD_RATE per second, so one device retrying in a loop
+   cannot take every slot
+2. a cap of ICLOCK_MAX_CONCURRENT_UPLOADS uploads being processed at the
+   same time
+
+A rejected upload gets "503 ERROR: busy" with a Retry-After header, before
+the body is read or a query runs. The device does not get "OK", so it keeps
+the punches and sends them again on a later attempt.
+
+With the redis cache backend, buckets and the cap are shared by every
+worker (Lua scripts, so each check is one round trip). The cap is a
+sorted set of leases that expire after ICLOCK_UPLOAD_LEASE_SECONDS, so a
+killed worker does not hold its slots forever. Otherwise, or while redis
+is unreachable, the state lives in the process and the cap applies per
+process.
+"""
+import logging
+import math
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from django.conf import settings
+from django.http import HttpResponse
+from apps.core import metrics
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'iclock:admission'
+SLOTS_KEY = f'{KEY_PREFIX}:slots'
+WARN_INTERVAL = 60  # seconds between "redis unavailable" warnings
+LOCAL_BUCKETS = 10000  # idle buckets are pruned beyond this many devices
+
+# Refill the bucket from redis server time, then take a token. Returns the
+# seconds until a token is available (as a string: Lua numbers are
+# truncated to integers on the way out), "0" when one was taken.
+TOKEN_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+# Drop expired leases, then add one unless the cap is reached
+SLOT_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[2]), ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+
+class Ticket:
+    """Outcome of an admission check"""
+    __slots__ = ('admitted', 'reason', 'retry_after')
+
+    def __init__(self, admitted, reason=None, retry_after=0):
+        self.admitted = admitted
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionControl:
+    """Per-device token buckets and a cap on concurrent uploads"""
+
+    def __init__(self, rate, burst, max_concurrent, lease_seconds):
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrent = max_concurrent
+        self.lease_seconds = lease_seconds
+        self._buckets = {}  # sn -> [tokens, monotonic time of the last update]
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._scripts = None
+        self._last_warning = 0
+
+    def _redis(self):
+        if settings.CACHE_BACKEND != 'redis':
+            return None
+        from django_redis import get_redis_connection
+        conn = get_redis_connection('default')
+        if self._scripts is None:
+            self._scripts = (conn.register_script(TOKEN_SCRIPT), conn.register_script(SLOT_SCRIPT))
+        return conn
+
+    def _warn(self, e):
+        now = time.monotonic()
+        if now - self._last_warning >= WARN_INTERVAL:
+            self._last_warning = now
+            logger.warning(f"Upload admission falling back to per-process limits: {str(e)}")
+
+    # Token buckets
+
+    def take_token(self, sn):
+        """Take one upload token for sn; returns 0, or the seconds until one is available"""
+        if self.rate <= 0:
+            return 0
+        try:
+            conn = self._redis()
+            if conn is not None:
+                return float(self._scripts[0](keys=[f'{KEY_PREFIX}:bucket:{sn}'],
+                                              args=[self.rate, self.burst], client=conn))
+        except Exception as e:
+            self._warn(e)
+        return self._take_local_token(sn)
+
+    def _take_local_token(self, sn):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._buckets) > LOCAL_BUCKETS:
+                self._prune(now)
+            tokens, updated = self._buckets.get(sn, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                self._buckets[sn] = [tokens - 1, now]
+                return 0
+            self._buckets[sn] = [tokens, now]
+            return (1 - tokens) / self.rate
+
+    def _prune(self, now):
+        # A bucket idle long enough to be full again is the same as no bucket
+        idle = self.burst / self.rate
+        for sn in [sn for sn, (_, updated) in self._buckets.items() if now - updated >= idle]:
+            del self._buckets[sn]
+
+    # Concurrency cap
+
+    def acquire_slot(self):
+        """Reserve a processing slot; returns a release callable, or None when all are taken"""
+        if self.max_concurrent <= 0:
+            return lambda: None
+        try:
+            conn = self._redis()
+            if conn is not None:
+                member = uuid.uuid4().hex
+                if not self._scripts[1](keys=[SLOTS_KEY], args=[self.max_concurrent, self.lease_seconds, member],
+                                        client=conn):
+                    return None
+                return lambda: self._release_shared(conn, member)
+        except Exception as e:
+            self._warn(e)
+        if not self._slots.acquire(blocking=False):
+            return None
+        return self._slots.release
+
+    def _release_shared(self, conn, member):
+        try:
+            conn.zrem(SLOTS_KEY, member)
+        except Exception as e:
+            # The lease expires by itself after lease_seconds
+            self._warn(e)
+
+    @contextmanager
+    def admit(self, sn):
+        """
+        Admission check for one upload from sn
+        Yields a Ticket; a slot taken for an admitted upload is released on exit.
+        """
+        if not settings.ICLOCK_ADMISSION_ENABLED:
+            yield Ticket(True)
+            return
+        release = self.acquire_slot()
+        if release is None:
+            metrics.UPLOADS_REJECTED.inc(reason='busy')
+            # Spread the retries so rejected devices do not come back together
+            yield Ticket(False, 'busy', settings.ICLOCK_RETRY_AFTER * random.uniform(1, 2))
+            return
+        try:
+            wait = self.take_token(sn)
+            if wait > 0:
+                release()
+                release = None
+                metrics.UPLOADS_REJECTED.inc(reason='rate')
+                yield Ticket(False, 'rate', wait)
+                return
+            yield Ticket(True)
+        finally:
+            if release is not None:
+                release()
+
+
+def retry_later(sn, ticket):
+    """Cheap rejection: the device keeps its punches and uploads them again later"""
+    retry_after = max(1, math.ceil(ticket.retry_after))
+    logger.info(f"Upload from {sn} deferred ({ticket.reason}), retry in {retry_after}s")
+    response = HttpResponse('ERROR: busy', status=503)
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+admission = AdmissionControl(
+    rate=settings.ICLOCK_UPLOAD_RATE,
+    burst=settings.ICLOCK_UPLOAD_BURST,
+    max_concurrent=settings.ICLOCK_MAX_CONCURRENT_UPLOADS,
+    lease_seconds=settings.ICLOCK_UPLOAD_LEASE_SECONDS,
+)
@@ -5,3 +5,7 @@ class DevicesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.devices'
     verbose_name = 'Device Management'
+    
+    def ready(self):
+        """Import signals when app is ready"""
+        from . import signals  # noqa: F401
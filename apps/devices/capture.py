@@ -0,0 +1,244 @@
+"""
+Capture of device protocol traffic (/iclock/cdata, getrequest, devicecmd) for replay
+
+When CAPTURE_ENABLED, requests from a sample of devices are appended as
+JSON lines to gzip files in CAPTURE_DIR. Each line records the request
+method, path, query, a few headers, the body, the response and the
+timing. Each worker writes its own file, which rotates by size or age.
+Only the newest CAPTURE_MAX_FILES files are kept.
+
+Before writing, PINs are replaced with stable keyed pseudonyms of the same
+length, so a replay still maps each employee consistently. Names, cards
+and passwords are masked, and biometric templates are blanked. Client
+addresses are never stored.
+"""
+import asyncio
+import base64
+import gzip
+import hashlib
+import heapq
+import hmac
+import json
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+SUFFIX = '.jsonl.gz'
+# Device protocol only; /iclock/data/ carries employee records in JSON
+CAPTURED_PATHS = ('/iclock/cdata', '/iclock/getrequest', '/iclock/devicecmd')
+KEPT_HEADERS = ('User-Agent', 'Content-Type', 'Content-Encoding', 'Accept', 'Connection')
+SCRUBBED_KEYS = {'Name': 'name', 'Card': 'card', 'Passwd': 'password', 'Password': 'password'}
+TEMPLATE_KEYS = ('TMP', 'Tmp', 'Content')
+KEY_VALUE = re.compile(r'(?<![^\s\t])(\w+)=([^\t\r\n]*)')
+
+
+class Scrubber:
+    """Pseudonymize PINs and mask personal fields in upload bodies"""
+
+    def __init__(self, key):
+        self.key = key.encode()
+
+    def pin(self, pin):
+        if not pin:
+            return pin
+        digest = int(hmac.new(self.key, pin.encode(), hashlib.sha256).hexdigest(), 16)
+        if pin.isdigit():
+            return str(digest % 10 ** len(pin)).zfill(len(pin))
+        return f'{digest:x}'[:len(pin)]
+
+    def _mask(self, kind, value):
+        if not value:
+            return value
+        return f'{kind}-{hashlib.sha256(self.key + value.encode()).hexdigest()[:8]}'
+
+    def line(self, line, attendance=False):
+        # Bare (table=ATTLOG) or ATTLOG-prefixed attendance line: PIN comes first
+        fields = line.split('\t')
+        if fields[0].strip() == 'ATTLOG' or (attendance and '=' not in fields[0]):
+            offset = 1 if fields[0].strip() == 'ATTLOG' else 0
+            if len(fields) > offset:
+                fields[offset] = self.pin(fields[offset].strip())
+            return '\t'.join(fields)
+
+        # USER / FP / OPLOG style "Key=value\tKey=value" lines
+        def replace(match):
+            key, value = match.groups()
+            if key == 'PIN':
+                return f'{key}={self.pin(value)}'
+            if key in SCRUBBED_KEYS:
+                return f'{key}={self._mask(SCRUBBED_KEYS[key], value)}'
+            if key in TEMPLATE_KEYS:
+                return f'{key}='
+            return match.group(0)
+        return KEY_VALUE.sub(replace, line)
+
+    def body(self, text, table=None):
+        attendance = table == 'ATTLOG'
+        return '\n'.join(
+            self.line(line, attendance) if line.strip() else line for line in text.split('\n')
+        )
+
+
+class CaptureWriter:
+    """Appends records to a per-process rotating gzip file"""
+
+    def __init__(self, directory, max_bytes, max_age, max_files):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.max_files = max_files
+        self._lock = threading.Lock()
+        self._file = None
+        self._written = 0
+        self._opened = 0
+        self._flushed = 0
+
+    def write(self, record):
+        data = (json.dumps(record, separators=(',', ':')) + '\n').encode()
+        with self._lock:
+            now = time.monotonic()
+            if self._file is None or self._written >= self.max_bytes or now - self._opened >= self.max_age:
+                self._rotate(now)
+            self._file.write(data)
+            self._written += len(data)
+            if now - self._flushed >= 1:
+                # A crash loses at most a second of records
+                self._file.flush()
+                self._flushed = now
+
+    def _rotate(self, now):
+        if self._file is not None:
+            self._file.close()
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        path = os.path.join(self.directory, f'capture-{stamp}-{os.getpid()}{SUFFIX}')
+        self._file = gzip.open(path, 'ab')
+        self._written = 0
+        self._opened = now
+        self._prune()
+
+    def _prune(self):
+        names = sorted(n for n in os.listdir(self.directory) if n.endswith(SUFFIX))
+        for name in names[:-self.max_files]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def sampled(sn, rate):
+    """Stable per-device decision, so a captured device is captured completely"""
+    if rate >= 1:
+        return True
+    bucket = int(hashlib.sha256(sn.encode()).hexdigest()[:8], 16) / 0xFFFFFFFF
+    return bucket < rate
+
+
+def _read_file(path):
+    with gzip.open(path, 'rt') as f:
+        try:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        except (EOFError, gzip.BadGzipFile, json.JSONDecodeError):
+            logger.warning(f"Capture file {path} is truncated, stopped at the last complete record")
+
+
+def read_capture(paths):
+    """Yield records of several capture files (one per worker) merged by time"""
+    return heapq.merge(*(_read_file(path) for path in paths), key=lambda record: record['ts'])
+
+
+def record_body(record):
+    """Request body bytes of a captured record"""
+    if 'body_b64' in record:
+        return base64.b64decode(record['body_b64'])
+    return record.get('body', '').encode()
+
+
+class CaptureMiddleware:
+    """Records sampled /iclock/ requests (see module docstring); sync or async"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.writer = None
+        self.scrubber = None
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+        if settings.CAPTURE_ENABLED:
+            self.writer = CaptureWriter(
+                settings.CAPTURE_DIR,
+                settings.CAPTURE_MAX_BYTES,
+                settings.CAPTURE_ROTATE_SECONDS,
+                settings.CAPTURE_MAX_FILES,
+            )
+            self.scrubber = Scrubber(settings.CAPTURE_SCRUB_KEY or settings.SECRET_KEY)
+
+    def wanted(self, request):
+        if self.writer is None or not request.path.startswith(CAPTURED_PATHS):
+            return False
+        return sampled(request.GET.get('SN', ''), settings.CAPTURE_SAMPLE_RATE)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not self.wanted(request):
+            return self.get_response(request)
+
+        body = request.body  # read before the view so it stays available
+        started = time.time()
+        start = time.perf_counter()
+        response = self.get_response(request)
+        self.write(request, body, response, started, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        if not self.wanted(request):
+            return await self.get_response(request)
+
+        body = request.body  # already in memory under ASGI
+        started = time.time()
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        # Buffered gzip append, flushed at most once a second: cheap enough for the event loop
+        self.write(request, body, response, started, time.perf_counter() - start)
+        return response
+
+    def write(self, request, body, response, started, elapsed):
+        try:
+            self.writer.write(self.build_record(request, body, response, started, elapsed))
+        except Exception as e:
+            logger.warning(f"Capture failed for {request.path}: {str(e)}")
+
+    def build_record(self, request, body, response, started, elapsed):
+        record = {
+            'ts': round(started, 6),
+            'method': request.method,
+            'path': request.path,
+            'query': request.META.get('QUERY_STRING', ''),
+            'headers': {name: request.headers[name] for name in KEPT_HEADERS if name in request.headers},
+            'status': response.status_code,
+            'duration_ms': round(elapsed * 1000, 3),
+        }
+        try:
+            record['body'] = self.scrubber.body(body.decode('utf-8'), request.GET.get('table'))
+        except UnicodeDecodeError:
+            # Undecodable bodies (e.g. photos) are not scrubbed, only kept for size realism
+            record['body_b64'] = base64.b64encode(b'\0' * len(body)).decode()
+        if not getattr(response, 'streaming', False):
+            record['response'] = self.scrubber.body(response.content[:200].decode('utf-8', 'replace'))
+        return record
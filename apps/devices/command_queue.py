@@ -0,0 +1,120 @@
+"""
+Device command queue
+
+Commands are stored as DeviceCommand rows. A device receives its pending
+commands in the reply to its next getrequest poll and reports the
+results through devicecmd. Queuing a command publishes an event on
+CHANNEL so long-polling getrequests (ASGI) answer right away.
+
+With the redis cache backend, queuing also sets a per-device marker key
+and polls only query the database while it is set. Devices poll every
+few seconds and almost never have commands waiting, so most polls then
+never open a database connection.
+"""
+import logging
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from apps.core import events, metrics
+from .models import DeviceCommand
+from .protocol import format_commands, parse_command_results
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'device-commands'
+COMMANDS_PER_POLL = 10
+MARKER_KEY = 'devices:commands:{sn}'
+
+
+def queue_command(device, command, created_by=None):
+    """Queue a command for a device"""
+    queued = DeviceCommand.objects.create(device=device, command=command, created_by=created_by)
+    announce(queued)
+    return queued
+
+
+def queue_commands(device, commands, created_by=None):
+    """Queue several commands for a device in one insert"""
+    queued = DeviceCommand.objects.bulk_create([
+        DeviceCommand(device=device, command=command, created_by=created_by) for command in commands
+    ])
+    if queued:
+        transaction.on_commit(lambda: _notify(device.serial_number))
+        metrics.DEVICE_COMMANDS.inc(len(queued), status='pending')
+    return queued
+
+
+def announce(queued):
+    """Wake the device's long poll once the new command is committed"""
+    sn = queued.device.serial_number
+    transaction.on_commit(lambda: _notify(sn))
+    metrics.DEVICE_COMMANDS.inc(status='pending')
+
+
+def _notify(sn):
+    if settings.CACHE_BACKEND == 'redis':
+        try:
+            cache.set(MARKER_KEY.format(sn=sn), 1, timeout=None)
+        except Exception as e:
+            logger.warning(f"Failed to mark pending commands for {sn}: {str(e)}")
+    events.publish(CHANNEL, 'queued', [{'sn': sn}])
+
+
+def _marker_cleared(sn):
+    """
+    Clear the device's marker; False when it was not set (nothing queued)
+    Cleared before the query: a command committed meanwhile is either
+    found by it or sets the marker again for the next poll.
+    """
+    if settings.CACHE_BACKEND != 'redis':
+        return True
+    try:
+        return bool(cache.delete(MARKER_KEY.format(sn=sn)))
+    except Exception as e:
+        logger.warning(f"Failed to read pending commands marker for {sn}: {str(e)}")
+        return True
+
+
+def take_pending(sn):
+    """
+    Reply body with the device's pending commands, marked as sent
+    Returns an empty string when nothing is pending, the answer to almost
+    every poll: without a query when the marker is unset, otherwise after
+    one indexed query.
+    """
+    if not _marker_cleared(sn):
+        return ''
+    pending = DeviceCommand.objects.filter(device__serial_number=sn, status='pending')
+    if not pending.exists():
+        return ''
+    with transaction.atomic():
+        claimed = list(
+            pending.select_for_update(skip_locked=True)
+            .order_by('id').values_list('id', 'command')[:COMMANDS_PER_POLL]
+        )
+        DeviceCommand.objects.filter(pk__in=[command_id for command_id, _ in claimed]).update(
+            status='sent', sent_at=timezone.now()
+        )
+    if not claimed:
+        return ''
+    if len(claimed) == COMMANDS_PER_POLL:
+        _notify(sn)  # more may be waiting: keep the marker for the next poll
+    metrics.DEVICE_COMMANDS.inc(len(claimed), status='sent')
+    logger.info(f"Sent {len(claimed)} commands to {sn}")
+    return format_commands(claimed)
+
+
+def record_results(sn, body):
+    """Store the results a device reported through devicecmd; returns how many matched"""
+    updated = 0
+    now = timezone.now()
+    for command_id, return_code, name in parse_command_results(body):
+        status = 'success' if return_code >= 0 else 'failed'
+        updated += DeviceCommand.objects.filter(pk=command_id, device__serial_number=sn).update(
+            status=status, return_code=return_code, completed_at=now
+        )
+        metrics.DEVICE_COMMANDS.inc(status=status)
+        if status == 'failed':
+            logger.warning(f"Command {command_id} ({name}) failed on {sn}: return code {return_code}")
+    return updated
@@ -0,0 +1,156 @@
+"""
+Async iClock protocol views for the ASGI device handler
+
+Under ASGI the request body is read by the event loop before the view
+runs, so a slow upload over a branch-office link costs a coroutine, not a
+worker. The views reuse the sync handlers for database work and run them
+in a thread pool of ICLOCK_ASYNC_DB_WORKERS threads. That pool bounds the
+number of database connections whatever the number of open device
+connections. Keep ICLOCK_MAX_CONCURRENT_UPLOADS below it so that rejected
+uploads and polls still find a free thread during an upload storm.
+
+getrequest can long-poll: with ICLOCK_LONGPOLL_SECONDS set, a poll that
+finds no pending command is held open until a command is queued for the
+device (command_queue.CHANNEL event) or the time runs out.
+"""
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpResponse, HttpResponseNotAllowed
+from apps.core import events, metrics
+from apps.core.middleware import track_queries
+from .command_queue import CHANNEL, record_results, take_pending
+from .iclock_views import handle_admitted_bundle, handle_admitted_upload, handle_device_registration, relay_name
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=settings.ICLOCK_ASYNC_DB_WORKERS, thread_name_prefix='iclock-db')
+
+
+def _call(stats, func, args):
+    close_old_connections()
+    try:
+        if stats is None:
+            return func(*args)
+        with track_queries(stats):
+            return func(*args)
+    finally:
+        close_old_connections()
+
+
+async def run_db(request, func, *args):
+    """Run blocking database work in the pool, counting its queries for MetricsMiddleware"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, _call, getattr(request, 'query_stats', None), func, args)
+
+
+class CommandNotifier:
+    """Wakes long-polling getrequests when a command is queued for their device"""
+
+    def __init__(self):
+        self._waiters = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._listen, name='iclock-commands', daemon=True)
+                self._thread.start()
+
+    def _listen(self):
+        last_id = None
+        while True:
+            try:
+                if last_id is None:
+                    last_id = events.current_id(CHANNEL)
+                for event in events.listen(CHANNEL, last_id, timeout=15, duration=3600):
+                    if event is not None:
+                        last_id = event.id
+                        self._wake(event.data['sn'])
+            except Exception as e:
+                logger.warning(f"Command notifier failed, retrying: {str(e)}")
+                time.sleep(5)
+
+    def _wake(self, sn):
+        with self._lock:
+            waiters = list(self._waiters.get(sn, ()))
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    async def wait(self, sn, timeout):
+        """Wait until a command is queued for sn; False on timeout"""
+        self._start()
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._waiters.setdefault(sn, set()).add(waiter)
+        try:
+            with metrics.LONGPOLLS_WAITING.track_inprogress():
+                await asyncio.wait_for(waiter[1].wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(sn)
+                waiters.discard(waiter)
+                if not waiters:
+                    del self._waiters[sn]
+
+
+notifier = CommandNotifier()
+
+
+async def iclock_cdata(request):
+    """Async version of iclock_views.iclock_cdata"""
+    if request.method not in ('GET', 'POST'):
+        return HttpResponseNotAllowed(['GET', 'POST'])
+
+    sn = request.GET.get('SN', '')
+    if not sn:
+        return HttpResponse('ERROR: No SN provided', status=400)
+
+    logger.info(f"iClock request from SN: {sn}, Method: {request.method}")
+    metrics.CDATA_REQUESTS.inc(method=request.method)
+
+    if request.method == 'GET':
+        return await run_db(request, handle_device_registration, request, sn)
+    return await run_db(request, handle_admitted_upload, request, sn)
+
+
+async def iclock_getrequest(request):
+    """Pending commands for the device, long-polling when ICLOCK_LONGPOLL_SECONDS is set"""
+    sn = request.GET.get('SN', '')
+    logger.info(f"getrequest from SN: {sn}")
+
+    body = await run_db(request, take_pending, sn)
+    if not body and sn and settings.ICLOCK_LONGPOLL_SECONDS > 0:
+        # Check again after waking or timing out: a command queued just
+        # before the wait started has no event left to wake us
+        await notifier.wait(sn, settings.ICLOCK_LONGPOLL_SECONDS)
+        body = await run_db(request, take_pending, sn)
+    return HttpResponse(body or 'OK', status=200)
+
+
+async def iclock_devicecmd(request):
+    """Async version of iclock_views.iclock_devicecmd"""
+    sn = request.GET.get('SN', '')
+    logger.info(f"devicecmd from SN: {sn}")
+
+    if request.method == 'POST':
+        await run_db(request, record_results, sn, request.body.decode('utf-8', 'replace'))
+    return HttpResponse('OK', status=200)
+
+
+async def iclock_relay(request):
+    """Async version of iclock_views.iclock_relay"""
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    relay = relay_name(request)
+    if relay is None:
+        return HttpResponse('ERROR: unauthorized', status=401)
+    return await run_db(request, handle_admitted_bundle, request, relay)
@@ -13,9 +13,12 @@ from rest_framework.permissions import AllowAny
 from rest_framework.decorators import permission_classes
 from rest_framework.response import Response
 from rest_framework import status
-from apps.accounts.models import User
+from apps.accounts.departments import get_departments, get_subtree_ids
+from apps.accounts.models import Department, User
 from apps.devices.models import Device
 from apps.attendance.models import AttendanceRecord
+from apps.attendance.storage import store_punches
+from apps.core.sharding import gather, punch_database
 from django.http import JsonResponse
 
 
@@ -31,8 +34,17 @@ def department_api(request):
     POST: Create/Update department
     """
     if request.method == 'GET':
-        # Return departments (for now, empty or from User groups)
-        departments = []
+        rows = get_departments()
+        codes = {row['id']: row['code'] for row in rows}
+        departments = [
+            {
+                'id': row['id'],
+                'dept_code': row['code'] or '',
+                'dept_name': row['name'],
+                'parent_dept': codes.get(row['parent_id']) or '',
+            }
+            for row in rows if row['is_active']
+        ]
         return Response({
             'code': 0,
             'msg': 'success',
@@ -40,10 +52,57 @@ def department_api(request):
         })
     
     elif request.method == 'POST':
+        # Departments scope what managers see: only admins may change them
+        if not request.user.is_authenticated:
+            return Response({
+                'code': 1,
+                'msg': 'Authentication required'
+            }, status=status.HTTP_401_UNAUTHORIZED)
+        if not request.user.is_admin:
+            return Response({
+                'code': 1,
+                'msg': 'Only admins can create or update departments'
+            }, status=status.HTTP_403_FORBIDDEN)
+        
         # Create/Update department
+        data = request.data
+        dept_code = data.get('dept_code')
+        
+        if not dept_code:
+            return Response({
+                'code': 1,
+                'msg': 'dept_code is required'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        existing = Department.objects.filter(code=dept_code).first()
+        defaults = {'name': data.get('dept_name') or (existing.name if existing else dept_code)}
+        # The parent only changes when parent_dept is sent; an empty value makes a top-level department
+        if 'parent_dept' in data:
+            parent_code = data.get('parent_dept')
+            parent = None
+            if parent_code:
+                parent = Department.objects.filter(code=parent_code).first()
+                if parent is None:
+                    return Response({
+                        'code': 1,
+                        'msg': f'Unknown parent_dept "{parent_code}"'
+                    }, status=status.HTTP_400_BAD_REQUEST)
+                if existing and parent.id in get_subtree_ids(existing.id):
+                    return Response({
+                        'code': 1,
+                        'msg': 'parent_dept cannot be the department itself or one below it'
+                    }, status=status.HTTP_400_BAD_REQUEST)
+            defaults['parent'] = parent
+        
+        department, created = Department.objects.update_or_create(
+            code=dept_code,
+            defaults=defaults
+        )
+        
         return Response({
             'code': 0,
-            'msg': 'Department saved'
+            'msg': 'Department saved',
+            'data': {'id': department.id, 'dept_code': department.code}
         })
 
 
@@ -60,7 +119,7 @@ def employee_api(request):
     """
     if request.method == 'GET':
         # Return all users as employees
-        users = User.objects.filter(is_active=True)
+        users = User.objects.filter(is_active=True).select_related('department')
         employees = []
         
         for user in users:
@@ -70,7 +129,7 @@ def employee_api(request):
                 'first_name': user.first_name,
                 'last_name': user.last_name,
                 'email': user.email,
-                'department': '',
+                'department': user.department.name if user.department else '',
                 'position': '',
                 'hire_date': user.date_joined.strftime('%Y-%m-%d') if user.date_joined else '',
             })
@@ -128,7 +187,7 @@ def transaction_api(request):
         device_sn = request.GET.get('device_sn')
         
         # Filter attendance records
-        records = AttendanceRecord.objects.all()
+        records = AttendanceRecord.objects.select_related('user', 'device')
         
         if start_date:
             records = records.filter(timestamp__gte=start_date)
@@ -139,8 +198,8 @@ def transaction_api(request):
         if device_sn:
             records = records.filter(device__serial_number=device_sn)
         
-        # Limit to latest 1000 records
-        records = records.order_by('-timestamp')[:1000]
+        # Limit to latest 1000 records, across site databases
+        records = gather(records.order_by('-timestamp'))[:1000]
         
         transactions = []
         for rec in records:
@@ -195,15 +254,18 @@ def transaction_api(request):
         dt = datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S')
         dt_aware = timezone.make_aware(dt)
         
-        record, created = AttendanceRecord.objects.get_or_create(
+        record = AttendanceRecord(
             user=user,
             device=device,
             timestamp=dt_aware,
-            defaults={
-                'verify_type': data.get('verify_type', '1'),
-                'is_processed': False
-            }
+            verify_type=data.get('verify_type', '1'),
+            is_processed=False
         )
+        created = bool(store_punches([record]))
+        if not created:
+            record = AttendanceRecord.objects.db_manager(punch_database(record)).only('id').get(
+                user=user, device=device, timestamp=dt_aware
+            )
         
         return Response({
             'code': 0,
@@ -4,13 +4,21 @@ from rest_framework.decorators import permission_classes
 iClock Protocol Views
 Handle communication with fingerprint devices
 """
-from django.http import HttpResponse
+import hmac
+import json
+import zlib
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.utils import timezone
+from apps.core import metrics
+from .admission import admission, retry_later
 from .models import Device, DeviceLog
-from apps.attendance.models import AttendanceRecord
-from apps.accounts.models import User
+from .command_queue import record_results, take_pending
+from .ingest import ingest_punches
+from .protocol import format_attlog_line, parse_attlog
+from .spool import DATABASE_UNAVAILABLE, spool
 import logging
 
 logger = logging.getLogger(__name__)
@@ -31,11 +39,12 @@ def iclock_cdata(request):
     
     # Log request
     logger.info(f"iClock request from SN: {sn}, Method: {request.method}")
+    metrics.CDATA_REQUESTS.inc(method=request.method)
     
     if request.method == 'GET':
         return handle_device_registration(request, sn)
     elif request.method == 'POST':
-        return handle_attendance_upload(request, sn)
+        return handle_admitted_upload(request, sn)
     
     return HttpResponse('OK', status=200)
 
@@ -52,7 +61,7 @@ def handle_device_registration(request, sn):
             defaults={
                 'name': f'Device {sn}',
                 'ip_address': get_client_ip(request),
-                'status': 'active',
+                'status': 'online',
                 'last_online': timezone.now()
             }
         )
@@ -68,7 +77,8 @@ def handle_device_registration(request, sn):
         else:
             # Update last activity
             device.last_online = timezone.now()
-            device.save(update_fields=['last_online'])
+            device.status = 'online'
+            device.save(update_fields=['last_online', 'status'])
         
         # Return commands (empty for now, can add later)
         # Format: OK or C:command
@@ -79,85 +89,211 @@ def handle_device_registration(request, sn):
         return HttpResponse('ERROR', status=500)
 
 
+def handle_admitted_upload(request, sn):
+    """
+    Attendance upload behind admission control
+    When the device or the server is over its limit, answer 503 with
+    Retry-After before reading the body or querying the database.
+    """
+    if settings.ICLOCK_SPOOL_ENABLED:
+        spool.start()  # replays spools left by workers that exited
+    with admission.admit(sn) as ticket:
+        if not ticket.admitted:
+            return retry_later(sn, ticket)
+        with metrics.CDATA_INFLIGHT.track_inprogress():
+            return handle_attendance_upload(request, sn)
+
+
 def handle_attendance_upload(request, sn):
     """
     Handle attendance data upload from device
     Format: POST data contains attendance records
     """
+    punches = []
     try:
-        device = Device.objects.filter(serial_number=sn).first()
-        
-        if not device:
-            # Auto-create if not exists
-            device = Device.objects.create(
-                serial_number=sn,
-                name=f'Device {sn}',
-                ip_address=get_client_ip(request),
-                status='active',
-                last_online=timezone.now()
-            )
-            logger.info(f"Device auto-created during upload: {sn}")
-        
         # Parse attendance data from POST body
         body = request.body.decode('utf-8')
         logger.info(f"Attendance data from {sn}: {body[:200]}")
         
         # Parse iClock format data
-        # Format typically: ATTLOG or similar
-        lines = body.strip().split('\n')
-        records_created = 0
+        # Format: ATTLOG\tpin\ttime\tstate\tverify, or bare lines with table=ATTLOG
+        with metrics.PARSE_SECONDS.time():
+            punches = parse_attlog(body, table=request.GET.get('table'))
+        metrics.RECORDS_PARSED.inc(len(punches), sn=sn)
+        
+        device = upload_device(sn, get_client_ip(request))
         
-        for line in lines:
-            if line.startswith('ATTLOG'):
-                # Parse format: ATTLOG\tpin\ttime\tstate\tverify
-                # Example: ATTLOG\t1\t2024-01-15 08:30:00\t0\t1
-                parts = line.split('\t')
-                if len(parts) >= 3:
-                    try:
-                        user_id = parts[1]
-                        timestamp_str = parts[2]
-                        
-                        # Find or create user
-                        user, _ = User.objects.get_or_create(
-                            username=f'emp_{user_id}',
-                            defaults={'email': f'emp_{user_id}@local'}
-                        )
-                        
-                        # Parse timestamp
-                        from datetime import datetime
-                        timestamp = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
-                        timestamp = timezone.make_aware(timestamp)
-                        
-                        # Create attendance record
-                        AttendanceRecord.objects.get_or_create(
-                            user=user,
-                            device=device,
-                            timestamp=timestamp,
-                            defaults={
-                                'verify_type': parts[4] if len(parts) > 4 else '1',
-                                'is_processed': False
-                            }
-                        )
-                        records_created += 1
-                        
-                    except Exception as e:
-                        logger.error(f"Error parsing line: {line}, Error: {str(e)}")
-                        continue
+        with metrics.INSERT_SECONDS.time():
+            new_records = ingest_punches(device, punches)
         
-        logger.info(f"Created {records_created} attendance records from {sn}")
+        logger.info(f"Created {len(new_records)} attendance records from {sn} "
+                    f"({len(punches)} parsed)")
         
         # Update device last activity
         device.last_online = timezone.now()
-        device.save(update_fields=['last_online'])
+        device.status = 'online'
+        device.save(update_fields=['last_online', 'status'])
         
         # Return success
         return HttpResponse('OK', status=200)
         
+    except DATABASE_UNAVAILABLE as e:
+        if not (settings.ICLOCK_SPOOL_ENABLED and punches):
+            logger.error(f"Database unavailable for upload from {sn}: {str(e)}")
+            return HttpResponse('ERROR', status=500)
+        # Acknowledge from the local spool: a retrying device would only add load
+        try:
+            spool.append(sn, get_client_ip(request), [format_attlog_line(punch) for punch in punches])
+        except OSError as error:
+            logger.error(f"Database unavailable and spooling failed for upload from {sn}: {str(error)}")
+            return HttpResponse('ERROR', status=500)
+        logger.warning(f"Database unavailable, spooled {len(punches)} punches from {sn}: {str(e)}")
+        return HttpResponse('OK', status=200)
+        
     except Exception as e:
         logger.error(f"Error handling attendance upload from {sn}: {str(e)}")
         return HttpResponse('ERROR', status=500)
 
 
+def upload_device(sn, ip_address):
+    """Device sending an upload, registered on first contact"""
+    device = Device.objects.filter(serial_number=sn).first()
+    if not device:
+        # Auto-create if not exists
+        device = Device.objects.create(
+            serial_number=sn,
+            name=f'Device {sn}',
+            ip_address=ip_address,
+            status='online',
+            last_online=timezone.now()
+        )
+        logger.info(f"Device auto-created during upload: {sn}")
+    return device
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def iclock_relay(request):
+    """
+    Bulk upload endpoint for edge relays (apps/devices/relay.py)
+    Takes a gzip-compressed JSON bundle of device uploads, authenticated
+    with a bearer token from ICLOCK_RELAY_TOKENS.
+    """
+    relay = relay_name(request)
+    if relay is None:
+        return HttpResponse('ERROR: unauthorized', status=401)
+    return handle_admitted_bundle(request, relay)
+
+
+def relay_name(request):
+    """Name of the relay whose token the request carries, or None"""
+    scheme, _, token = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        return None
+    for name, expected in settings.ICLOCK_RELAY_TOKENS.items():
+        if hmac.compare_digest(token.encode(), expected.encode()):
+            return name
+    return None
+
+
+def handle_admitted_bundle(request, relay):
+    """Relay bundle behind admission control; the relay keeps it and retries after a 503"""
+    with admission.admit(f'relay:{relay}') as ticket:
+        if not ticket.admitted:
+            return retry_later(f'relay {relay}', ticket)
+        with metrics.CDATA_INFLIGHT.track_inprogress():
+            return handle_relay_bundle(request, relay)
+
+
+class BundleTooLarge(ValueError):
+    """Compressed bundle above ICLOCK_RELAY_MAX_UPLOAD"""
+
+
+def read_bundle(request):
+    """Decode a relay bundle: {"bundle": id, "uploads": [{"sn", "ip", "lines"}, ...]}"""
+    # request.body stops at DATA_UPLOAD_MAX_MEMORY_SIZE; bundles have their own limit
+    if int(request.META.get('CONTENT_LENGTH') or 0) > settings.ICLOCK_RELAY_MAX_UPLOAD:
+        raise BundleTooLarge('bundle larger than ICLOCK_RELAY_MAX_UPLOAD')
+    body = request.read()
+    if request.META.get('HTTP_CONTENT_ENCODING') == 'gzip':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            body = decompressor.decompress(body, settings.ICLOCK_RELAY_MAX_BYTES)
+        except zlib.error as e:
+            raise ValueError(f'bad gzip data: {str(e)}')
+        if decompressor.unconsumed_tail:
+            raise ValueError('bundle larger than ICLOCK_RELAY_MAX_BYTES')
+    bundle = json.loads(body)
+    uploads = bundle.get('uploads') if isinstance(bundle, dict) else None
+    if not isinstance(uploads, list) or not all(
+        isinstance(upload, dict) and isinstance(upload.get('sn'), str) and upload['sn']
+        and isinstance(upload.get('lines'), list) for upload in uploads
+    ):
+        raise ValueError('expected "uploads": [{"sn": ..., "lines": [...]}, ...]')
+    return bundle.get('bundle'), uploads
+
+
+def handle_relay_bundle(request, relay):
+    """
+    Store the uploads of a relay bundle, one batch per device
+    Punches stored by an earlier attempt are skipped, so a bundle can be
+    sent again safely. Each device is stored in its own transaction: a
+    device whose lines fail is listed under "failed" with the error and
+    the others are stored. Only an unreachable database fails the whole
+    bundle (503, the relay sends it again).
+    """
+    try:
+        bundle_id, uploads = read_bundle(request)
+    except BundleTooLarge as e:
+        logger.warning(f"Bundle from relay {relay} refused: {str(e)}")
+        return JsonResponse({'error': str(e)}, status=413)
+    except ValueError as e:
+        logger.warning(f"Bad bundle from relay {relay}: {str(e)}")
+        return JsonResponse({'error': str(e)}, status=400)
+
+    try:
+        by_device = {}
+        for upload in uploads:
+            entry = by_device.setdefault(upload['sn'], {'ip': upload.get('ip'), 'lines': []})
+            entry['lines'].extend(str(line) for line in upload['lines'])
+
+        stored = 0
+        failed = {}
+        for sn, entry in by_device.items():
+            try:
+                stored += len(store_device_lines(sn, entry['ip'] or get_client_ip(request), entry['lines']))
+            except DATABASE_UNAVAILABLE:
+                raise
+            except Exception as e:
+                logger.error(f"Relay {relay} bundle {bundle_id}: lines from {sn} not stored: {str(e)}")
+                failed[sn] = str(e)
+
+        metrics.RELAY_UPLOADS.inc(len(uploads), relay=relay)
+        logger.info(f"Relay {relay} bundle {bundle_id}: {len(uploads)} uploads from "
+                    f"{len(by_device)} devices, {stored} new punches, {len(failed)} devices failed")
+        return JsonResponse({'bundle': bundle_id, 'uploads': len(uploads), 'stored': stored, 'failed': failed})
+
+    except DATABASE_UNAVAILABLE as e:
+        logger.error(f"Database unavailable for bundle {bundle_id} from relay {relay}: {str(e)}")
+        response = HttpResponse('ERROR: database unavailable', status=503)
+        response['Retry-After'] = str(settings.ICLOCK_RETRY_AFTER)
+        return response
+
+    except Exception as e:
+        logger.error(f"Error handling bundle {bundle_id} from relay {relay}: {str(e)}")
+        return HttpResponse('ERROR', status=500)
+
+
+def store_device_lines(sn, ip_address, lines):
+    """Store bare ATTLOG lines of one device (relay bundles, spool replay); returns the new records"""
+    device = upload_device(sn, ip_address)
+    with metrics.PARSE_SECONDS.time():
+        punches = parse_attlog('\n'.join(lines), table='ATTLOG')
+    metrics.RECORDS_PARSED.inc(len(punches), sn=sn)
+    with metrics.INSERT_SECONDS.time():
+        return ingest_punches(device, punches)
+
+
 def get_client_ip(request):
     """Get client IP address from request"""
     x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
@@ -172,22 +308,22 @@ def get_client_ip(request):
 def iclock_getrequest(request):
     """
     Handle getrequest from device
-    Used for device configuration sync
+    Replies with pending commands ("C:<id>:<command>" lines) or OK
     """
     sn = request.GET.get('SN', '')
     logger.info(f"getrequest from SN: {sn}")
     
-    # Return empty or configuration commands
-    return HttpResponse('OK', status=200)
+    return HttpResponse(take_pending(sn) or 'OK', status=200)
 
 
 @csrf_exempt  
 def iclock_devicecmd(request):
     """
-    Handle devicecmd - commands for device
+    Handle devicecmd - results of the commands sent with getrequest
     """
     sn = request.GET.get('SN', '')
     logger.info(f"devicecmd from SN: {sn}")
     
-    # Return commands if any
+    if request.method == 'POST':
+        record_results(sn, request.body.decode('utf-8', 'replace'))
     return HttpResponse('OK', status=200)
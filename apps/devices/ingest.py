@@ -0,0 +1,99 @@
+"""
+Attendance ingest pipeline
+Turns parsed device punches into AttendanceRecord rows, stored in one
+batch by apps.attendance.storage.store_punches. Near-duplicate taps are
+dropped first (see suppression.py).
+"""
+import logging
+from django.conf import settings
+from django.db import InterfaceError, OperationalError
+from django.utils import timezone
+from apps.accounts.models import User
+from apps.core import metrics
+from apps.attendance.models import AttendanceRecord
+from apps.attendance.storage import store_punches
+from apps.attendance.stream import publish_punches
+from .models import DeviceLog
+from .resolver import resolver
+from .suppression import suppressor, window_seconds
+
+logger = logging.getLogger(__name__)
+
+
+def ingest_punches(device, punches):
+    """
+    Store punches uploaded by one device
+    Returns the newly created records (duplicates and suppressed
+    near-duplicates are skipped).
+    """
+    if not punches:
+        return []
+
+    user_ids = resolver.resolve_many(device, {punch.pin for punch in punches})
+    records = [
+        AttendanceRecord(
+            user_id=user_ids[punch.pin],
+            device=device,
+            timestamp=timezone.make_aware(punch.timestamp),
+            verify_type=punch.verify,
+            verify_code=punch.status,
+            work_code=punch.workcode,
+        )
+        for punch in punches
+    ]
+    records, suppressed = suppressor.split(device, records)
+    failed = 0
+
+    try:
+        new_records = store_punches(records)
+    except (OperationalError, InterfaceError):
+        raise  # the database is unreachable: retrying punch by punch cannot help
+    except Exception as e:
+        # One bad punch fails the whole batch: store the rest one by one
+        logger.warning(f"Batch insert from {device.serial_number} failed, retrying per punch: {str(e)}")
+        new_records = []
+        for record in records:
+            try:
+                new_records.extend(store_punches([record]))
+            except Exception as error:
+                logger.error(f"Error storing punch of user {record.user_id} at {record.timestamp} "
+                             f"from {device.serial_number}: {str(error)}")
+                failed += 1
+        if failed == len(records):
+            raise
+
+    sn = device.serial_number
+    metrics.RECORDS_INSERTED.inc(len(new_records), sn=sn)
+    metrics.RECORDS_DUPLICATE.inc(len(records) - len(new_records) - failed, sn=sn)
+    metrics.RECORDS_FAILED.inc(failed, sn=sn)
+    if suppressed:
+        metrics.RECORDS_SUPPRESSED.inc(len(suppressed), sn=sn)
+        if settings.PUNCH_SUPPRESS_LOG:
+            log_suppressed(device, suppressed)
+    newest = max(punch.timestamp for punch in punches)
+    lag = timezone.now() - timezone.make_aware(newest)
+    metrics.UPLOAD_LAG.set(round(lag.total_seconds(), 3), sn=sn)
+
+    # Attach users in one query for the live feed
+    users = User.objects.in_bulk({record.user_id for record in new_records})
+    for record in new_records:
+        record.user = users[record.user_id]
+    publish_punches(new_records)
+
+    return new_records
+
+
+def log_suppressed(device, records):
+    """One DeviceLog row per upload listing the suppressed punches compactly"""
+    DeviceLog.objects.create(
+        device=device,
+        log_type='suppressed',
+        message=f'{len(records)} near-duplicate punches suppressed',
+        details={
+            'window_seconds': window_seconds(device),
+            # [user id, timestamp, state]
+            'punches': [
+                [record.user_id, record.timestamp.isoformat(), record.verify_code] for record in records
+            ],
+        },
+    )
@@ -0,0 +1,179 @@
+"""
+Append-only journal of the edge relay (see relay.py)
+Pure Python, no Django imports, so the relay runs without the server.
+
+Entries are JSON documents appended to segment files journal-<n>.log,
+each framed as a 4-byte length, the CRC-32 of the payload and the
+payload. append() returns only after fsync, so an upload acknowledged
+to a device survives a crash or power cut. A torn entry at the end of
+the last segment (a crash during the write) is cut off on open.
+
+Readers take entries from the position stored in the "cursor" file,
+which commit() replaces atomically; segments that lie entirely before
+the cursor are deleted.
+"""
+import json
+import logging
+import os
+import re
+import struct
+import threading
+import zlib
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct('>II')  # payload length, CRC-32
+SEGMENT_NAME = re.compile(r'^journal-(\d+)\.log$')
+CURSOR_FILE = 'cursor'
+SEGMENT_BYTES = 16 * 1024 * 1024
+
+
+def _frame(entry):
+    payload = json.dumps(entry, separators=(',', ':')).encode('utf-8')
+    return HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+class Journal:
+    """Durable FIFO of JSON entries with a committed read position"""
+
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES, fsync=True):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        self.cursor = self._read_cursor()
+        self._segments = sorted(
+            int(match.group(1)) for match in map(SEGMENT_NAME.match, os.listdir(directory)) if match
+        )
+        if not self._segments:
+            self._segments = [self.cursor[0]]
+        self._recover(self._segments[-1])
+        self._file = open(self._path(self._segments[-1]), 'ab')
+
+    def _path(self, segment):
+        return os.path.join(self.directory, f'journal-{segment:08d}.log')
+
+    def _read_cursor(self):
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE)) as f:
+                cursor = json.load(f)
+            return cursor['segment'], cursor['offset']
+        except FileNotFoundError:
+            return 1, 0
+
+    def _scan(self, segment, offset):
+        """Yield (offset after the entry, payload) for the valid entries from offset"""
+        try:
+            f = open(self._path(segment), 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            f.seek(offset)
+            while True:
+                header = f.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    return
+                length, crc = HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    if f.read(1):  # not just a torn tail
+                        logger.error(f"Corrupt journal entry in segment {segment} at offset {offset}, "
+                                     f"skipping the rest of the segment")
+                    return
+                offset += HEADER.size + length
+                yield offset, payload
+
+    def _recover(self, segment):
+        """Cut off a torn or corrupt tail left by a crash"""
+        end = 0
+        for end, _ in self._scan(segment, 0):
+            pass
+        path = self._path(segment)
+        if os.path.exists(path) and os.path.getsize(path) > end:
+            logger.warning(f"Truncating journal segment {segment} from {os.path.getsize(path)} to {end} bytes")
+            with open(path, 'r+b') as f:
+                f.truncate(end)
+                os.fsync(f.fileno())
+
+    def _sync_directory(self):
+        if self.fsync and hasattr(os, 'O_DIRECTORY'):
+            fd = os.open(self.directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def append(self, entries):
+        """Append entries durably (one write and one fsync for all of them)"""
+        data = b''.join(_frame(entry) for entry in entries)
+        with self._lock:
+            self._file.write(data)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            if self._file.tell() >= self.segment_bytes:
+                self._file.close()
+                self._segments.append(self._segments[-1] + 1)
+                self._file = open(self._path(self._segments[-1]), 'ab')
+                self._sync_directory()
+
+    def read(self, max_entries):
+        """Up to max_entries entries after the cursor, and the position to commit once they are handled"""
+        with self._lock:  # no half-written entry at the end
+            segment, offset = self.cursor
+            entries = []
+            for current in [s for s in self._segments if s >= segment]:
+                start = offset if current == segment else 0
+                for end, payload in self._scan(current, start):
+                    entries.append(json.loads(payload))
+                    segment, offset = current, end
+                    if len(entries) >= max_entries:
+                        return entries, (segment, offset)
+                if current < self._segments[-1]:
+                    # Finished with this segment: the next read starts in the following one
+                    segment, offset = current + 1, 0
+            return entries, (segment, offset)
+
+    def commit(self, position):
+        """Record that everything before position was handled; drop finished segments"""
+        segment, offset = position
+        path = os.path.join(self.directory, CURSOR_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'segment': segment, 'offset': offset}, f)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+        self._sync_directory()
+        self.cursor = (segment, offset)
+
+        with self._lock:
+            finished = [s for s in self._segments if s < segment]
+            self._segments = [s for s in self._segments if s >= segment]
+        for old in finished:
+            try:
+                os.remove(self._path(old))
+            except FileNotFoundError:
+                pass
+
+    def pending_bytes(self):
+        """Journal bytes not yet committed"""
+        with self._lock:
+            segments = list(self._segments)
+        total = 0
+        for segment in segments:
+            try:
+                size = os.path.getsize(self._path(segment))
+            except FileNotFoundError:
+                continue
+            if segment == self.cursor[0]:
+                size -= self.cursor[1]
+            if segment >= self.cursor[0]:
+                total += size
+        return total
+
+    def close(self):
+        with self._lock:
+            self._file.close()
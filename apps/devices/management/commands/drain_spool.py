@@ -0,0 +1,36 @@
+"""
+Replay spooled uploads into the database
+Workers replay their own spool and those of exited workers by themselves;
+use this after the device workers were stopped for good, or on Windows
+where they cannot tell an exited worker's spool from a live one.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from apps.devices.iclock_views import store_device_lines
+from apps.devices.spool import DATABASE_UNAVAILABLE, REJECTED_FILE, replay, spool
+
+
+class Command(BaseCommand):
+    help = 'Replay uploads spooled while the database was unavailable'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report what is spooled')
+
+    def handle(self, *args, **options):
+        total = 0
+        for directory in spool.orphans(force=True):
+            try:
+                pending = directory.journal.pending_bytes()
+                if options['dry_run']:
+                    self.stdout.write(f'{directory.directory}: {pending} bytes pending')
+                    continue
+                try:
+                    drained = replay(directory, store_device_lines)
+                except DATABASE_UNAVAILABLE as e:
+                    raise CommandError(f'Database unavailable: {str(e)}')
+                total += drained
+                self.stdout.write(f'{directory.directory}: {drained} uploads replayed')
+                if not directory.finished():
+                    self.stdout.write(self.style.WARNING(f'  rejected uploads kept in {REJECTED_FILE}'))
+            finally:
+                directory.close(remove=not options['dry_run'] and directory.finished())
+        self.stdout.write(self.style.SUCCESS(f'{total} spooled uploads replayed.'))
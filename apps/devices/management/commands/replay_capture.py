@@ -0,0 +1,216 @@
+"""
+Replay captured device traffic against a test server
+
+Reads capture files written by CaptureMiddleware (CAPTURE_ENABLED) and
+sends the requests again, either at the original pace scaled by --speed
+or as fast as possible (--speed 0). Requests from one device stay in
+order. Status codes and response bodies are compared with the capture.
+Latency percentiles are stored as JSON with --output, and --baseline
+compares them with an earlier run, for example the previous build.
+Do not point this at production.
+"""
+import hashlib
+import http.client
+import json
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import parse_qsl, urlencode, urlsplit
+from django.core.management.base import BaseCommand, CommandError
+from apps.devices.capture import SUFFIX, read_capture, record_body
+from .simulate_devices import SERVER_TIMING_QUERIES, percentile
+
+_STOP = object()
+
+
+class Command(BaseCommand):
+    help = 'Replay captured /iclock/ traffic and compare responses and timings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='Capture files or directories')
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Server base URL')
+        parser.add_argument('--speed', type=float, default=1.0,
+                            help='Time scale: 1 = original pace, 10 = ten times faster, 0 = no pacing')
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--sn-prefix', default='', help='Prefix added to every serial number')
+        parser.add_argument('--limit', type=int, help='Replay at most this many requests')
+        parser.add_argument('--timeout', type=float, default=30)
+        parser.add_argument('--output', help='Write results as JSON')
+        parser.add_argument('--baseline', help='Results JSON of an earlier run to compare with')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Allowed slowdown against the baseline (0.2 = 20%%)')
+
+    def handle(self, *args, **options):
+        self.url = urlsplit(options['url'])
+        if self.url.scheme not in ('http', 'https') or not self.url.hostname:
+            raise CommandError('--url must look like http://host:port')
+        self.options = options
+        paths = self.capture_files(options['paths'])
+        if not paths:
+            raise CommandError('No capture files found')
+
+        self.lock = threading.Lock()
+        self.results = defaultdict(lambda: {
+            'latencies': [], 'captured': [], 'queries': [], 'errors': 0, 'mismatches': 0,
+        })
+        self.samples = {}
+        queues = [queue.Queue(maxsize=1000) for _ in range(options['concurrency'])]
+        workers = [threading.Thread(target=self.worker, args=(q,), daemon=True) for q in queues]
+        for worker in workers:
+            worker.start()
+
+        self.stdout.write(f'Replaying {len(paths)} file(s) against {options["url"]} at speed {options["speed"]}')
+        started = time.monotonic()
+        first_ts = None
+        count = 0
+        for record in read_capture(paths):
+            if options['limit'] and count >= options['limit']:
+                break
+            if first_ts is None:
+                first_ts = record['ts']
+            if options['speed'] > 0:
+                delay = started + (record['ts'] - first_ts) / options['speed'] - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            sn = dict(parse_qsl(record['query'])).get('SN', '')
+            shard = int(hashlib.md5(sn.encode()).hexdigest()[:8], 16) % len(queues)
+            queues[shard].put(record)
+            count += 1
+            if count % 1000 == 0:
+                self.stdout.write(f'{count} requests sent')
+
+        for q in queues:
+            q.put(_STOP)
+        for worker in workers:
+            worker.join()
+        elapsed = time.monotonic() - started
+
+        summary = self.summarize(count, elapsed)
+        self.report(summary)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(summary, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+        if options['baseline']:
+            self.compare(summary, options['baseline'], options['threshold'])
+
+    def capture_files(self, paths):
+        files = []
+        for path in paths:
+            if os.path.isdir(path):
+                files.extend(sorted(os.path.join(path, n) for n in os.listdir(path) if n.endswith(SUFFIX)))
+            elif os.path.exists(path):
+                files.append(path)
+            else:
+                raise CommandError(f'{path} does not exist')
+        return files
+
+    def worker(self, records):
+        connection = None
+        while True:
+            record = records.get()
+            if record is _STOP:
+                break
+            connection = self.replay(connection, record)
+
+    def replay(self, connection, record):
+        query = parse_qsl(record['query'], keep_blank_values=True)
+        if self.options['sn_prefix']:
+            query = [(k, self.options['sn_prefix'] + v if k == 'SN' else v) for k, v in query]
+        target = f"{self.url.path.rstrip('/')}{record['path']}?{urlencode(query)}"
+        body = record_body(record) if record['method'] == 'POST' else None
+
+        start = time.perf_counter()
+        try:
+            if connection is None:
+                connection_class = (http.client.HTTPSConnection if self.url.scheme == 'https'
+                                    else http.client.HTTPConnection)
+                connection = connection_class(self.url.hostname, self.url.port, timeout=self.options['timeout'])
+            connection.request(record['method'], target, body=body, headers=record.get('headers', {}))
+            response = connection.getresponse()
+            text = response.read()[:200].decode('utf-8', 'replace')
+        except (OSError, http.client.HTTPException) as e:
+            self.add(record, time.perf_counter() - start, error=repr(e))
+            if connection is not None:
+                connection.close()
+            return None
+
+        match = SERVER_TIMING_QUERIES.search(response.getheader('Server-Timing') or '')
+        mismatch = None
+        if response.status != record['status']:
+            mismatch = f"status {response.status}, captured {record['status']}"
+        elif 'response' in record and text.strip() != record['response'].strip():
+            mismatch = f"body {text.strip()[:60]!r}, captured {record['response'].strip()[:60]!r}"
+        self.add(record, time.perf_counter() - start, int(match.group(1)) if match else None, mismatch=mismatch)
+        return connection
+
+    def add(self, record, elapsed, queries=None, error=None, mismatch=None):
+        with self.lock:
+            result = self.results[record['path']]
+            result['latencies'].append(elapsed * 1000)
+            result['captured'].append(record.get('duration_ms', 0))
+            if queries is not None:
+                result['queries'].append(queries)
+            if error:
+                result['errors'] += 1
+                self.samples.setdefault(record['path'], error)
+            elif mismatch:
+                result['mismatches'] += 1
+                self.samples.setdefault(record['path'], mismatch)
+
+    def summarize(self, count, elapsed):
+        endpoints = {}
+        for path, result in sorted(self.results.items()):
+            latencies, captured, queries = result['latencies'], result['captured'], result['queries']
+            endpoints[path] = {
+                'requests': len(latencies),
+                'errors': result['errors'],
+                'mismatches': result['mismatches'],
+                'p50_ms': round(percentile(latencies, 0.50), 2),
+                'p95_ms': round(percentile(latencies, 0.95), 2),
+                'p99_ms': round(percentile(latencies, 0.99), 2),
+                'captured_p50_ms': round(percentile(captured, 0.50), 2),
+                'captured_p99_ms': round(percentile(captured, 0.99), 2),
+                'queries_avg': round(sum(queries) / len(queries), 2) if queries else None,
+            }
+        return {
+            'url': self.options['url'],
+            'speed': self.options['speed'],
+            'requests': count,
+            'elapsed_s': round(elapsed, 2),
+            'endpoints': endpoints,
+        }
+
+    def report(self, summary):
+        self.stdout.write('')
+        self.stdout.write(f"{'path':<22}{'requests':>9}{'errors':>8}{'diffs':>7}{'p50 ms':>9}{'p99 ms':>9}"
+                          f"{'capt p50':>10}{'capt p99':>10}{'queries':>9}")
+        for path, row in summary['endpoints'].items():
+            queries = '-' if row['queries_avg'] is None else f"{row['queries_avg']:.1f}"
+            self.stdout.write(
+                f"{path:<22}{row['requests']:>9}{row['errors']:>8}{row['mismatches']:>7}"
+                f"{row['p50_ms']:>9.1f}{row['p99_ms']:>9.1f}{row['captured_p50_ms']:>10.1f}"
+                f"{row['captured_p99_ms']:>10.1f}{queries:>9}"
+            )
+        for path, sample in self.samples.items():
+            self.stdout.write(self.style.WARNING(f'{path}: {sample}'))
+        self.stdout.write(f"{summary['requests']} requests in {summary['elapsed_s']}s")
+
+    def compare(self, summary, baseline_path, threshold):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        regressions = []
+        for path, row in summary['endpoints'].items():
+            before = baseline.get('endpoints', {}).get(path)
+            if not before:
+                continue
+            for key in ('p50_ms', 'p99_ms'):
+                if before[key] and row[key] > before[key] * (1 + threshold):
+                    regressions.append(f'{path} {key}: {before[key]} -> {row[key]}')
+        if regressions:
+            for line in regressions:
+                self.stdout.write(self.style.ERROR(f'Slower: {line}'))
+            raise CommandError(f'{len(regressions)} timing regression(s) over {threshold:.0%}')
+        self.stdout.write(self.style.SUCCESS(f'No regressions against {baseline_path}.'))
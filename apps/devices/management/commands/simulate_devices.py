@@ -0,0 +1,362 @@
+"""
+Simulate a fleet of iClock devices against a running server
+
+Each simulated device does the following:
+- sends the cdata handshake
+- polls /iclock/getrequest every --poll-interval seconds
+- acknowledges any "C:<id>:<command>" lines it receives through
+  /iclock/devicecmd
+- uploads ATTLOG bursts of random size every --upload-interval seconds
+
+With --storm-at, every device goes offline for --storm-outage seconds,
+buffering its punches. All devices then reconnect at the same moment and
+upload their backlog, as after a network or power outage. An upload
+answered with 503 and Retry-After (upload admission control) is kept and
+sent again after that delay, as the firmware does; it counts as deferred,
+not as an error.
+
+The report shows latency percentiles, throughput, error rates and database
+queries per request, read from the Server-Timing header. Only the standard
+library is used on the client side. Do not point this at production.
+"""
+import heapq
+import http.client
+import random
+import re
+import threading
+import time
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+from urllib.parse import urlencode, urlsplit
+from django.core.management.base import BaseCommand, CommandError
+
+SERVER_TIMING_QUERIES = re.compile(r'db;[^,]*desc="(\d+) queries"')
+COMMAND_LINE = re.compile(r'^C:([^:]+):(.*)$')
+
+
+RetryLater = namedtuple('RetryLater', 'seconds')
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class SimulatedDevice:
+    def __init__(self, sn, pins, rng):
+        self.sn = sn
+        self.pins = pins
+        self.rng = rng
+        self.backlog = []
+        self.pending_acks = []
+        self.online = True
+        self.connected = False
+
+    def punches(self, count, now):
+        lines = []
+        for _ in range(count):
+            moment = now - timedelta(seconds=self.rng.randint(0, 30))
+            lines.append(f"{self.rng.choice(self.pins)}\t{moment.strftime('%Y-%m-%d %H:%M:%S')}"
+                         f"\t{self.rng.choice((0, 1))}\t1\t0\t0\t0")
+        return lines
+
+
+class Stats:
+    """Thread-safe collection of per-endpoint results"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.queries = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.deferred = defaultdict(int)
+        self.error_samples = {}
+        self.punches = 0
+
+    def record(self, endpoint, elapsed, ok, queries=None, error=None, punches=0, deferred=False):
+        with self.lock:
+            self.latencies[endpoint].append(elapsed)
+            if queries is not None:
+                self.queries[endpoint].append(queries)
+            if deferred:
+                self.deferred[endpoint] += 1
+            elif not ok:
+                self.errors[endpoint] += 1
+                self.error_samples.setdefault(endpoint, error)
+            else:
+                self.punches += punches
+
+    def total(self):
+        with self.lock:
+            return (sum(len(v) for v in self.latencies.values()), sum(self.errors.values()),
+                    sum(self.deferred.values()), self.punches)
+
+
+class Command(BaseCommand):
+    help = 'Emulate many iClock devices against a running server and report latency and errors'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Server base URL')
+        parser.add_argument('--devices', type=int, default=100)
+        parser.add_argument('--prefix', default='SIM', help='Serial number prefix')
+        parser.add_argument('--duration', type=float, default=60, help='Seconds to run')
+        parser.add_argument('--ramp', type=float, default=10, help='Seconds over which devices connect')
+        parser.add_argument('--concurrency', type=int, default=50, help='Client threads')
+        parser.add_argument('--poll-interval', type=float, default=30)
+        parser.add_argument('--upload-interval', type=float, default=60,
+                            help='Mean seconds between uploads per device')
+        parser.add_argument('--burst', type=int, default=5, help='Maximum punches per upload')
+        parser.add_argument('--pins-per-device', type=int, default=200)
+        parser.add_argument('--pin-start', type=int, default=500000)
+        parser.add_argument('--from-db', action='store_true',
+                            help='Use devices and PINs from the database (see generate_load_data)')
+        parser.add_argument('--storm-at', type=float, help='Seconds into the run to start an outage')
+        parser.add_argument('--storm-outage', type=float, default=30,
+                            help='Outage length; all devices reconnect together afterwards')
+        parser.add_argument('--timeout', type=float, default=30)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme not in ('http', 'https') or not url.hostname:
+            raise CommandError('--url must look like http://host:port')
+        self.url = url
+        self.options = options
+        self.rng = random.Random(options['seed'])
+        self.devices = self.build_devices(options)
+        if not self.devices:
+            raise CommandError('No devices to simulate')
+
+        self.stats = Stats()
+        self.queue = []
+        self.condition = threading.Condition()
+        self.sequence = 0
+        self.started = time.monotonic()
+        self.deadline = self.started + options['duration']
+
+        for device in self.devices:
+            self.schedule(self.rng.uniform(0, options['ramp']), 'handshake', device)
+        if options['storm_at'] is not None:
+            self.schedule(options['storm_at'], 'storm_start', None)
+            self.schedule(options['storm_at'] + options['storm_outage'], 'storm_end', None)
+
+        self.stdout.write(f"Simulating {len(self.devices)} devices against {options['url']} "
+                          f"for {options['duration']:.0f}s with {options['concurrency']} threads")
+        workers = [threading.Thread(target=self.worker, daemon=True) for _ in range(options['concurrency'])]
+        for worker in workers:
+            worker.start()
+        self.progress()
+        with self.condition:
+            self.condition.notify_all()
+        for worker in workers:
+            worker.join(timeout=options['timeout'] + 1)
+
+        self.report(time.monotonic() - self.started)
+
+    def build_devices(self, options):
+        if options['from_db']:
+            from apps.devices.models import DeviceUser
+            fleet = defaultdict(list)
+            mappings = (DeviceUser.objects
+                        .filter(device__serial_number__startswith=options['prefix'])
+                        .order_by('device__serial_number', 'device_user_id')
+                        .values_list('device__serial_number', 'device_user_id'))
+            for sn, pin in mappings:
+                fleet[sn].append(pin)
+            return [
+                SimulatedDevice(sn, fleet[sn], random.Random(options['seed'] + n))
+                for n, sn in enumerate(sorted(fleet)[:options['devices']])
+            ]
+
+        pins = [str(options['pin_start'] + n) for n in range(options['pins_per_device'])]
+        return [
+            SimulatedDevice(f"{options['prefix']}{n + 1:05d}", pins, random.Random(options['seed'] + n))
+            for n in range(options['devices'])
+        ]
+
+    # Scheduling
+
+    def schedule(self, delay, action, device):
+        with self.condition:
+            self.sequence += 1
+            heapq.heappush(self.queue, (time.monotonic() + delay, self.sequence, action, device))
+            self.condition.notify()
+
+    def next_task(self):
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                if now >= self.deadline:
+                    return None
+                if self.queue and self.queue[0][0] <= now:
+                    return heapq.heappop(self.queue)
+                wait = (self.queue[0][0] if self.queue else self.deadline) - now
+                self.condition.wait(timeout=min(wait, self.deadline - now))
+
+    def worker(self):
+        connection = None
+        while True:
+            task = self.next_task()
+            if task is None:
+                break
+            _, _, action, device = task
+            if action == 'storm_start':
+                for each in self.devices:
+                    each.online = False
+                continue
+            if action == 'storm_end':
+                for each in self.devices:
+                    each.online = True
+                    self.schedule(0, 'handshake', each)
+                continue
+            if not device.online:
+                # Offline: punches pile up in the backlog, polls are skipped
+                if action == 'upload':
+                    device.backlog.extend(device.punches(self.burst_size(device), datetime.now()))
+                    self.schedule(self.upload_delay(device), 'upload', device)
+                elif action == 'getrequest':
+                    self.schedule(self.poll_delay(device), 'getrequest', device)
+                continue
+            connection = getattr(self, action)(connection, device)
+
+    def burst_size(self, device):
+        return device.rng.randint(1, self.options['burst'])
+
+    def upload_delay(self, device):
+        return device.rng.expovariate(1 / self.options['upload_interval'])
+
+    def poll_delay(self, device):
+        interval = self.options['poll_interval']
+        return device.rng.uniform(0.9 * interval, 1.1 * interval)
+
+    # Protocol
+
+    def request(self, connection, method, path, params, endpoint, body=None, punches=0, deferrable=False):
+        """
+        Send one request, reusing the worker's keep-alive connection
+        With deferrable, a 503 with Retry-After returns a RetryLater
+        instead of failing.
+        """
+        target = f"{self.url.path.rstrip('/')}{path}?{urlencode(params)}"
+        start = time.perf_counter()
+        try:
+            if connection is None:
+                connection_class = (http.client.HTTPSConnection if self.url.scheme == 'https'
+                                    else http.client.HTTPConnection)
+                connection = connection_class(self.url.hostname, self.url.port,
+                                              timeout=self.options['timeout'])
+            headers = {'User-Agent': 'iClock Proline'}
+            if body is not None:
+                headers['Content-Type'] = 'text/plain'
+            connection.request(method, target, body=body, headers=headers)
+            response = connection.getresponse()
+            text = response.read().decode('utf-8', 'replace')
+        except (OSError, http.client.HTTPException) as e:
+            self.stats.record(endpoint, time.perf_counter() - start, False, error=repr(e))
+            if connection is not None:
+                connection.close()
+            return None, None
+
+        elapsed = time.perf_counter() - start
+        match = SERVER_TIMING_QUERIES.search(response.getheader('Server-Timing') or '')
+        queries = int(match.group(1)) if match else None
+        retry_after = response.getheader('Retry-After')
+        if deferrable and response.status == 503 and retry_after:
+            self.stats.record(endpoint, elapsed, True, queries, deferred=True)
+            return connection, RetryLater(float(retry_after))
+        ok = response.status == 200 and not text.startswith('ERROR')
+        self.stats.record(endpoint, elapsed, ok, queries, error=f'HTTP {response.status}: {text[:80]}',
+                          punches=punches)
+        return connection, text if ok else None
+
+    def handshake(self, connection, device):
+        connection, _ = self.request(connection, 'GET', '/iclock/cdata', {
+            'SN': device.sn, 'options': 'all', 'pushver': '2.4.1', 'language': '69',
+        }, 'handshake')
+        if not device.connected:
+            # Poll and upload loops keep running across reconnects
+            device.connected = True
+            self.schedule(0, 'getrequest', device)
+            self.schedule(self.upload_delay(device), 'upload', device)
+        if device.backlog:
+            self.schedule(0, 'flush_backlog', device)
+        return connection
+
+    def getrequest(self, connection, device):
+        connection, text = self.request(connection, 'GET', '/iclock/getrequest', {'SN': device.sn}, 'getrequest')
+        for line in (text or '').splitlines():
+            match = COMMAND_LINE.match(line.strip())
+            if match:
+                device.pending_acks.append(match.groups())
+        if device.pending_acks:
+            self.schedule(0, 'devicecmd', device)
+        self.schedule(self.poll_delay(device), 'getrequest', device)
+        return connection
+
+    def devicecmd(self, connection, device):
+        acks, device.pending_acks = device.pending_acks, []
+        body = '\n'.join(f'ID={command_id}&Return=0&CMD={command.split(" ")[0]}'
+                         for command_id, command in acks)
+        connection, _ = self.request(connection, 'POST', '/iclock/devicecmd', {'SN': device.sn},
+                                     'devicecmd', body=body)
+        return connection
+
+    def upload(self, connection, device):
+        lines = device.punches(self.burst_size(device), datetime.now())
+        connection = self.send_attlog(connection, device, lines, 'upload')
+        self.schedule(self.upload_delay(device), 'upload', device)
+        return connection
+
+    def flush_backlog(self, connection, device):
+        lines, device.backlog = device.backlog, []
+        return self.send_attlog(connection, device, lines, 'backlog')
+
+    def send_attlog(self, connection, device, lines, endpoint):
+        if not lines:
+            return connection
+        connection, reply = self.request(connection, 'POST', '/iclock/cdata', {
+            'SN': device.sn, 'table': 'ATTLOG', 'Stamp': int(time.time()),
+        }, endpoint, body='\n'.join(lines) + '\n', punches=len(lines), deferrable=True)
+        if isinstance(reply, RetryLater):
+            # Not acknowledged: keep the punches and send them with the backlog
+            device.backlog[:0] = lines
+            self.schedule(reply.seconds, 'flush_backlog', device)
+        return connection
+
+    # Reporting
+
+    def progress(self):
+        while time.monotonic() < self.deadline:
+            time.sleep(min(10, max(0, self.deadline - time.monotonic())))
+            requests, errors, deferred, punches = self.stats.total()
+            elapsed = time.monotonic() - self.started
+            self.stdout.write(f'{elapsed:6.0f}s  {requests} requests  {errors} errors  '
+                              f'{deferred} deferred  {punches} punches')
+
+    def report(self, elapsed):
+        self.stdout.write('')
+        self.stdout.write(f"{'endpoint':<12}{'requests':>10}{'req/s':>9}{'errors':>8}{'deferred':>10}"
+                          f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'queries':>9}{'q p99':>7}")
+        for endpoint in sorted(self.stats.latencies):
+            latencies = self.stats.latencies[endpoint]
+            queries = self.stats.queries[endpoint]
+            errors = self.stats.errors[endpoint]
+            self.stdout.write(
+                f'{endpoint:<12}{len(latencies):>10}{len(latencies) / elapsed:>9.1f}'
+                f'{errors:>8}{self.stats.deferred[endpoint]:>10}'
+                f'{percentile(latencies, 0.50) * 1000:>9.1f}{percentile(latencies, 0.95) * 1000:>9.1f}'
+                f'{percentile(latencies, 0.99) * 1000:>9.1f}{max(latencies) * 1000:>9.1f}'
+                + (f'{sum(queries) / len(queries):>9.1f}{percentile(queries, 0.99):>7}' if queries else f"{'-':>9}{'-':>7}")
+            )
+        for endpoint, sample in self.stats.error_samples.items():
+            self.stdout.write(self.style.WARNING(f'{endpoint} error sample: {sample}'))
+
+        requests, errors, deferred, punches = self.stats.total()
+        style = self.style.SUCCESS if not errors else self.style.ERROR
+        self.stdout.write(style(
+            f'{requests} requests in {elapsed:.1f}s ({requests / elapsed:.1f}/s), '
+            f'{errors} errors ({100 * errors / max(requests, 1):.2f}%), {deferred} deferred, '
+            f'{punches} punches accepted ({punches / elapsed:.1f}/s)'
+        ))
@@ -0,0 +1,16 @@
+"""
+Preload device PIN mappings into the shared PIN cache
+"""
+from django.core.management.base import BaseCommand
+from apps.devices.resolver import resolver
+
+
+class Command(BaseCommand):
+    help = 'Load every DeviceUser PIN mapping into the PIN resolver cache'
+
+    def handle(self, *args, **options):
+        count = resolver.warm()
+        if count is None:
+            self.stdout.write('No shared cache (CACHE_BACKEND=redis): nothing to warm.')
+            return
+        self.stdout.write(self.style.SUCCESS(f'Warmed {count} PIN mappings.'))
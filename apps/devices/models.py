@@ -16,6 +16,8 @@ class Device(models.Model):
     serial_number = models.CharField(max_length=50, unique=True)
     name = models.CharField(max_length=100)
     location = models.CharField(max_length=200)
+    # Stores its attendance in the SITE_DATABASES entry of this name; empty uses the default database
+    site = models.CharField(max_length=50, blank=True, db_index=True)
     ip_address = models.GenericIPAddressField()
     port = models.IntegerField(default=4370)
     device_type = models.CharField(max_length=50, default='ZKTeco')
@@ -23,6 +25,8 @@ class Device(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='offline')
     last_online = models.DateTimeField(null=True, blank=True)
     is_active = models.BooleanField(default=True)
+    # Drop repeated taps within this many seconds; empty uses PUNCH_SUPPRESS_SECONDS
+    punch_suppress_seconds = models.PositiveIntegerField(null=True, blank=True)
     notes = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -76,6 +80,42 @@ class DeviceLog(models.Model):
         ordering = ['-timestamp']
         verbose_name = 'Device Log'
         verbose_name_plural = 'Device Logs'
+        indexes = [
+            models.Index(fields=['device', 'timestamp']),
+            models.Index(fields=['timestamp']),
+        ]
     
     def __str__(self):
         return f"{self.device.name} - {self.log_type} at {self.timestamp}"
+
+
+class DeviceCommand(models.Model):
+    """Command queued for a device, sent on its next getrequest poll"""
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('success', 'Success'),
+        ('failed', 'Failed'),
+    )
+    
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, related_name='commands')
+    command = models.TextField()  # e.g. "DATA UPDATE USERINFO PIN=1\tName=..." or "REBOOT"
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    return_code = models.IntegerField(null=True, blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True,
+                                   related_name='device_commands')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'device_commands'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['device', 'status']),
+        ]
+        verbose_name = 'Device Command'
+        verbose_name_plural = 'Device Commands'
+    
+    def __str__(self):
+        return f"{self.device.serial_number} #{self.pk}: {self.command[:40]}"
@@ -0,0 +1,94 @@
+"""
+iClock (ZKTeco push) protocol parsing
+Pure Python, no Django imports, so it can be reused outside the server.
+"""
+import logging
+from collections import namedtuple
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# One attendance punch: PIN, naive local datetime, state (check in/out...),
+# verify type (fingerprint, card...) and work code
+Punch = namedtuple('Punch', ['pin', 'timestamp', 'status', 'verify', 'workcode'])
+
+
+def parse_attlog_line(line):
+    """
+    Parse one attendance line
+    Accepts "ATTLOG\\tpin\\ttime\\tstate\\tverify..." as well as the bare
+    "pin\\ttime\\tstate\\tverify\\tworkcode..." form used by table=ATTLOG
+    uploads and x_attlog.dat files. Raises ValueError on malformed lines.
+    """
+    parts = [part.strip() for part in line.strip().split('\t')]
+    if parts and parts[0] == 'ATTLOG':
+        parts = parts[1:]
+    if len(parts) < 2 or not parts[0]:
+        raise ValueError('expected at least PIN and time')
+
+    timestamp = datetime.strptime(parts[1], TIMESTAMP_FORMAT)
+    status = int(parts[2]) if len(parts) > 2 and parts[2] else 0
+    verify = int(parts[3]) if len(parts) > 3 and parts[3] else 1
+    workcode = parts[4] if len(parts) > 4 and parts[4] != '0' else ''
+    return Punch(parts[0], timestamp, status, verify, workcode)
+
+
+def format_attlog_line(punch):
+    """Bare ATTLOG line for a punch, as parse_attlog_line reads it back"""
+    return '\t'.join([
+        punch.pin, punch.timestamp.strftime(TIMESTAMP_FORMAT), str(punch.status),
+        str(punch.verify), punch.workcode or '0',
+    ])
+
+
+def parse_attlog(body, table=None):
+    """
+    Parse an upload body into punches
+    Lines prefixed with ATTLOG are always parsed; bare lines only when the
+    device declared table=ATTLOG. Malformed lines are logged and skipped.
+    """
+    bare_lines = table == 'ATTLOG'
+    punches = []
+    for line in body.splitlines():
+        if not line.strip():
+            continue
+        if not (line.startswith('ATTLOG') or bare_lines):
+            continue
+        try:
+            punches.append(parse_attlog_line(line))
+        except ValueError as e:
+            logger.error(f"Error parsing line: {line}, Error: {str(e)}")
+    return punches
+
+
+def format_userinfo(pin, name, privilege=0, password='', card=''):
+    """Command adding or updating a user on a device"""
+    return (f'DATA UPDATE USERINFO PIN={pin}\tName={name}\tPri={privilege}'
+            f'\tPasswd={password}\tCard={card}\tGrp=1')
+
+
+def format_commands(commands):
+    """Body of a getrequest reply: one "C:<id>:<command>" line per (id, command)"""
+    return ''.join(f'C:{command_id}:{command}\n' for command_id, command in commands)
+
+
+def parse_command_results(body):
+    """
+    Parse a devicecmd body into (id, return code, command name) tuples
+    Each line looks like "ID=12&Return=0&CMD=DATA". Lines without a
+    numeric ID or Return are logged and skipped.
+    """
+    results = []
+    for line in body.splitlines():
+        if not line.strip():
+            continue
+        fields = dict(
+            part.split('=', 1) for part in line.strip().split('&') if '=' in part
+        )
+        try:
+            results.append((int(fields['ID']), int(fields['Return']), fields.get('CMD', '')))
+        except (KeyError, ValueError):
+            logger.error(f"Error parsing command result: {line}")
+    return results
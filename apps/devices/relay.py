@@ -0,0 +1,278 @@
+"""
+Edge relay: store-and-forward of device uploads from a branch office
+Pure Python, no Django imports; runs on the branch LAN with the repository
+checked out and nothing else installed:
+
+    python -m apps.devices.relay --central https://iclock.example.com \\
+        --token SECRET --journal /var/lib/iclock-relay
+
+Point the branch devices at the relay instead of the central server. It
+speaks the iClock push protocol:
+- cdata POST: attendance lines are parsed (protocol.parse_attlog),
+  appended to the journal and acknowledged as soon as they are on disk
+- cdata GET, getrequest and devicecmd are passed through to the central
+  server so device commands keep working; while it cannot be reached the
+  relay answers OK itself
+
+A forwarder thread sends the journal to the central /iclock/relay
+endpoint in gzip-compressed bundles of up to --batch uploads and
+--max-bytes compressed bytes, waiting --linger seconds after an upload so
+that bundles fill up. A bundle is sent again until the server confirms
+it; the server skips punches it has already stored, so sending twice is
+harmless. During a WAN outage the punches stay in the journal and go out
+when the link is back.
+
+A bundle the server refuses for good (a 4xx other than authentication
+and rate limiting), and the uploads of devices the server reports as
+failed, are moved to rejected.jsonl in the journal directory for
+inspection, so they cannot block the uploads behind them. A bundle
+refused as too large (413) is split instead.
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from .journal import Journal
+from .protocol import format_attlog_line, parse_attlog
+
+logger = logging.getLogger(__name__)
+
+PASSTHROUGH_PATHS = ('/iclock/cdata', '/iclock/getrequest', '/iclock/devicecmd')
+MAX_BACKOFF = 300  # seconds between attempts while the central server fails
+REJECTED_FILE = 'rejected.jsonl'
+# Client errors that a later attempt can get past: a wrong token or URL is
+# fixed on the server, a rate limit passes
+RETRY_STATUSES = {401, 403, 404, 408, 429}
+
+
+def encode_bundle(bundle_id, uploads):
+    """Request body of a bundle: gzip-compressed JSON"""
+    return gzip.compress(json.dumps({'bundle': bundle_id, 'uploads': uploads}).encode('utf-8'))
+
+
+class Central:
+    """HTTP client for the central server"""
+
+    def __init__(self, url, token, timeout):
+        self.url = url.rstrip('/')
+        self.token = token
+        self.timeout = timeout
+
+    def passthrough(self, method, path, query, body):
+        """Forward a device request; returns (status, body)"""
+        request = urllib.request.Request(
+            f'{self.url}{path}?{query}' if query else f'{self.url}{path}',
+            data=body if method == 'POST' else None, method=method,
+            headers={'Content-Type': 'text/plain'},
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return response.status, response.read()
+
+    def send_bundle(self, body):
+        """POST an encoded bundle; returns the server's summary, raises on failure"""
+        request = urllib.request.Request(
+            f'{self.url}/iclock/relay', data=body, method='POST',
+            headers={
+                'Authorization': f'Bearer {self.token}',
+                'Content-Type': 'application/json',
+                'Content-Encoding': 'gzip',
+            },
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+
+class Forwarder(threading.Thread):
+    """Sends journal entries to the central server in bundles"""
+
+    def __init__(self, journal, central, batch, linger, max_bytes):
+        super().__init__(name='relay-forwarder', daemon=True)
+        self.journal = journal
+        self.central = central
+        self.batch = batch
+        self.linger = linger
+        self.max_bytes = max_bytes
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+
+    def next_bundle(self):
+        """(bundle id, uploads, body, position) of the next bundle, or None when the journal is empty"""
+        count = self.batch
+        while True:
+            uploads, position = self.journal.read(count)
+            if not uploads:
+                return None
+            start = self.journal.cursor
+            bundle_id = f'{start[0]}-{start[1]}-{position[0]}-{position[1]}'
+            body = encode_bundle(bundle_id, uploads)
+            if len(body) <= self.max_bytes or len(uploads) == 1:
+                return bundle_id, uploads, body, position
+            # Fewer uploads, in proportion to the excess
+            count = max(1, min(len(uploads) - 1, len(uploads) * self.max_bytes // len(body)))
+
+    def reject(self, bundle_id, uploads, error):
+        """Move uploads the server will not take to REJECTED_FILE"""
+        logger.error(f"Bundle {bundle_id}: {len(uploads)} uploads rejected, see {REJECTED_FILE}: {error}")
+        with open(os.path.join(self.journal.directory, REJECTED_FILE), 'a') as f:
+            for upload in uploads:
+                f.write(json.dumps({'bundle': bundle_id, 'error': str(error), 'entry': upload}) + '\n')
+            f.flush()
+            if self.journal.fsync:
+                os.fsync(f.fileno())
+
+    def run(self):
+        backoff = 1
+        while not self.stopping.is_set():
+            bundle = self.next_bundle()
+            if bundle is None:
+                if self.wakeup.wait(60):
+                    self.wakeup.clear()
+                    self.stopping.wait(self.linger)  # let the bundle fill up
+                continue
+            bundle_id, uploads, body, position = bundle
+            try:
+                summary = self.central.send_bundle(body)
+            except urllib.error.HTTPError as e:
+                if e.code == 413 and len(uploads) > 1:
+                    self.max_bytes = max(len(body) // 2, 1)
+                    logger.warning(f"Central server refused bundle {bundle_id} as too large, "
+                                   f"sending bundles of up to {self.max_bytes} bytes")
+                    continue
+                if 400 <= e.code < 500 and e.code not in RETRY_STATUSES:
+                    self.reject(bundle_id, uploads, f'HTTP {e.code}: {e.read()[:200].decode("utf-8", "replace")}')
+                    self.journal.commit(position)
+                    continue
+                wait = backoff
+                if e.code == 503 and e.headers.get('Retry-After', '').isdigit():
+                    wait = int(e.headers['Retry-After'])
+                logger.warning(f"Central server refused bundle {bundle_id} ({e.code}), retry in {wait}s")
+                backoff = min(backoff * 2, MAX_BACKOFF)
+                self.stopping.wait(wait)
+                continue
+            except Exception as e:
+                logger.warning(f"Cannot reach the central server, retry in {backoff}s: {str(e)}")
+                self.stopping.wait(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+                continue
+            backoff = 1
+            failed = summary.get('failed') or {}
+            for sn, error in failed.items():
+                self.reject(bundle_id, [upload for upload in uploads if upload['sn'] == sn], error)
+            self.journal.commit(position)
+            logger.info(f"Forwarded bundle {bundle_id}: {len(uploads)} uploads, "
+                        f"{summary.get('stored', '?')} new punches, {len(failed)} devices failed")
+
+
+def make_handler(journal, forwarder, central):
+    class RelayHandler(BaseHTTPRequestHandler):
+        """iClock push protocol, answered locally"""
+        protocol_version = 'HTTP/1.1'
+
+        def reply(self, status, body):
+            self.send_response(status)
+            self.send_header('Content-Type', 'text/plain')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            self.handle_request('GET', b'')
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            self.handle_request('POST', body)
+
+        def handle_request(self, method, body):
+            url = urlsplit(self.path)
+            if url.path not in PASSTHROUGH_PATHS:
+                self.reply(404, b'Not Found')
+                return
+            params = parse_qs(url.query)
+            sn = params.get('SN', [''])[0]
+            if url.path == '/iclock/cdata' and method == 'POST':
+                if not sn:
+                    self.reply(400, b'ERROR: No SN provided')
+                    return
+                self.store_upload(sn, params.get('table', [None])[0], body)
+                return
+            try:
+                status, answer = central.passthrough(method, url.path, url.query, body)
+            except Exception as e:
+                logger.info(f"{url.path} from {sn} answered locally: {str(e)}")
+                status, answer = 200, b'OK'
+            self.reply(status, answer)
+
+        def store_upload(self, sn, table, body):
+            punches = parse_attlog(body.decode('utf-8', 'replace'), table=table)
+            if punches:
+                try:
+                    journal.append([{
+                        'sn': sn,
+                        'ip': self.client_address[0],
+                        'received': time.time(),
+                        'lines': [format_attlog_line(punch) for punch in punches],
+                    }])
+                except OSError as e:
+                    # Not stored: the device keeps the punches and sends them again
+                    logger.error(f"Cannot write the journal: {str(e)}")
+                    self.reply(500, b'ERROR')
+                    return
+                forwarder.wakeup.set()
+            logger.info(f"Stored {len(punches)} punches from {sn}")
+            self.reply(200, b'OK')
+
+        def log_message(self, format, *args):
+            logger.debug(f"{self.address_string()} {format % args}")
+
+    return RelayHandler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='iClock edge relay (store-and-forward)')
+    parser.add_argument('--central', default=os.environ.get('RELAY_CENTRAL_URL'),
+                        help='Central server URL (RELAY_CENTRAL_URL)')
+    parser.add_argument('--token', default=os.environ.get('RELAY_TOKEN'),
+                        help='Token from the server\'s ICLOCK_RELAY_TOKENS (RELAY_TOKEN)')
+    parser.add_argument('--journal', default=os.environ.get('RELAY_JOURNAL', 'relay-journal'),
+                        help='Journal directory (RELAY_JOURNAL)')
+    parser.add_argument('--listen', default=os.environ.get('RELAY_LISTEN', '0.0.0.0:8081'),
+                        help='Address for the devices, host:port (RELAY_LISTEN)')
+    parser.add_argument('--batch', type=int, default=500, help='Uploads per bundle')
+    parser.add_argument('--max-bytes', type=int, default=4 * 1024 * 1024,
+                        help='Compressed bytes per bundle, below the server\'s ICLOCK_RELAY_MAX_UPLOAD')
+    parser.add_argument('--linger', type=float, default=5, help='Seconds to wait for a bundle to fill up')
+    parser.add_argument('--timeout', type=float, default=60, help='Central server timeout in seconds')
+    parser.add_argument('--no-fsync', action='store_true', help='Do not fsync the journal (testing only)')
+    options = parser.parse_args(argv)
+    if not options.central or not options.token:
+        parser.error('--central and --token are required')
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s %(asctime)s %(name)s %(message)s')
+    journal = Journal(options.journal, fsync=not options.no_fsync)
+    central = Central(options.central, options.token, options.timeout)
+    forwarder = Forwarder(journal, central, options.batch, options.linger, options.max_bytes)
+    forwarder.start()
+
+    host, _, port = options.listen.rpartition(':')
+    server = ThreadingHTTPServer((host or '0.0.0.0', int(port)), make_handler(journal, forwarder, central))
+    logger.info(f"Relay listening on {options.listen}, forwarding to {options.central} "
+                f"({journal.pending_bytes()} journal bytes pending)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        forwarder.stopping.set()
+        server.server_close()
+        journal.close()
+
+
+if __name__ == '__main__':
+    main()
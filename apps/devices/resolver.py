@@ -0,0 +1,201 @@
+"""
+PIN to user resolution for device ingest
+
+Maps (device, PIN) to a user id through three layers:
+1. a bounded in-process LRU (per worker)
+2. shared redis hashes, one per device (when the redis cache is configured)
+3. one batched database lookup for the remaining misses
+
+Database resolution order: DeviceUser.device_user_id on that device,
+then User.employee_id, then the legacy auto-created "emp_<pin>" user.
+Unknown PINs still get an "emp_<pin>" user, as before.
+
+With redis, an invalidation bumps a generation counter that makes every
+worker clear its LRU, so entries can live for PIN_CACHE_TTL. Without a
+shared cache, other workers never hear of an invalidation: their entries
+expire after PIN_CACHE_LOCAL_TTL seconds instead, which bounds how long
+a changed PIN keeps resolving to its old user.
+"""
+import logging
+import threading
+from django.conf import settings
+from django.db.models import Q
+from apps.accounts.models import User
+from apps.core.cache import LocalCache
+from .models import DeviceUser
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'iclock:pins'
+GENERATION_KEY = f'{KEY_PREFIX}:gen'
+DEVICES_KEY = f'{KEY_PREFIX}:devices'
+
+
+class PinResolver:
+    """Resolve device PINs to user ids with layered caching"""
+
+    def __init__(self, maxsize, ttl, shared_ttl):
+        self.local = LocalCache(maxsize=maxsize, ttl=ttl)
+        self.shared_ttl = shared_ttl
+        self._generation = None
+        self._lock = threading.Lock()
+
+    def _redis(self):
+        if settings.CACHE_BACKEND != 'redis':
+            return None
+        from django_redis import get_redis_connection
+        return get_redis_connection('default')
+
+    def _check_generation(self, conn):
+        """Drop local entries when another worker invalidated mappings"""
+        if conn is None:
+            return
+        generation = conn.get(GENERATION_KEY)
+        with self._lock:
+            if generation != self._generation:
+                self.local.clear()
+                self._generation = generation
+
+    def resolve_many(self, device, pins):
+        """Return {pin: user_id} for every PIN, creating unknown users"""
+        pins = set(pins)
+        if not pins:
+            return {}
+
+        conn = self._safe(self._redis)
+        self._safe(self._check_generation, conn)
+
+        resolved = {
+            key[1]: user_id
+            for key, user_id in self.local.get_many((device.id, pin) for pin in pins).items()
+        }
+        misses = pins - resolved.keys()
+
+        if misses and conn is not None:
+            shared = self._safe(self._shared_get, conn, device.id, misses) or {}
+            self.local.set_many({(device.id, pin): user_id for pin, user_id in shared.items()})
+            resolved.update(shared)
+            misses -= shared.keys()
+
+        if misses:
+            found = self._lookup(device, misses)
+            self._store(conn, device.id, found)
+            resolved.update(found)
+
+        return resolved
+
+    def _lookup(self, device, pins):
+        """Resolve PINs from the database in one pass"""
+        found = dict(
+            DeviceUser.objects.filter(device_id=device.id, device_user_id__in=pins)
+            .values_list('device_user_id', 'user_id')
+        )
+        remaining = pins - found.keys()
+
+        if remaining:
+            legacy = {f'emp_{pin}': pin for pin in remaining}
+            by_employee_id = {}
+            by_username = {}
+            users = User.objects.filter(
+                Q(employee_id__in=remaining) | Q(username__in=legacy)
+            ).values_list('id', 'employee_id', 'username')
+            for user_id, employee_id, username in users:
+                if employee_id in remaining:
+                    by_employee_id[employee_id] = user_id
+                if username in legacy:
+                    by_username[legacy[username]] = user_id
+            for pin in remaining:
+                user_id = by_employee_id.get(pin) or by_username.get(pin)
+                if user_id:
+                    found[pin] = user_id
+
+        # Unknown PINs: auto-create the legacy placeholder user
+        for pin in pins - found.keys():
+            user, _ = User.objects.get_or_create(
+                username=f'emp_{pin}',
+                defaults={'email': f'emp_{pin}@local'}
+            )
+            found[pin] = user.id
+
+        return found
+
+    def _shared_get(self, conn, device_id, pins):
+        pins = sorted(pins)
+        values = conn.hmget(f'{KEY_PREFIX}:{device_id}', pins)
+        return {pin: int(value) for pin, value in zip(pins, values) if value is not None}
+
+    def _store(self, conn, device_id, mapping):
+        self.local.set_many({(device_id, pin): user_id for pin, user_id in mapping.items()})
+        if conn is not None and mapping:
+            self._safe(self._shared_set, conn, device_id, mapping)
+
+    def _shared_set(self, conn, device_id, mapping):
+        key = f'{KEY_PREFIX}:{device_id}'
+        pipe = conn.pipeline(transaction=False)
+        pipe.hset(key, mapping=mapping)
+        pipe.expire(key, self.shared_ttl)
+        pipe.sadd(DEVICES_KEY, device_id)
+        pipe.execute()
+
+    def _safe(self, func, *args):
+        """Treat redis as optional: log and fall back to the database"""
+        try:
+            return func(*args)
+        except Exception as e:
+            logger.warning(f"PIN cache unavailable: {str(e)}")
+            return None
+
+    def invalidate_device(self, device_id, pins):
+        """Forget mappings for some PINs on one device"""
+        for pin in pins:
+            self.local.delete((device_id, pin))
+        conn = self._safe(self._redis)
+        if conn is not None:
+            self._safe(self._shared_invalidate, conn, [device_id], pins)
+
+    def invalidate_pins(self, pins):
+        """Forget mappings for some PINs on every device"""
+        self.local.clear()
+        conn = self._safe(self._redis)
+        if conn is not None:
+            self._safe(self._shared_invalidate, conn, None, pins)
+
+    def _shared_invalidate(self, conn, device_ids, pins):
+        pins = [pin for pin in pins if pin]
+        if device_ids is None:
+            device_ids = [int(d) for d in conn.smembers(DEVICES_KEY)]
+        pipe = conn.pipeline(transaction=False)
+        if pins:
+            for device_id in device_ids:
+                pipe.hdel(f'{KEY_PREFIX}:{device_id}', *pins)
+        # Other workers clear their local LRU on their next batch
+        pipe.incr(GENERATION_KEY)
+        pipe.execute()
+
+    def warm(self):
+        """
+        Preload every DeviceUser mapping into redis and the LRU, e.g. at worker boot
+        Skipped without redis (returns None): the local entries would expire
+        after PIN_CACHE_LOCAL_TTL, before most devices upload again.
+        """
+        conn = self._safe(self._redis)
+        if conn is None:
+            logger.info("PIN cache warm-up skipped: no shared cache")
+            return None
+        self._safe(self._check_generation, conn)
+        by_device = {}
+        mappings = DeviceUser.objects.values_list('device_id', 'device_user_id', 'user_id')
+        for device_id, pin, user_id in mappings.iterator(chunk_size=5000):
+            by_device.setdefault(device_id, {})[pin] = user_id
+        for device_id, mapping in by_device.items():
+            self._store(conn, device_id, mapping)
+        count = sum(len(m) for m in by_device.values())
+        logger.info(f"PIN cache warmed with {count} device user mappings")
+        return count
+
+
+resolver = PinResolver(
+    maxsize=settings.PIN_CACHE_SIZE,
+    ttl=settings.PIN_CACHE_TTL if settings.CACHE_BACKEND == 'redis' else settings.PIN_CACHE_LOCAL_TTL,
+    shared_ttl=settings.PIN_CACHE_SHARED_TTL,
+)
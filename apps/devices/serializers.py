@@ -1,8 +1,9 @@
 """
 API Serializers for Device Management
 """
+from django.conf import settings
 from rest_framework import serializers
-from .models import Device, DeviceUser, DeviceLog
+from .models import Device, DeviceCommand, DeviceUser, DeviceLog
 
 
 class DeviceSerializer(serializers.ModelSerializer):
@@ -13,6 +14,12 @@ class DeviceSerializer(serializers.ModelSerializer):
         model = Device
         fields = '__all__'
         read_only_fields = ['created_at', 'updated_at', 'last_online']
+    
+    def validate_site(self, value):
+        """A site must have a database in SITE_DATABASES"""
+        if value and value not in settings.SITE_DATABASES:
+            raise serializers.ValidationError(f'No database is configured for site "{value}".')
+        return value
 
 
 class DeviceUserSerializer(serializers.ModelSerializer):
@@ -34,3 +41,14 @@ class DeviceLogSerializer(serializers.ModelSerializer):
         model = DeviceLog
         fields = '__all__'
         read_only_fields = ['timestamp']
+
+
+class DeviceCommandSerializer(serializers.ModelSerializer):
+    """Serializer for DeviceCommand model"""
+    
+    class Meta:
+        model = DeviceCommand
+        fields = ['id', 'device', 'command', 'status', 'return_code', 'created_by',
+                  'created_at', 'sent_at', 'completed_at']
+        read_only_fields = ['device', 'status', 'return_code', 'created_by',
+                            'created_at', 'sent_at', 'completed_at']
@@ -0,0 +1,57 @@
+"""
+Signal handlers keeping the PIN resolver cache consistent
+"""
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+from apps.accounts.models import User
+from .models import DeviceUser
+from .resolver import resolver
+
+
+@receiver(post_init, sender=DeviceUser)
+def remember_device_user_pin(sender, instance, **kwargs):
+    instance._resolver_key = (
+        instance.__dict__.get('device_id'),
+        instance.__dict__.get('device_user_id'),
+    )
+
+
+@receiver(post_save, sender=DeviceUser)
+def invalidate_device_user(sender, instance, created, **kwargs):
+    """A PIN was (re)assigned on a device"""
+    old_device_id, old_pin = instance._resolver_key
+    if old_device_id and old_device_id != instance.device_id:
+        resolver.invalidate_device(old_device_id, [old_pin])
+    resolver.invalidate_device(instance.device_id, {old_pin, instance.device_user_id} - {None})
+    instance._resolver_key = (instance.device_id, instance.device_user_id)
+
+
+@receiver(post_delete, sender=DeviceUser)
+def forget_device_user(sender, instance, **kwargs):
+    resolver.invalidate_device(instance.device_id, [instance.device_user_id])
+
+
+@receiver(post_init, sender=User)
+def remember_employee_id(sender, instance, **kwargs):
+    instance._resolver_employee_id = instance.__dict__.get('employee_id')
+
+
+@receiver(post_save, sender=User)
+def invalidate_employee_id(sender, instance, created, **kwargs):
+    """
+    employee_id doubles as a PIN on every device
+    A new user's employee_id may be a PIN already mapped to its "emp_<pin>"
+    placeholder, so creation invalidates too.
+    """
+    old = None if created else instance._resolver_employee_id
+    if old != instance.employee_id:
+        resolver.invalidate_pins({old, instance.employee_id} - {None, ''})
+    instance._resolver_employee_id = instance.employee_id
+
+
+@receiver(post_delete, sender=User)
+def forget_user(sender, instance, **kwargs):
+    pins = {instance.employee_id}
+    if instance.username.startswith('emp_'):
+        pins.add(instance.username[len('emp_'):])
+    resolver.invalidate_pins(pins - {None})
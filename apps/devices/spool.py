@@ -0,0 +1,200 @@
+"""
+Local spool for uploads the database cannot take
+
+While PostgreSQL restarts or fails over, an upload would get HTTP 500 and
+the device would retry in a tight loop, just as the database comes back.
+Instead, a parsed upload whose storage fails with a connection error is
+appended to a journal on local disk (journal.py: checksummed entries,
+fsync before the device gets OK) and replayed later.
+
+Each process spools to its own directory under ICLOCK_SPOOL_DIR and holds
+a lock on it. A replayer thread drains the process's spool in order,
+grouping consecutive uploads of a device into one batch, once the
+database answers again. It also adopts the spools of processes that
+exited. drain_spool does the same from the command line.
+
+An entry that fails for another reason than the connection is moved to
+rejected.jsonl in its spool directory for inspection, so it cannot block
+the entries behind it.
+"""
+import json
+import logging
+import os
+import shutil
+import socket
+import threading
+import time
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, close_old_connections, connection
+from apps.core import metrics
+from .journal import Journal
+
+try:
+    import fcntl
+except ImportError:  # Windows: spools of other processes are left to drain_spool
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Errors meaning "the database cannot be reached", as opposed to bad data
+DATABASE_UNAVAILABLE = (OperationalError, InterfaceError)
+LOCK_FILE = 'lock'
+REJECTED_FILE = 'rejected.jsonl'
+
+
+def _lock(directory):
+    """Exclusive lock on a spool directory; None when another process holds it"""
+    handle = open(os.path.join(directory, LOCK_FILE), 'a')
+    if fcntl is not None:
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return None
+    return handle
+
+
+class SpoolDirectory:
+    """A locked spool directory and its journal"""
+
+    def __init__(self, directory, lock):
+        self.directory = directory
+        self.lock = lock
+        self.journal = Journal(directory)
+
+    def finished(self):
+        """Nothing left to replay or inspect"""
+        return not self.journal.pending_bytes() and not os.path.exists(os.path.join(self.directory, REJECTED_FILE))
+
+    def reject(self, entry, error):
+        with open(os.path.join(self.directory, REJECTED_FILE), 'a') as f:
+            f.write(json.dumps({'error': str(error), 'entry': entry}) + '\n')
+
+    def close(self, remove=False):
+        self.journal.close()
+        self.lock.close()
+        if remove:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def drain(spool, store, batch):
+    """
+    Store the entries of spool in order; returns the number of entries drained
+    store(sn, ip, lines) stores one device's punches. Stops at the first
+    connection error, leaving the remaining entries spooled.
+    """
+    drained = 0
+    while True:
+        entries, position = spool.journal.read(batch)
+        if not entries:
+            return drained
+        # Consecutive uploads of the same device go in one batch
+        groups = []
+        for entry in entries:
+            if groups and groups[-1][0]['sn'] == entry['sn']:
+                groups[-1].append(entry)
+            else:
+                groups.append([entry])
+        for group in groups:
+            try:
+                store(group[0]['sn'], group[0].get('ip'), [line for entry in group for line in entry['lines']])
+            except DATABASE_UNAVAILABLE:
+                raise
+            except Exception as e:
+                logger.error(f"Spooled upload from {group[0]['sn']} rejected, see {REJECTED_FILE}: {str(e)}")
+                for entry in group:
+                    spool.reject(entry, e)
+        spool.journal.commit(position)
+        drained += len(entries)
+
+
+class UploadSpool:
+    """Per-process spool and its replayer thread"""
+
+    def __init__(self):
+        self._own = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._wakeup = threading.Event()
+
+    @property
+    def root(self):
+        return settings.ICLOCK_SPOOL_DIR
+
+    def _own_spool(self):
+        with self._lock:
+            if self._own is None:
+                directory = os.path.join(self.root, f'{socket.gethostname()}-{os.getpid()}')
+                os.makedirs(directory, exist_ok=True)
+                self._own = SpoolDirectory(directory, _lock(directory))
+            return self._own
+
+    def append(self, sn, ip, lines):
+        """Spool one upload durably; raises OSError when the disk cannot take it"""
+        self._own_spool().journal.append([{'sn': sn, 'ip': ip, 'received': time.time(), 'lines': lines}])
+        metrics.UPLOADS_SPOOLED.inc(sn=sn)
+        self.start()
+        self._wakeup.set()
+
+    def start(self):
+        """Start the replayer thread of this process (once)"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._replay, name='iclock-spool', daemon=True)
+                self._thread.start()
+
+    def orphans(self, force=False):
+        """
+        Spools left behind by processes that exited, locked for the caller
+        Without file locks (Windows) they cannot be told from live ones and
+        are only returned with force, when no worker is running.
+        """
+        if fcntl is None and not force:
+            return
+        own = self._own.directory if self._own is not None else None
+        try:
+            names = sorted(os.listdir(self.root))
+        except FileNotFoundError:
+            return
+        for name in names:
+            directory = os.path.join(self.root, name)
+            if directory == own or not os.path.isdir(directory):
+                continue
+            lock = _lock(directory)
+            if lock is not None:
+                yield SpoolDirectory(directory, lock)
+
+    def _replay(self):
+        from .iclock_views import store_device_lines
+        while True:
+            self._wakeup.wait(settings.ICLOCK_SPOOL_REPLAY_INTERVAL)
+            self._wakeup.clear()
+            close_old_connections()
+            try:
+                if self._own is not None:
+                    replay(self._own, store_device_lines)
+                for orphan in self.orphans():
+                    try:
+                        replay(orphan, store_device_lines)
+                    finally:
+                        orphan.close(remove=orphan.finished())
+                metrics.SPOOL_PENDING_BYTES.set(self._own.journal.pending_bytes() if self._own else 0)
+            except DATABASE_UNAVAILABLE as e:
+                logger.info(f"Database still unavailable, spool replay postponed: {str(e)}")
+            except Exception as e:
+                logger.error(f"Spool replay failed: {str(e)}")
+            finally:
+                close_old_connections()
+
+
+def replay(spool, store):
+    """Drain spool once the database answers; raises DATABASE_UNAVAILABLE otherwise"""
+    if not spool.journal.pending_bytes():
+        return 0
+    connection.ensure_connection()
+    drained = drain(spool, store, settings.ICLOCK_SPOOL_BATCH)
+    logger.info(f"Replayed {drained} spooled uploads from {spool.directory}")
+    return drained
+
+
+spool = UploadSpool()
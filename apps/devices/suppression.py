@@ -0,0 +1,64 @@
+"""
+Near-duplicate punch suppression
+Employees often tap two or three times within seconds. Each tap would
+become an AttendanceRecord and a DailyAttendance update. A punch is
+dropped at ingest when the same user punched with the same state less
+than the suppression window earlier:
+- Device.punch_suppress_seconds, or PUNCH_SUPPRESS_SECONDS when unset
+- per device, or per site (devices sharing a location) with
+  PUNCH_SUPPRESS_SCOPE = 'site'
+
+Earlier punches are looked up in the rest of the upload and in a small
+per-process index of recently accepted punches, never in the database.
+A tap spread over two uploads handled by different workers can therefore
+get through; that only costs the row suppression would have saved.
+Resent punches (same timestamp) are left to the duplicate check.
+"""
+from django.conf import settings
+from apps.core.cache import LocalCache
+
+INDEX_TTL = 3600  # seconds; longer than any sensible window
+
+
+def window_seconds(device):
+    if device.punch_suppress_seconds is not None:
+        return device.punch_suppress_seconds
+    return settings.PUNCH_SUPPRESS_SECONDS
+
+
+class PunchSuppressor:
+    """Drops punches repeating the same user's last punch within the window"""
+
+    def __init__(self, maxsize):
+        self.recent = LocalCache(maxsize=maxsize, ttl=INDEX_TTL)
+
+    def scope(self, device):
+        if settings.PUNCH_SUPPRESS_SCOPE == 'site' and device.location:
+            return ('site', device.location)
+        return ('device', device.id)
+
+    def split(self, device, records):
+        """Return (kept, suppressed) records, oldest first; kept records update the index"""
+        window = window_seconds(device)
+        if window <= 0:
+            return records, []
+
+        scope = self.scope(device)
+        records = sorted(records, key=lambda record: record.timestamp)
+        keys = {(scope, record.user_id, record.verify_code) for record in records}
+        latest = self.recent.get_many(keys)
+        kept, suppressed = [], []
+        for record in records:
+            key = (scope, record.user_id, record.verify_code)
+            previous = latest.get(key)
+            if previous is not None and 0 < (record.timestamp - previous).total_seconds() < window:
+                suppressed.append(record)
+                continue
+            kept.append(record)
+            if previous is None or record.timestamp > previous:
+                latest[key] = record.timestamp
+        self.recent.set_many({key: latest[key] for key in keys if key in latest})
+        return kept, suppressed
+
+
+suppressor = PunchSuppressor(maxsize=settings.PUNCH_SUPPRESS_INDEX_SIZE)
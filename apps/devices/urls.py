@@ -6,9 +6,10 @@ from rest_framework.routers import DefaultRouter
 from .views import DeviceViewSet, DeviceUserViewSet, DeviceLogViewSet
 
 router = DefaultRouter()
-router.register(r'', DeviceViewSet, basename='device')
+# Register fixed prefixes first, the empty prefix would match them as a device id
 router.register(r'users', DeviceUserViewSet, basename='device-user')
 router.register(r'logs', DeviceLogViewSet, basename='device-log')
+router.register(r'', DeviceViewSet, basename='device')
 
 urlpatterns = [
     path('', include(router.urls)),
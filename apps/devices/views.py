@@ -7,8 +7,11 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django.utils import timezone
+from .command_queue import queue_command
 from .models import Device, DeviceUser, DeviceLog
-from .serializers import DeviceSerializer, DeviceUserSerializer, DeviceLogSerializer
+from .serializers import (
+    DeviceCommandSerializer, DeviceSerializer, DeviceUserSerializer, DeviceLogSerializer
+)
 
 
 class DeviceViewSet(viewsets.ModelViewSet):
@@ -48,11 +51,33 @@ class DeviceViewSet(viewsets.ModelViewSet):
         logs = device.logs.all()[:50]
         serializer = DeviceLogSerializer(logs, many=True)
         return Response(serializer.data)
+    
+    @action(detail=True, methods=['get', 'post'])
+    def commands(self, request, pk=None):
+        """
+        GET: latest commands of the device
+        POST: queue a command, sent on the device's next getrequest
+        Body params: command (e.g. "REBOOT" or "DATA UPDATE USERINFO PIN=1\tName=...")
+        """
+        device = self.get_object()
+        if request.method == 'GET':
+            commands = device.commands.all()[:50]
+            return Response(DeviceCommandSerializer(commands, many=True).data)
+        
+        if not request.user.is_admin:
+            return Response(
+                {'error': 'Only admins can send commands to devices.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        serializer = DeviceCommandSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        command = queue_command(device, serializer.validated_data['command'], created_by=request.user)
+        return Response(DeviceCommandSerializer(command).data, status=status.HTTP_201_CREATED)
 
 
 class DeviceUserViewSet(viewsets.ModelViewSet):
     """API endpoint for device user management"""
-    queryset = DeviceUser.objects.all()
+    queryset = DeviceUser.objects.select_related('user', 'device')
     serializer_class = DeviceUserSerializer
     permission_classes = [IsAuthenticated]
     filterset_fields = ['device', 'user', 'is_synced']
@@ -178,7 +203,7 @@ class DeviceUserViewSet(viewsets.ModelViewSet):
 
 class DeviceLogViewSet(viewsets.ReadOnlyModelViewSet):
     """API endpoint for device logs (read-only)"""
-    queryset = DeviceLog.objects.all()
+    queryset = DeviceLog.objects.select_related('device')
     serializer_class = DeviceLogSerializer
     permission_classes = [IsAuthenticated]
     filterset_fields = ['device', 'log_type']
@@ -0,0 +1,21 @@
+"""
+Gunicorn configuration for the async device protocol pool (uvicorn workers)
+Usage: gunicorn -c deploy/gunicorn-devices-asgi.conf.py iclock_server.asgi:device_application
+"""
+import logging
+
+bind = 'unix:/run/iclock/iclock-devices.sock'
+worker_class = 'uvicorn.workers.UvicornWorker'
+workers = 2  # each holds thousands of device connections
+timeout = 60  # must exceed ICLOCK_LONGPOLL_SECONDS
+accesslog = '/var/log/iclock/devices-access.log'
+errorlog = '/var/log/iclock/devices-error.log'
+
+
+def post_worker_init(worker):
+    """Every upload resolves PINs: load them before the first poll"""
+    try:
+        from apps.devices.resolver import resolver
+        resolver.warm()
+    except Exception as e:
+        logging.getLogger(__name__).warning(f"PIN cache warm-up failed: {str(e)}")
@@ -0,0 +1,20 @@
+"""
+Gunicorn configuration for the device protocol pool (/iclock/cdata, getrequest, devicecmd)
+Usage: gunicorn -c deploy/gunicorn-devices.conf.py iclock_server.wsgi:device_application
+"""
+import logging
+
+bind = 'unix:/run/iclock/iclock-devices.sock'
+workers = 4
+timeout = 30
+accesslog = '/var/log/iclock/devices-access.log'
+errorlog = '/var/log/iclock/devices-error.log'
+
+
+def post_worker_init(worker):
+    """Every upload resolves PINs: load them before the first poll"""
+    try:
+        from apps.devices.resolver import resolver
+        resolver.warm()
+    except Exception as e:
+        logging.getLogger(__name__).warning(f"PIN cache warm-up failed: {str(e)}")
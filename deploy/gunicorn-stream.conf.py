@@ -0,0 +1,12 @@
+"""
+Gunicorn configuration for the live attendance feed (uvicorn workers)
+Usage: gunicorn -c deploy/gunicorn-stream.conf.py iclock_server.asgi:application
+nginx sends only /api/attendance/stream/ here; every open dashboard holds
+one coroutine, not a worker.
+"""
+bind = 'unix:/run/iclock/iclock-stream.sock'
+worker_class = 'uvicorn.workers.UvicornWorker'
+workers = 2
+timeout = 60
+accesslog = '/var/log/iclock/stream-access.log'
+errorlog = '/var/log/iclock/stream-error.log'
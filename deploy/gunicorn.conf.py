@@ -0,0 +1,20 @@
+"""
+Gunicorn configuration for iClock Server
+Usage: gunicorn -c deploy/gunicorn.conf.py iclock_server.wsgi:application
+"""
+import logging
+
+bind = 'unix:/run/iclock/iclock.sock'
+workers = 4
+timeout = 60
+accesslog = '/var/log/iclock/access.log'
+errorlog = '/var/log/iclock/error.log'
+
+
+def post_worker_init(worker):
+    """Warm per-worker caches before the first request"""
+    try:
+        from apps.devices.resolver import resolver
+        resolver.warm()
+    except Exception as e:
+        logging.getLogger(__name__).warning(f"PIN cache warm-up failed: {str(e)}")
@@ -0,0 +1,31 @@
+"""
+ASGI config for iClock Server
+
+For large device fleets: the iClock protocol paths are served by async
+views (apps/devices/iclock_async.py), so a slow upload or a long-polling
+getrequest holds a coroutine instead of a worker. Database work runs in
+a bounded thread pool. The live attendance feed is served the same way
+(apps/attendance/stream_async.py): an open dashboard holds a coroutine.
+Other paths go to the regular Django stack.
+Run with uvicorn workers (deploy/gunicorn-devices-asgi.conf.py for the
+devices, deploy/gunicorn-stream.conf.py for the feed).
+"""
+import os
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'iclock_server.settings')
+django_application = get_asgi_application()
+
+from iclock_server.handlers import DeviceASGIHandler  # noqa: E402
+from iclock_server.iclock_urls import DEVICE_PATHS  # noqa: E402
+from apps.attendance.stream_async import STREAM_PATH, stream_application  # noqa: E402
+
+device_application = DeviceASGIHandler()
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'] in DEVICE_PATHS:
+        return await device_application(scope, receive, send)
+    if scope['type'] == 'http' and scope['path'] == STREAM_PATH:
+        return await stream_application(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -0,0 +1,41 @@
+"""
+Django handlers for the iClock device protocol (see wsgi.py and asgi.py)
+They run their own middleware list and URLconf instead of MIDDLEWARE and
+ROOT_URLCONF, so device polls skip sessions, CSRF, auth, messages and CORS.
+"""
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+
+
+class DeviceHandlerMixin:
+    middleware_setting = 'ICLOCK_MIDDLEWARE'
+    urlconf_setting = 'ICLOCK_URLCONF'
+
+    def load_middleware(self, is_async=False):
+        # BaseHandler builds the chain from settings.MIDDLEWARE; swap it while
+        # loading (once per process, before any request is served)
+        full_middleware = settings.MIDDLEWARE
+        settings.MIDDLEWARE = getattr(settings, self.middleware_setting)
+        try:
+            super().load_middleware(is_async)
+        finally:
+            settings.MIDDLEWARE = full_middleware
+
+
+class DeviceWSGIHandler(DeviceHandlerMixin, WSGIHandler):
+    """Sync device handler with ICLOCK_MIDDLEWARE and ICLOCK_URLCONF"""
+
+    def get_response(self, request):
+        request.urlconf = getattr(settings, self.urlconf_setting)
+        return super().get_response(request)
+
+
+class DeviceASGIHandler(DeviceHandlerMixin, ASGIHandler):
+    """Async device handler: async views, ICLOCK_ASGI_MIDDLEWARE and ICLOCK_ASGI_URLCONF"""
+    middleware_setting = 'ICLOCK_ASGI_MIDDLEWARE'
+    urlconf_setting = 'ICLOCK_ASGI_URLCONF'
+
+    async def get_response_async(self, request):
+        request.urlconf = getattr(settings, self.urlconf_setting)
+        return await super().get_response_async(request)
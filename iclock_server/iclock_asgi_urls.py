@@ -0,0 +1,13 @@
+"""
+URL configuration of the async device handler (see iclock_server/asgi.py)
+Same paths and names as iclock_server.iclock_urls, served by async views.
+"""
+from django.urls import path
+from apps.devices.iclock_async import iclock_cdata, iclock_getrequest, iclock_devicecmd, iclock_relay
+
+urlpatterns = [
+    path('iclock/cdata', iclock_cdata, name='iclock-cdata'),
+    path('iclock/getrequest', iclock_getrequest, name='iclock-getrequest'),
+    path('iclock/devicecmd', iclock_devicecmd, name='iclock-devicecmd'),
+    path('iclock/relay', iclock_relay, name='iclock-relay'),
+]
@@ -0,0 +1,16 @@
+"""
+URL configuration of the device handler (see iclock_server/wsgi.py)
+Only the iClock push protocol; the same views are in iclock_server.urls too.
+"""
+from django.urls import path
+from apps.devices.iclock_views import iclock_cdata, iclock_getrequest, iclock_devicecmd, iclock_relay
+
+urlpatterns = [
+    path('iclock/cdata', iclock_cdata, name='iclock-cdata'),
+    path('iclock/getrequest', iclock_getrequest, name='iclock-getrequest'),
+    path('iclock/devicecmd', iclock_devicecmd, name='iclock-devicecmd'),
+    path('iclock/relay', iclock_relay, name='iclock-relay'),
+]
+
+# Exact paths served by the device handler
+DEVICE_PATHS = frozenset(f'/{pattern.pattern}' for pattern in urlpatterns)
@@ -32,9 +32,12 @@ INSTALLED_APPS = [
     'apps.accounts',
     'apps.devices',
     'apps.attendance',
+    'apps.core',
 ]
 
 MIDDLEWARE = [
+    'apps.core.middleware.MetricsMiddleware',
+    'apps.devices.capture.CaptureMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -43,10 +46,47 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'apps.core.db_router.ReplicaReadMiddleware',
+    'apps.core.middleware.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'iclock_server.urls'
 
+# iClock protocol requests skip the middleware above (see iclock_server/wsgi.py)
+ICLOCK_DISPATCH = config('ICLOCK_DISPATCH', default=True, cast=bool)
+ICLOCK_URLCONF = 'iclock_server.iclock_urls'
+ICLOCK_MIDDLEWARE = [
+    'apps.core.middleware.MetricsMiddleware',
+    'apps.devices.capture.CaptureMiddleware',
+    'apps.core.middleware.ProfilingMiddleware',  # PROFILING_SECRET / sample rates only, no login
+]
+# Async device handler (iclock_server/asgi.py); middleware must be async-capable
+ICLOCK_ASGI_URLCONF = 'iclock_server.iclock_asgi_urls'
+ICLOCK_ASGI_MIDDLEWARE = [
+    'apps.core.middleware.MetricsMiddleware',
+    'apps.devices.capture.CaptureMiddleware',
+]
+ICLOCK_ASYNC_DB_WORKERS = config('ICLOCK_ASYNC_DB_WORKERS', default=20, cast=int)  # DB connections per process
+ICLOCK_LONGPOLL_SECONDS = config('ICLOCK_LONGPOLL_SECONDS', default=0, cast=int)  # hold idle getrequests (ASGI only)
+# Upload admission control (apps/devices/admission.py); cluster-wide with redis, per process otherwise
+ICLOCK_ADMISSION_ENABLED = config('ICLOCK_ADMISSION_ENABLED', default=True, cast=bool)
+ICLOCK_UPLOAD_RATE = config('ICLOCK_UPLOAD_RATE', default=0.5, cast=float)  # uploads per second per device
+ICLOCK_UPLOAD_BURST = config('ICLOCK_UPLOAD_BURST', default=20, cast=int)
+ICLOCK_MAX_CONCURRENT_UPLOADS = config('ICLOCK_MAX_CONCURRENT_UPLOADS', default=8, cast=int)
+ICLOCK_UPLOAD_LEASE_SECONDS = config('ICLOCK_UPLOAD_LEASE_SECONDS', default=120, cast=int)
+ICLOCK_RETRY_AFTER = config('ICLOCK_RETRY_AFTER', default=30, cast=int)  # seconds, doubled at most by jitter
+# Edge relays (apps/devices/relay.py): ICLOCK_RELAY_TOKENS=branch=token,... ; empty disables /iclock/relay
+ICLOCK_RELAY_TOKENS = dict(
+    entry.split('=', 1) for entry in config('ICLOCK_RELAY_TOKENS', default='', cast=Csv()) if '=' in entry
+)
+ICLOCK_RELAY_MAX_BYTES = config('ICLOCK_RELAY_MAX_BYTES', default=64 * 1024 * 1024, cast=int)  # uncompressed bundle
+ICLOCK_RELAY_MAX_UPLOAD = config('ICLOCK_RELAY_MAX_UPLOAD', default=16 * 1024 * 1024, cast=int)  # compressed bundle
+# Uploads that fail with a database connection error are spooled to local disk and acknowledged
+ICLOCK_SPOOL_ENABLED = config('ICLOCK_SPOOL_ENABLED', default=True, cast=bool)
+ICLOCK_SPOOL_DIR = config('ICLOCK_SPOOL_DIR', default=str(BASE_DIR / 'spool'))
+ICLOCK_SPOOL_REPLAY_INTERVAL = config('ICLOCK_SPOOL_REPLAY_INTERVAL', default=5, cast=int)  # seconds
+ICLOCK_SPOOL_BATCH = config('ICLOCK_SPOOL_BATCH', default=200, cast=int)  # uploads per replay batch
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -102,6 +142,47 @@ else:  # SQLite fallback for development
         }
     }
 
+# Read replicas: DB_REPLICA_HOSTS=host[:port],... with the primary's name and
+# credentials. Only REPLICA_READ_VIEWS and replica_reads() blocks use them
+# (apps/core/db_router.py).
+DATABASE_REPLICAS = []
+if DB_ENGINE in ('postgresql', 'mysql'):
+    for number, address in enumerate(config('DB_REPLICA_HOSTS', default='', cast=Csv()), start=1):
+        host, _, port = address.partition(':')
+        alias = f'replica{number}'
+        DATABASES[alias] = {
+            **DATABASES['default'],
+            'HOST': host,
+            'PORT': port or DATABASES['default']['PORT'],
+            'TEST': {'MIRROR': 'default'},
+        }
+        DATABASE_REPLICAS.append(alias)
+# Site databases: SITE_DATABASES=site=host[:port],... with the primary's name
+# and credentials. Attendance records and daily summaries of devices whose
+# Device.site is listed are stored there (see apps/core/sharding.py)
+SITE_DATABASES = {}
+if DB_ENGINE in ('postgresql', 'mysql'):
+    for entry in config('SITE_DATABASES', default='', cast=Csv()):
+        site, _, address = entry.partition('=')
+        host, _, port = address.partition(':')
+        alias = f'site_{site}'
+        DATABASES[alias] = {
+            **DATABASES['default'],
+            'HOST': host,
+            'PORT': port or DATABASES['default']['PORT'],
+        }
+        SITE_DATABASES[site] = alias
+DATABASE_ROUTERS = ['apps.core.sharding.SiteRouter', 'apps.core.db_router.ReplicaRouter']
+REPLICA_READ_VIEWS = config('REPLICA_READ_VIEWS', cast=Csv(), default=','.join([
+    'daily-attendance-report',
+    'attendance-record-download-attlog',
+    'iclock-transaction',
+    'admin:attendance_attendancerecord_changelist',
+    'admin:attendance_dailyattendance_changelist',
+]))
+REPLICA_PIN_SECONDS = config('REPLICA_PIN_SECONDS', default=5, cast=int)  # primary-only reads after a write
+REPLICA_RETRY_SECONDS = config('REPLICA_RETRY_SECONDS', default=30, cast=int)  # skip an unreachable replica
+
 # Cache Configuration
 CACHE_BACKEND = config('CACHE_BACKEND', default='dummy')
 
@@ -115,6 +196,8 @@ if CACHE_BACKEND == 'redis':
             }
         }
     }
+    # Session reads are served from redis, writes still go to the database
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
 else:
     CACHES = {
         'default': {
@@ -122,6 +205,10 @@ else:
         }
     }
 
+# Authentication cache (token and user lookups)
+AUTH_CACHE_TTL = config('AUTH_CACHE_TTL', default=300, cast=int)  # seconds (shared cache)
+AUTH_CACHE_LOCAL_TTL = config('AUTH_CACHE_LOCAL_TTL', default=10, cast=int)  # seconds (per worker)
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -165,8 +252,8 @@ AUTH_USER_MODEL = 'accounts.User'
 # REST Framework Configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
+        'apps.accounts.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -175,7 +262,7 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 50,
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
-        'rest_framework.filters.SearchFilter',
+        'apps.core.search.IndexedSearchFilter',  # related fields as subqueries, trigram indexes
         'rest_framework.filters.OrderingFilter',
     ],
 }
@@ -235,6 +322,73 @@ LOGGING = {
 PIN_WIDTH = config('PIN_WIDTH', default=9, cast=int)
 MAX_UPLOAD_SIZE = config('MAX_UPLOAD_SIZE', default=10485760, cast=int)  # 10MB
 
+# USB attendance log (x_attlog.dat) imports
+ATTLOG_IMPORT_DIR = config('ATTLOG_IMPORT_DIR', default=str(BASE_DIR / 'imports'))
+ATTLOG_IMPORT_BATCH = config('ATTLOG_IMPORT_BATCH', default=5000, cast=int)  # lines per batch
+ATTLOG_IMPORT_MAX_BYTES = config('ATTLOG_IMPORT_MAX_BYTES', default=1024 * 1024 * 1024, cast=int)  # API uploads
+ATTLOG_IMPORT_STALE = config('ATTLOG_IMPORT_STALE', default=600, cast=int)  # seconds without progress: job failed
+
+# Device PIN resolver cache
+PIN_CACHE_SIZE = config('PIN_CACHE_SIZE', default=100000, cast=int)  # in-process LRU entries
+PIN_CACHE_TTL = config('PIN_CACHE_TTL', default=3600, cast=int)  # seconds (with redis)
+PIN_CACHE_LOCAL_TTL = config('PIN_CACHE_LOCAL_TTL', default=30, cast=int)  # seconds (without a shared cache)
+PIN_CACHE_SHARED_TTL = config('PIN_CACHE_SHARED_TTL', default=86400, cast=int)  # seconds (redis)
+
+# Near-duplicate punch suppression (apps/devices/suppression.py); 0 disables
+PUNCH_SUPPRESS_SECONDS = config('PUNCH_SUPPRESS_SECONDS', default=0, cast=int)  # Device.punch_suppress_seconds overrides
+PUNCH_SUPPRESS_SCOPE = config('PUNCH_SUPPRESS_SCOPE', default='device')  # 'device', or 'site': devices sharing a location
+PUNCH_SUPPRESS_LOG = config('PUNCH_SUPPRESS_LOG', default=True, cast=bool)  # DeviceLog summary per upload
+PUNCH_SUPPRESS_INDEX_SIZE = config('PUNCH_SUPPRESS_INDEX_SIZE', default=100000, cast=int)  # in-process entries
+
+# Dashboard statistics
+STATS_RECONCILE_INTERVAL = config('STATS_RECONCILE_INTERVAL', default=300, cast=int)  # seconds
+DEVICE_OFFLINE_AFTER = config('DEVICE_OFFLINE_AFTER', default=600, cast=int)  # seconds without polling
+
+# Live feeds (Server-Sent Events)
+EVENTS_BACKLOG = config('EVENTS_BACKLOG', default=500, cast=int)  # events kept for Last-Event-ID resume
+SSE_HEARTBEAT = config('SSE_HEARTBEAT', default=15, cast=int)  # seconds
+SSE_MAX_DURATION = config('SSE_MAX_DURATION', default=300, cast=int)  # seconds before the client reconnects
+SSE_RETRY_MS = config('SSE_RETRY_MS', default=3000, cast=int)
+SSE_TICKET_TTL = config('SSE_TICKET_TTL', default=30, cast=int)  # seconds a stream ticket can be redeemed
+
+# Metrics (Prometheus scrape endpoint at /metrics)
+METRICS_ALLOWED_IPS = config('METRICS_ALLOWED_IPS', default='127.0.0.1,::1', cast=Csv())
+METRICS_FLUSH_INTERVAL = config('METRICS_FLUSH_INTERVAL', default=5, cast=float)  # seconds between redis flushes
+
+# Query budgets: requests running more queries than their view's budget
+# are logged. Keys are URL names; None disables the check for a view.
+SERVER_TIMING = config('SERVER_TIMING', default=True, cast=bool)
+QUERY_BUDGET_DEFAULT = config('QUERY_BUDGET_DEFAULT', default=10, cast=int)
+QUERY_BUDGETS = {
+    'iclock-cdata': 15,  # one batch per upload; PINs seen for the first time add a few
+    'attendance-record-import-attlog': None,  # a few queries per batch of ATTLOG_IMPORT_BATCH lines
+    'user-bulk-import': None,  # a few queries per batch of employees
+}
+
+# Sampling profiler (profiles are listed at /admin/profiles/)
+PROFILING_ENABLED = config('PROFILING_ENABLED', default=False, cast=bool)
+PROFILING_SECRET = config('PROFILING_SECRET', default='')  # X-Profile value accepted without login
+PROFILING_INTERVAL = config('PROFILING_INTERVAL', default=0.005, cast=float)  # seconds between samples
+PROFILING_DIR = config('PROFILING_DIR', default=str(BASE_DIR / 'profiles'))
+PROFILING_MAX_FILES = config('PROFILING_MAX_FILES', default=200, cast=int)
+# Path prefix -> fraction of requests to profile, e.g. "/iclock/cdata=0.01,/api/attendance/daily/report/=0.1"
+PROFILING_SAMPLE_RATES = {
+    prefix: float(rate)
+    for prefix, _, rate in (
+        item.partition('=') for item in config('PROFILING_SAMPLE_RATES', default='', cast=Csv())
+    )
+    if rate
+}
+
+# Device traffic capture for replay (see replay_capture command)
+CAPTURE_ENABLED = config('CAPTURE_ENABLED', default=False, cast=bool)
+CAPTURE_DIR = config('CAPTURE_DIR', default=str(BASE_DIR / 'captures'))
+CAPTURE_SAMPLE_RATE = config('CAPTURE_SAMPLE_RATE', default=1.0, cast=float)  # fraction of devices
+CAPTURE_MAX_BYTES = config('CAPTURE_MAX_BYTES', default=50 * 1024 * 1024, cast=int)  # per file, uncompressed
+CAPTURE_ROTATE_SECONDS = config('CAPTURE_ROTATE_SECONDS', default=3600, cast=int)
+CAPTURE_MAX_FILES = config('CAPTURE_MAX_FILES', default=100, cast=int)
+CAPTURE_SCRUB_KEY = config('CAPTURE_SCRUB_KEY', default='')  # PIN pseudonym key, defaults to SECRET_KEY
+
 # Email Configuration
 EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.console.EmailBackend')
 EMAIL_HOST = config('EMAIL_HOST', default='localhost')
@@ -5,24 +5,32 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
-from apps.devices.iclock_views import iclock_cdata, iclock_getrequest, iclock_devicecmd
+from apps.devices.iclock_views import iclock_cdata, iclock_getrequest, iclock_devicecmd, iclock_relay
 from apps.devices.iclock_data_api import department_api, employee_api, transaction_api
 from django.views.generic import TemplateView
+from apps.core.views import metrics_view, profile_download, profile_list
 
 urlpatterns = [
     # Admin panel
+    path('admin/profiles/', profile_list, name='profiles'),
+    path('admin/profiles/<str:name>', profile_download, name='profile-download'),
     path('admin/', admin.site.urls),
 
     # API endpoints
     path('api/auth/', include('apps.accounts.urls')),
     path('api/devices/', include('apps.devices.urls')),
     path('api/attendance/', include('apps.attendance.urls')),
+    path('api/stats/', include('apps.core.urls')),
+
+    # Monitoring
+    path('metrics', metrics_view, name='metrics'),
 
     # Frontend
     # iClock Protocol endpoints (for fingerprint devices)
     path('iclock/cdata', iclock_cdata, name='iclock-cdata'),
     path('iclock/getrequest', iclock_getrequest, name='iclock-getrequest'),
     path('iclock/devicecmd', iclock_devicecmd, name='iclock-devicecmd'),
+    path('iclock/relay', iclock_relay, name='iclock-relay'),
     path('iclock/data/department/', department_api, name='iclock-department'),
     path('iclock/data/employee/', employee_api, name='iclock-employee'),
     path('iclock/data/transaction/', transaction_api, name='iclock-transaction'),
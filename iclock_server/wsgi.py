@@ -1,8 +1,31 @@
 """
 WSGI config for iClock Server (Linux Edition)
+
+`application` sends the iClock protocol paths (DEVICE_PATHS) to
+`device_application` and everything else to the full Django stack.
+The device handler runs only ICLOCK_MIDDLEWARE: no sessions, CSRF, auth,
+messages or CORS, which devices never use. It resolves against the small
+ICLOCK_URLCONF. `device_application` can also run as its own gunicorn pool
+(deploy/gunicorn-devices.conf.py), so device polls and the admin/API do
+not compete for workers.
 """
 import os
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'iclock_server.settings')
-application = get_wsgi_application()
+django_application = get_wsgi_application()
+
+from django.conf import settings  # noqa: E402  (configured by get_wsgi_application)
+from iclock_server.handlers import DeviceWSGIHandler  # noqa: E402
+from iclock_server.iclock_urls import DEVICE_PATHS  # noqa: E402
+
+device_application = DeviceWSGIHandler()
+
+
+def dispatch(environ, start_response):
+    if environ.get('PATH_INFO') in DEVICE_PATHS:
+        return device_application(environ, start_response)
+    return django_application(environ, start_response)
+
+
+application = dispatch if settings.ICLOCK_DISPATCH else django_application
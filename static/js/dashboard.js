@@ -80,113 +80,151 @@
         }
     }
 
-    // Load statistics
+    // Statistics are for admins and managers; userData saved before
+    // is_manager was sent only has the role
+    const canViewStats = userData.is_manager !== undefined
+        ? userData.is_manager
+        : ['admin', 'manager'].includes(userData.role);
+
+    // Load statistics (single request served from cached counters)
     async function loadStats() {
         try {
-            // Load total users
-            const usersResponse = await apiFetch('/api/auth/users/');
-            if (usersResponse && usersResponse.ok) {
-                const usersData = await usersResponse.json();
-                document.getElementById('totalUsers').textContent = usersData.count || usersData.length || 0;
-            }
-
-            // Load total devices
-            const devicesResponse = await apiFetch('/api/devices/');
-            if (devicesResponse && devicesResponse.ok) {
-                const devicesData = await devicesResponse.json();
-                document.getElementById('totalDevices').textContent = devicesData.count || devicesData.results?.length || 0;
-            }
-
-            // Load today's attendance
-            const today = new Date().toISOString().split('T')[0];
-            const attendanceResponse = await apiFetch(`/api/attendance/daily/?date=${today}`);
-            if (attendanceResponse && attendanceResponse.ok) {
-                const attendanceData = await attendanceResponse.json();
-                document.getElementById('todayAttendance').textContent = attendanceData.count || attendanceData.results?.length || 0;
-            }
-
-            // Load pending leaves
-            const leavesResponse = await apiFetch('/api/attendance/leaves/?status=pending');
-            if (leavesResponse && leavesResponse.ok) {
-                const leavesData = await leavesResponse.json();
-                document.getElementById('pendingLeaves').textContent = leavesData.count || leavesData.results?.length || 0;
+            const response = await apiFetch('/api/stats/');
+            if (response && response.status === 403) {
+                hideStats();
+            } else if (response && response.ok) {
+                const stats = await response.json();
+                document.getElementById('totalUsers').textContent = stats.total_users;
+                document.getElementById('totalDevices').textContent = stats.online_devices;
+                document.getElementById('todayAttendance').textContent = stats.present_today;
+                document.getElementById('lateToday').textContent = stats.late_today;
+                document.getElementById('pendingLeaves').textContent = stats.pending_leaves;
             }
         } catch (error) {
             console.error('Error loading statistics:', error);
         }
     }
 
-    // Load recent attendance
-    async function loadRecentAttendance() {
-        try {
-            const response = await apiFetch('/api/attendance/records/?limit=10');
-            if (response && response.ok) {
-                const data = await response.json();
-                const records = data.results || data;
-                const tbody = document.getElementById('recentAttendance');
-
-                if (records.length === 0) {
-                    tbody.innerHTML = `
-                        <tr>
-                            <td colspan="5" style="text-align: center; padding: 2rem; color: var(--gray-500);">
-                                No attendance records found
-                            </td>
-                        </tr>
-                    `;
-                    return;
-                }
+    let statsTimer = null;
 
-                tbody.innerHTML = records.map(record => {
-                    const date = new Date(record.timestamp);
-                    const time = date.toLocaleTimeString('id-ID', {
-                        hour: '2-digit',
-                        minute: '2-digit'
-                    });
-
-                    const verifyTypes = {
-                        0: 'Password',
-                        1: 'Fingerprint',
-                        2: 'Card',
-                        3: 'Face',
-                        4: 'Iris',
-                        15: 'Palm'
-                    };
-
-                    const verifyCodes = {
-                        0: { text: 'Check In', class: 'badge-success' },
-                        1: { text: 'Check Out', class: 'badge-danger' },
-                        2: { text: 'Break Out', class: 'badge-warning' },
-                        3: { text: 'Break In', class: 'badge-info' },
-                        4: { text: 'OT In', class: 'badge-info' },
-                        5: { text: 'OT Out', class: 'badge-info' }
-                    };
-
-                    const verifyCode = verifyCodes[record.verify_code] || { text: 'Unknown', class: 'badge-info' };
-
-                    return `
-                        <tr>
-                            <td>
-                                <div style="font-weight: 500;">${record.user?.username || 'Unknown'}</div>
-                                <div style="font-size: 0.75rem; color: var(--gray-500);">${record.user?.employee_id || '-'}</div>
-                            </td>
-                            <td>${record.device?.name || 'Unknown Device'}</td>
-                            <td>${time}</td>
-                            <td>${verifyTypes[record.verify_type] || 'Unknown'}</td>
-                            <td><span class="badge ${verifyCode.class}">${verifyCode.text}</span></td>
-                        </tr>
-                    `;
-                }).join('');
-            }
-        } catch (error) {
-            console.error('Error loading recent attendance:', error);
-            document.getElementById('recentAttendance').innerHTML = `
+    function hideStats() {
+        document.querySelector('.stats-grid').style.display = 'none';
+        clearInterval(statsTimer);
+    }
+
+    // Recent attendance (live feed over Server-Sent Events)
+    const MAX_RECENT = 10;
+    const STREAM_RETRY_MS = 3000;
+    const recentRecords = [];
+
+    const verifyTypes = {
+        0: 'Password',
+        1: 'Fingerprint',
+        2: 'Card',
+        3: 'Face',
+        4: 'Iris',
+        15: 'Palm'
+    };
+
+    const verifyCodes = {
+        0: { text: 'Check In', class: 'badge-success' },
+        1: { text: 'Check Out', class: 'badge-danger' },
+        2: { text: 'Break Out', class: 'badge-warning' },
+        3: { text: 'Break In', class: 'badge-info' },
+        4: { text: 'OT In', class: 'badge-info' },
+        5: { text: 'OT Out', class: 'badge-info' }
+    };
+
+    function renderRecentAttendance() {
+        const tbody = document.getElementById('recentAttendance');
+
+        if (recentRecords.length === 0) {
+            tbody.innerHTML = `
                 <tr>
-                    <td colspan="5" style="text-align: center; padding: 2rem; color: var(--danger-color);">
-                        Error loading data
+                    <td colspan="5" style="text-align: center; padding: 2rem; color: var(--gray-500);">
+                        No attendance records found
                     </td>
                 </tr>
             `;
+            return;
         }
+
+        tbody.innerHTML = recentRecords.map(record => {
+            const date = new Date(record.timestamp);
+            const time = date.toLocaleTimeString('id-ID', {
+                hour: '2-digit',
+                minute: '2-digit'
+            });
+
+            const verifyCode = verifyCodes[record.verify_code] || { text: 'Unknown', class: 'badge-info' };
+
+            return `
+                <tr>
+                    <td>
+                        <div style="font-weight: 500;">${record.user_name || 'Unknown'}</div>
+                        <div style="font-size: 0.75rem; color: var(--gray-500);">${record.employee_id || '-'}</div>
+                    </td>
+                    <td>${record.device_name || 'Unknown Device'}</td>
+                    <td>${time}</td>
+                    <td>${verifyTypes[record.verify_type] || 'Unknown'}</td>
+                    <td><span class="badge ${verifyCode.class}">${verifyCode.text}</span></td>
+                </tr>
+            `;
+        }).join('');
+    }
+
+    function addRecentRecord(record) {
+        // Seeded punches can be re-sent after a reconnect
+        if (recentRecords.some(existing => existing.id === record.id)) {
+            return;
+        }
+        recentRecords.unshift(record);
+        recentRecords.length = Math.min(recentRecords.length, MAX_RECENT);
+    }
+
+    let lastEventId = null;
+
+    async function connectAttendanceStream() {
+        // The stream takes a single-use ticket instead of the API token, so
+        // every (re)connect asks for a new one and resumes from the last event
+        let ticket;
+        try {
+            const response = await apiFetch('/api/attendance/stream/ticket/', { method: 'POST' });
+            if (!response || !response.ok) {
+                throw new Error(response ? `HTTP ${response.status}` : 'no response');
+            }
+            ticket = (await response.json()).ticket;
+        } catch (error) {
+            console.error('Attendance stream ticket failed, retrying...', error);
+            setTimeout(connectAttendanceStream, STREAM_RETRY_MS);
+            return;
+        }
+
+        let url = `/api/attendance/stream/?ticket=${encodeURIComponent(ticket)}`;
+        if (lastEventId !== null) {
+            url += `&last_event_id=${encodeURIComponent(lastEventId)}`;
+        }
+        const source = new EventSource(url);
+
+        source.addEventListener('punch', function (e) {
+            if (e.lastEventId) {
+                lastEventId = e.lastEventId;
+            }
+            addRecentRecord(JSON.parse(e.data));
+            renderRecentAttendance();
+        });
+
+        source.addEventListener('ready', function (e) {
+            lastEventId = e.lastEventId;
+            renderRecentAttendance();
+        });
+
+        source.onerror = function () {
+            // The ticket is spent: EventSource's own retry would be refused
+            source.close();
+            console.error('Attendance stream disconnected, retrying...');
+            setTimeout(connectAttendanceStream, STREAM_RETRY_MS);
+        };
     }
 
     // Logout function
@@ -207,13 +245,14 @@
 
     // Initialize dashboard
     loadUserInfo();
-    loadStats();
-    loadRecentAttendance();
+    connectAttendanceStream();
 
-    // Refresh stats every 30 seconds
-    setInterval(loadStats, 30000);
-
-    // Refresh attendance every 10 seconds
-    setInterval(loadRecentAttendance, 10000);
+    if (canViewStats) {
+        loadStats();
+        // Refresh stats every 30 seconds
+        statsTimer = setInterval(loadStats, 30000);
+    } else {
+        hideStats();
+    }
 
 })();